@@ -1,48 +1,185 @@
-from flask import Flask, render_template, send_file, request, abort
+from flask import Flask, Response, render_template, send_file, request, abort
 import boto3
+from botocore.config import Config
+from botocore.exceptions import ClientError
+from werkzeug.utils import safe_join
+from datetime import datetime, timezone
 import io
 import os
 import sys
+import mimetypes
+
+from disk_cache import ObjectCache
+from previews import PreviewCache, parse_size
 
 app = Flask(__name__)
 
-# Настройте клиента boto3 для работы с Yandex Storage
+DATASETS_DIR = '/app/datasets'   # проверьте, что именно сюда монтируется ./datasets
+# Превью не меняются (оригиналы в хранилище не перезаписываются), поэтому браузер может долго их не перепроверять
+PREVIEW_MAX_AGE = int(os.getenv('PREVIEW_MAX_AGE', '86400'))
+previews = PreviewCache(
+    root=os.getenv('PREVIEW_CACHE_DIR', '/app/cache/previews'),
+    max_bytes=int(float(os.getenv('PREVIEW_CACHE_MAX_MB', '1024')) * 1024 * 1024),
+    quality=int(os.getenv('PREVIEW_QUALITY', '80')),
+)
+# Оригиналы браузер перепроверяет чаще: повторная проверка стоит ответа 304 без тела
+ORIGINAL_MAX_AGE = int(os.getenv('ORIGINAL_MAX_AGE', '3600'))
+# Размер чанка при потоковой передаче объекта из S3 клиенту
+STREAM_CHUNK_BYTES = int(os.getenv('STREAM_CHUNK_KB', '256')) * 1024
+# Локальные копии часто запрашиваемых оригиналов (повторный просмотр не идёт в S3)
+originals = ObjectCache(
+    root=os.getenv('OBJECT_CACHE_DIR', '/app/cache/objects'),
+    max_bytes=int(float(os.getenv('OBJECT_CACHE_MAX_MB', '2048')) * 1024 * 1024),
+    max_object_bytes=int(float(os.getenv('OBJECT_CACHE_MAX_OBJECT_MB', '64')) * 1024 * 1024),
+)
+
+# Клиент boto3 для Yandex Storage: один на процесс (потокобезопасен), пул соединений рассчитан
+# на число потоков сервера, которые одновременно отдают изображения; при троттлинге — adaptive-повторы
 s3_client = boto3.client(
     's3',
-    endpoint_url='https://storage.yandexcloud.net',
-    region_name='ru-central1',
+    endpoint_url=os.getenv('S3_ENDPOINT_URL', 'https://storage.yandexcloud.net'),
+    region_name=os.getenv('S3_REGION', 'ru-central1'),
+    config=Config(
+        max_pool_connections=int(os.getenv('S3_MAX_POOL_CONNECTIONS', '32')),
+        retries={
+            'max_attempts': int(os.getenv('S3_MAX_ATTEMPTS', '5')),
+            'mode': os.getenv('S3_RETRY_MODE', 'adaptive'),
+        },
+        connect_timeout=float(os.getenv('S3_CONNECT_TIMEOUT', '5')),
+        read_timeout=float(os.getenv('S3_READ_TIMEOUT', '30')),
+        tcp_keepalive=True,
+    ),
 )
 
 @app.route('/')
 def home():
     return render_template('index.html')
 
+def send_preview(path):
+    # send_file с путём отдаёт файл потоком, с ETag/Last-Modified, ответом 304 и поддержкой Range
+    return send_file(path, mimetype='image/jpeg', conditional=True, etag=True, max_age=PREVIEW_MAX_AGE)
+
+def object_meta(key, response):
+    # Yandex Object Storage часто хранит объекты как binary/octet-stream — тогда тип определяем по расширению
+    content_type = response.get('ContentType')
+    if not content_type or content_type in ('binary/octet-stream', 'application/octet-stream'):
+        content_type = mimetypes.guess_type(key)[0] or 'application/octet-stream'
+    last_modified = response.get('LastModified')
+    return {
+        'etag': (response.get('ETag') or '').strip('"') or None,
+        'last_modified': last_modified.timestamp() if last_modified else None,
+        'content_type': content_type,
+    }
+
+def set_validators(rv, meta):
+    if meta.get('etag'):
+        rv.set_etag(meta['etag'])
+    if meta.get('last_modified'):
+        rv.last_modified = datetime.fromtimestamp(meta['last_modified'], tz=timezone.utc)
+    rv.cache_control.public = True
+    rv.cache_control.max_age = ORIGINAL_MAX_AGE
+    return rv
+
+def send_original(bucket, key):
+    """
+    Оригинал объекта: из локального кэша (send_file — ETag/Last-Modified объекта S3, 304, Range)
+    или потоком из S3 чанками. Условные заголовки и Range передаются в S3, поэтому 304 и 206 не
+    требуют скачивания всего объекта; полный ответ по пути записывается в кэш.
+    """
+    cached = originals.get(bucket, key)
+    if cached is not None:
+        path, meta = cached
+        return send_file(path, mimetype=meta['content_type'], conditional=True,
+                         etag=meta['etag'] or True, max_age=ORIGINAL_MAX_AGE)
+
+    params = {'Bucket': bucket, 'Key': key}
+    if request.range is not None:
+        params['Range'] = request.headers['Range']
+    if request.if_none_match:
+        params['IfNoneMatch'] = request.headers['If-None-Match']
+    elif request.if_modified_since is not None:
+        params['IfModifiedSince'] = request.if_modified_since
+    try:
+        response = s3_client.get_object(**params)
+    except ClientError as e:
+        status = e.response.get('ResponseMetadata', {}).get('HTTPStatusCode')
+        if status == 304:
+            headers = e.response['ResponseMetadata'].get('HTTPHeaders', {})
+            return set_validators(Response(status=304), {'etag': headers.get('etag', '').strip('"') or None})
+        if status == 416:
+            abort(416)
+        raise
+
+    meta = object_meta(key, response)
+    body = response['Body']
+    chunks = body.iter_chunks(STREAM_CHUNK_BYTES)
+    partial = response.get('ContentRange') is not None
+    if not partial and response['ContentLength'] <= originals.max_object_bytes:
+        chunks = originals.write_through(bucket, key, meta, chunks)
+    rv = Response(chunks, status=206 if partial else 200, mimetype=meta['content_type'], direct_passthrough=True)
+    rv.call_on_close(body.close)
+    rv.content_length = response['ContentLength']
+    if partial:
+        rv.headers['Content-Range'] = response['ContentRange']
+    rv.accept_ranges = 'bytes'
+    return set_validators(rv, meta)
+
 @app.route('/get_image')
 def get_image():
-    # Получаем параметры запроса: bucket и key
+    # Получаем параметры запроса: bucket, key и размер (marker, card или full)
     bucket = request.args.get('bucket', 'remote-sensing-storage')
     key = request.args.get('key')
     if not key:
         abort(400, "Missing key parameter")
     try:
-        response = s3_client.get_object(Bucket=bucket, Key=key)
-        data = response['Body'].read()
-        # Для простоты считаем, что это jpeg; при необходимости определите MIME‑тип динамически
-        return send_file(io.BytesIO(data), mimetype='image/jpeg')
-    except Exception as e:
+        size = parse_size(request.args.get('size'))
+    except ValueError as e:
+        abort(400, str(e))
+    try:
+        if size == 'full':
+            return send_original(bucket, key)
+
+        def open_source():
+            cached = originals.get(bucket, key)
+            if cached is not None:
+                return cached[0]
+            return io.BytesIO(s3_client.get_object(Bucket=bucket, Key=key)['Body'].read())
+        return send_preview(previews.get_or_create(f's3://{bucket}/{key}', size, open_source))
+    except ClientError as e:
         print(e)
-        abort(404)
+        status = e.response.get('ResponseMetadata', {}).get('HTTPStatusCode')
+        abort(404 if status in (403, 404) else 502)
+    except OSError as e:
+        # Объект не удалось декодировать как изображение
+        print(e)
+        abort(415)
 
 @app.route('/local_image/<path:filename>')
 def local_image(filename):
-    base = '/app/datasets'   # проверьте, что именно сюда монтируется ./datasets
-    filepath = os.path.join(base, filename)
+    filepath = safe_join(DATASETS_DIR, filename)
+    try:
+        size = parse_size(request.args.get('size'))
+    except ValueError as e:
+        abort(400, str(e))
     # выведем в логи, что пробует отдать Flask
     print(f"[DEBUG] local_image(): filename='{filename}' → filepath='{filepath}'", file=sys.stderr)
-    if not os.path.isfile(filepath):
+    if filepath is None or not os.path.isfile(filepath):
         print(f"[DEBUG]     not found on disk", file=sys.stderr)
         abort(404)
-    return send_file(filepath)
+    if size != 'full':
+        st = os.stat(filepath)
+        # Изменённый файл получает новое превью: в идентификатор входят размер и время изменения
+        source_id = f'{filepath}|{st.st_size}|{st.st_mtime_ns}'
+        try:
+            return send_preview(previews.get_or_create(source_id, size, lambda: filepath))
+        except Exception as e:
+            print(e)
+            abort(415)
+    return send_file(filepath, conditional=True)
+
+@app.route('/cache-stats')
+def cache_stats():
+    return {'previews': previews.stats(), 'originals': originals.stats()}
 
 
 if __name__ == '__main__':
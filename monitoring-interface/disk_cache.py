@@ -0,0 +1,160 @@
+import os
+import sys
+import json
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Iterable, Iterator, Optional, Tuple
+
+
+class DiskLRU:
+    """
+    Файлы на диске, ограниченные по суммарному размеру: при превышении max_bytes удаляются
+    давно запрошенные (LRU). Файлы переживают перезапуск: при создании учитываются уже лежащие
+    в root файлы в порядке времени последнего обращения (atime; mtime не трогаем — от него
+    зависят Last-Modified и ETag, которые считает send_file).
+
+    :param root: Директория кэша.
+    :param max_bytes: Максимальный суммарный размер файлов.
+    """
+    # Служебные файлы рядом с данными: метаданные не учитываются в размере и удаляются вместе с файлом
+    meta_suffix = '.meta'
+
+    def __init__(self, root: str, max_bytes: int):
+        self.root = root
+        self.max_bytes = max(0, int(max_bytes))
+        self._entries: "OrderedDict[str, int]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(root, exist_ok=True)
+        self._load_existing()
+
+    def _load_existing(self) -> None:
+        files = []
+        for dirpath, _, filenames in os.walk(self.root):
+            for name in filenames:
+                path = os.path.join(dirpath, name)
+                if name.endswith('.tmp'):
+                    os.remove(path)
+                elif not name.endswith(self.meta_suffix):
+                    st = os.stat(path)
+                    files.append((st.st_atime, path, st.st_size))
+        for _, path, size in sorted(files):
+            self._entries[path] = size
+            self.total_bytes += size
+        self._evict()
+
+    def path_for(self, source_id: str, suffix: str = '') -> str:
+        digest = hashlib.sha1(source_id.encode('utf-8')).hexdigest()
+        return os.path.join(self.root, digest[:2], f'{digest}{suffix}')
+
+    def tmp_path(self, path: str) -> str:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        return f'{path}.{threading.get_ident()}.tmp'
+
+    def touch(self, path: str) -> bool:
+        """True, если файл есть в кэше; отмечает его как недавно использованный."""
+        with self._lock:
+            if path not in self._entries:
+                return False
+            self._entries.move_to_end(path)
+        try:
+            os.utime(path, ns=(time.time_ns(), os.stat(path).st_mtime_ns))
+        except FileNotFoundError:
+            with self._lock:
+                self.total_bytes -= self._entries.pop(path, 0)
+            return False
+        return True
+
+    def register(self, path: str) -> None:
+        """Учитывает записанный файл и при переполнении вытесняет самые давние (кроме только что добавленного)."""
+        size = os.path.getsize(path)
+        with self._lock:
+            self.total_bytes += size - self._entries.pop(path, 0)
+            self._entries[path] = size
+        self._evict()
+
+    def _evict(self) -> None:
+        evicted = []
+        with self._lock:
+            while self.total_bytes > self.max_bytes and len(self._entries) > 1:
+                old_path, old_size = self._entries.popitem(last=False)
+                self.total_bytes -= old_size
+                evicted.append(old_path)
+        for old_path in evicted:
+            for path in (old_path, old_path + self.meta_suffix):
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                except OSError as e:
+                    print(f'[cache] Не удалось удалить {path}: {e}', file=sys.stderr)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'files': len(self._entries),
+                'bytes': self.total_bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+            }
+
+
+class ObjectCache(DiskLRU):
+    """
+    Локальные копии часто запрашиваемых объектов S3 вместе с их метаданными (ETag, Last-Modified,
+    Content-Type). Объект попадает в кэш, пока его тело потоком передаётся клиенту (write_through),
+    поэтому ни прокси, ни кэш не держат объект в памяти целиком.
+
+    :param max_object_bytes: Объекты крупнее не кэшируются (только проксируются).
+    """
+    def __init__(self, root: str, max_bytes: int, max_object_bytes: int):
+        super().__init__(root, max_bytes)
+        self.max_object_bytes = max_object_bytes
+
+    def get(self, bucket: str, key: str) -> Optional[Tuple[str, dict]]:
+        """Путь к локальной копии и метаданные объекта или None."""
+        path = self.path_for(f's3://{bucket}/{key}')
+        if not self.touch(path):
+            with self._lock:
+                self.misses += 1
+            return None
+        try:
+            with open(path + self.meta_suffix) as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return None
+        with self._lock:
+            self.hits += 1
+        return path, meta
+
+    def write_through(self, bucket: str, key: str, meta: dict, chunks: Iterable[bytes]) -> Iterator[bytes]:
+        """
+        Отдаёт чанки дальше и одновременно пишет их во временный файл; если тело передано полностью,
+        файл становится копией в кэше (mtime = Last-Modified объекта). При обрыве соединения копия отбрасывается.
+        """
+        path = self.path_for(f's3://{bucket}/{key}')
+        tmp_path = self.tmp_path(path)
+        complete = False
+        try:
+            with open(tmp_path, 'wb') as f:
+                for chunk in chunks:
+                    f.write(chunk)
+                    yield chunk
+            with open(tmp_path + self.meta_suffix, 'w') as f:
+                json.dump(meta, f)
+            if meta.get('last_modified'):
+                os.utime(tmp_path, (time.time(), meta['last_modified']))
+            os.replace(tmp_path + self.meta_suffix, path + self.meta_suffix)
+            os.replace(tmp_path, path)
+            complete = True
+        finally:
+            for leftover in (tmp_path, tmp_path + self.meta_suffix):
+                if os.path.exists(leftover):
+                    os.remove(leftover)
+        if complete:
+            self.register(path)
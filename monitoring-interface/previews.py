@@ -0,0 +1,84 @@
+import os
+import threading
+from typing import BinaryIO, Callable, Optional, Union
+
+from PIL import Image, ImageOps
+
+from disk_cache import DiskLRU
+
+# Размеры превью (длинная сторона, px): marker — изображение во всплывающем окне маркера на карте,
+# card — карточка в списке результатов; full — оригинал без изменений
+PREVIEW_SIZES = {
+    'marker': 256,
+    'card': 512,
+}
+
+
+class PreviewCache(DiskLRU):
+    """
+    Дисковый кэш уменьшенных копий изображений (JPEG), ограниченный по суммарному размеру (см. DiskLRU).
+    Превью создаётся при первом запросе и дальше отдаётся с диска.
+
+    :param root: Директория кэша.
+    :param max_bytes: Максимальный суммарный размер превью.
+    :param quality: Качество JPEG.
+    """
+    def __init__(self, root: str, max_bytes: int, quality: int = 80):
+        super().__init__(root, max_bytes)
+        self.quality = quality
+        self._key_locks = {}
+
+    def get_or_create(self, source_id: str, size: str,
+                      open_source: Callable[[], Union[str, BinaryIO]]) -> str:
+        """
+        Возвращает путь к превью размера size для источника source_id (например, s3://bucket/key).
+        open_source вызывается только при промахе и возвращает путь к файлу или файловый объект оригинала.
+        """
+        if size not in PREVIEW_SIZES:
+            raise ValueError(f'Неизвестный размер превью: {size}')
+        path = self.path_for(f'{size}|{source_id}', '.jpg')
+        if self._hit(path):
+            return path
+        # Один и тот же оригинал не уменьшаем одновременно в нескольких потоках
+        with self._lock:
+            key_lock = self._key_locks.setdefault(path, threading.Lock())
+        try:
+            with key_lock:
+                if self._hit(path):
+                    return path
+                with self._lock:
+                    self.misses += 1
+                self._render(open_source(), PREVIEW_SIZES[size], path)
+                self.register(path)
+        finally:
+            with self._lock:
+                self._key_locks.pop(path, None)
+        return path
+
+    def _hit(self, path: str) -> bool:
+        if not self.touch(path):
+            return False
+        with self._lock:
+            self.hits += 1
+        return True
+
+    def _render(self, source: Union[str, BinaryIO], max_side: int, path: str) -> None:
+        tmp_path = self.tmp_path(path)
+        try:
+            with Image.open(source) as img:
+                # Для JPEG декодируем сразу с уменьшением (DCT-масштабирование) — в разы быстрее полного декодирования
+                img.draft('RGB', (max_side, max_side))
+                img = ImageOps.exif_transpose(img)
+                img.thumbnail((max_side, max_side), Image.Resampling.LANCZOS)
+                img.convert('RGB').save(tmp_path, 'JPEG', quality=self.quality, optimize=True)
+            os.replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+def parse_size(value: Optional[str]) -> str:
+    """Размер из параметра запроса: marker, card или full (по умолчанию)."""
+    size = (value or 'full').lower()
+    if size != 'full' and size not in PREVIEW_SIZES:
+        raise ValueError(f'Неизвестный размер: {value}')
+    return size
@@ -289,6 +289,9 @@ function displayResults(results) {
       const safePath = encodeURI(rel);
       imageUrl = `http://127.0.0.1:8333/local_image/${safePath}`;
     }
+    // Во всплывающем окне и карточке — превью, в полноэкранном просмотре — оригинал
+    const markerUrl = withSize(imageUrl, "marker");
+    const cardUrl = withSize(imageUrl, "card");
 
     console.log(`Используем изображение: ${imageUrl}`);
 
@@ -296,7 +299,7 @@ function displayResults(results) {
     const marker = L.marker([result.lat, result.lon]).addTo(map);
     const popupContent = `
       <div>
-        <img src="${imageUrl}" alt="result" onclick="openModal('${imageUrl}')" /><br>
+        <img src="${markerUrl}" alt="result" loading="lazy" onclick="openModal('${imageUrl}')" /><br>
         <div style="border:1px solid #444; padding:4px; background:#333; border-radius:4px;">
           <div style="margin-bottom:4px;"><strong>⭐ Score:</strong> ${result.score}</div>
           ${
@@ -327,7 +330,8 @@ function displayResults(results) {
     itemDiv.onclick = () => jumpToMarker(index);
 
     const imgEl = document.createElement("img");
-    imgEl.src = imageUrl;
+    imgEl.src = cardUrl;
+    imgEl.loading = "lazy";
 
     const infoDiv = document.createElement("div");
     infoDiv.classList.add("result-info");
@@ -363,6 +367,10 @@ function displayResults(results) {
 }
 
 
+function withSize(url, size) {
+  return url + (url.includes("?") ? "&" : "?") + `size=${size}`;
+}
+
 function jumpToMarker(index) {
   const mk = markers[index];
   if (!mk) return;
@@ -1,4 +1,5 @@
 # app.py
+import os
 import logging
 
 # Configure logging before imports
@@ -6,22 +7,114 @@ logging.basicConfig(
     level=logging.INFO,
     format="%(asctime)s %(levelname)s %(name)s — %(message)s",
 )
-logging.getLogger("src.retrieval").setLevel(logging.INFO)
+# LOG_LEVEL=DEBUG включает выборочные поштучные сообщения конвейера (см. src.metrics.debug_sampled)
+logging.getLogger("src").setLevel(os.getenv("LOG_LEVEL", "INFO").upper())
 
-import os
-from fastapi import FastAPI, BackgroundTasks
+import time
+import uuid
+import base64
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from fastapi import APIRouter, FastAPI, HTTPException, Request, UploadFile, File, Form
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
-from typing import Optional, List
-from src import ImageQdrantIndexer, RemoteCLIP, ImageFolderCleaner
+from fastapi.responses import JSONResponse, Response
+from starlette.concurrency import run_in_threadpool
+from pydantic import BaseModel, ValidationError
+from typing import Optional, List, Union
+from src import MicroBatchEncoder, IngestionRunner, IngestionJobManager
+from src.components import (BASE_DIR, QDRANT_PATH, LazyComponent, build_embedder, build_cleaner, build_indexer,
+                            embedder_model_id)
+from src.embedding.model import load_image
+from src.metrics import observe_request, render_metrics, timed
+from src.retrieval.utils import make_point_id
+
+logger = logging.getLogger("app")
+
+# Роль экземпляра: "query" — только поиск, "ingest" — только задачи индексации, "both" — всё вместе
+SERVICE_ROLE = os.getenv("SERVICE_ROLE", "both")
+if SERVICE_ROLE not in ("query", "ingest", "both"):
+    raise ValueError(f"Неизвестная роль сервиса: {SERVICE_ROLE}")
+SERVES_QUERIES = SERVICE_ROLE in ("query", "both")
+SERVES_INGEST = SERVICE_ROLE in ("ingest", "both")
+# Где выполняется индексация: "process" — отдельный процесс со своей моделью (не мешает запросам),
+# "thread" — фоновый поток этого процесса
+INGEST_MODE = os.getenv("INGEST_MODE", "process")
+if QDRANT_PATH and INGEST_MODE != "thread":
+    # Каталог встроенного Qdrant может открыть только один процесс — индексация идёт в этом же
+    logger.warning("[app] QDRANT_PATH задан: индексация выполняется в процессе сервиса (INGEST_MODE=thread)")
+    INGEST_MODE = "thread"
+# Фоновый прогрев при запуске: компоненты роли создаются сразу, а не при первом запросе
+WARMUP = os.getenv("WARMUP", "1") == "1"
+# Загрузить модель при импорте модуля: с gunicorn --preload веса загружаются один раз в мастер-процессе
+# и делятся с воркерами copy-on-write (только на CPU — CUDA после fork не работает)
+PRELOAD_MODEL = os.getenv("PRELOAD_MODEL", "0") == "1"
+
+# Компоненты создаются при первом обращении или фоновым прогревом (см. warm_up):
+# реплике только для поиска не нужен очиститель, а поиску похожих (/search/similar) — модель
+IN_PROCESS_INGEST = SERVES_INGEST and INGEST_MODE == "thread"
+embedder = LazyComponent("embedder", build_embedder)
+# Очиститель дубликатов нужен только при индексации в этом же процессе
+cleaner = LazyComponent("cleaner", build_cleaner) if IN_PROCESS_INGEST else None
+indexer = LazyComponent("indexer", lambda: build_indexer(
+    # Индексатору модель нужна только для кодирования: model_id (ключ кэша запросов) известен без загрузки
+    embedder.proxy(model_id=embedder_model_id()),
+    cleaner.get() if cleaner is not None else None,
+))
+# Компоненты, без которых экземпляр не готов принимать запросы своей роли
+required_components = []
+if SERVES_QUERIES or IN_PROCESS_INGEST:
+    required_components += [embedder, indexer]
+if cleaner is not None:
+    required_components.append(cleaner)
+if PRELOAD_MODEL and embedder in required_components:
+    embedder.get()
+
+ingestion, jobs = None, None
+if SERVES_INGEST:
+    ingestion = IngestionRunner(
+        mode=INGEST_MODE,
+        indexer=indexer.proxy() if INGEST_MODE == "thread" else None,
+        nice=int(os.getenv("INGEST_NICE", "10")),
+        torch_threads=int(os.getenv("INGEST_TORCH_THREADS", "0")),
+        max_workers=int(os.getenv("JOBS_MAX_CONCURRENT", "1")),
+    )
+    # Задачи индексации: состояние и контрольные точки в JOBS_DIR переживают перезапуск сервиса
+    jobs = IngestionJobManager(
+        ingestion,
+        jobs_dir=os.getenv("JOBS_DIR", os.path.join(BASE_DIR, "jobs")),
+        checkpoint_interval=float(os.getenv("JOBS_CHECKPOINT_INTERVAL", "5")),
+        max_attempts=int(os.getenv("JOBS_MAX_ATTEMPTS", "3")),
+    )
+
+# Пул инференса: все вызовы модели из обработчиков идут через него, поэтому одновременно
+# выполняется не больше INFERENCE_WORKERS батчей, а event loop не блокируется
+inference_executor = ThreadPoolExecutor(
+    max_workers=int(os.getenv("INFERENCE_WORKERS", "1")),
+    thread_name_prefix="inference",
+)
 
-# Base directory
-BASE_DIR = "./"
+# Одновременные текстовые запросы кодируются одним батчем
+# (попадание в кэш проверяется в обработчике до постановки в очередь)
+text_encoder = MicroBatchEncoder(
+    lambda texts: indexer.get().encode_texts(texts, record_stats=False),
+    max_batch_size=int(os.getenv("TEXT_BATCH_MAX_SIZE", "32")),
+    max_wait_ms=float(os.getenv("TEXT_BATCH_WINDOW_MS", "5")),
+    executor=inference_executor,
+)
+# Загруженные изображения декодируются в пуле потоков обработчика, кодируются — общими батчами
+image_encoder = MicroBatchEncoder(
+    lambda images: indexer.get().encode_images(images),
+    max_batch_size=int(os.getenv("IMAGE_BATCH_MAX_SIZE", "16")),
+    max_wait_ms=float(os.getenv("IMAGE_BATCH_WINDOW_MS", "10")),
+    executor=inference_executor,
+)
 
-# Initialize components
-embedder = RemoteCLIP(ckpt_path=os.path.join(BASE_DIR, "weights/RemoteCLIP-ViT-B-32.pt"))
-cleaner = ImageFolderCleaner(deletion_threshold=60)
-retriver = ImageQdrantIndexer(embedder, cleaner)
+# Максимальное число запросов в /search/batch
+MAX_BATCH_QUERIES = int(os.getenv("MAX_BATCH_QUERIES", "100"))
+# Максимальный размер изображения для /search/image и размер читаемого куска
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_MB", "32")) * 1024 * 1024
+UPLOAD_CHUNK_BYTES = 1024 * 1024
 
 app = FastAPI()
 app.add_middleware(
@@ -30,18 +123,114 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+query_router = APIRouter()
+ingest_router = APIRouter()
 
-class SearchRequest(BaseModel):
-    text: str
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    """Время ответа по маршрутам (шаблон пути, а не конкретный URL) в geo_http_request_seconds."""
+    started = time.perf_counter()
+    response = await call_next(request)
+    route = request.scope.get("route")
+    observe_request(request.method, getattr(route, "path", "unmatched"), response.status_code,
+                    time.perf_counter() - started)
+    return response
+
+def warm_up():
+    """Создаёт компоненты роли и прогоняет пробный запрос через модель (первый запрос не платит за прогрев)."""
+    if ingestion is not None:
+        ingestion.warm_up()
+    try:
+        for component in required_components:
+            component.get()
+        if SERVES_QUERIES:
+            indexer.get().encode_texts(["warm-up"], record_stats=False)
+    except Exception as e:
+        logger.error(f"[warm_up] Прогрев не завершён: {e}")
+
+@app.on_event("startup")
+async def start_encoders():
+    if SERVES_QUERIES:
+        await text_encoder.start()
+        await image_encoder.start()
+    if jobs is not None:
+        jobs.resume_pending()
+    if WARMUP:
+        threading.Thread(target=warm_up, name="warm-up", daemon=True).start()
+
+@app.on_event("shutdown")
+async def stop_encoders():
+    if SERVES_QUERIES:
+        await text_encoder.stop()
+        await image_encoder.stop()
+    inference_executor.shutdown(wait=False)
+    if ingestion is not None:
+        ingestion.shutdown()
+    retriver = indexer.peek()
+    if retriver is not None:
+        await retriver.aclose()
+        retriver.text_cache.save()
+
+@app.get("/health")
+async def health():
+    """Liveness: процесс отвечает (компоненты могут ещё загружаться)."""
+    return {"status": "ok", "role": SERVICE_ROLE}
+
+@app.get("/metrics")
+async def metrics():
+    """Метрики Prometheus: время стадий, обращения к кэшам, глубина очередей, время ответа."""
+    content, content_type = render_metrics()
+    return Response(content=content, media_type=content_type)
+
+@app.get("/ready")
+async def ready():
+    """Readiness: 200, когда созданы все компоненты роли, иначе 503 с их состоянием."""
+    components = {component.name: component.describe() for component in required_components}
+    is_ready = all(component.ready for component in required_components)
+    return JSONResponse(
+        status_code=200 if is_ready else 503,
+        content={"status": "ready" if is_ready else "starting", "role": SERVICE_ROLE, "components": components},
+    )
+
+async def embed_text(retriver, text: str):
+    """Эмбеддинг текстового запроса: из кэша или через общий батч text_encoder."""
+    with timed("search_encode"):
+        embedding = retriver.lookup_text_embedding(text)
+        if embedding is None:
+            embedding = await text_encoder.encode(text)
+    return embedding
+
+class SearchFilters(BaseModel):
+    # Прямоугольник
     min_lat: Optional[float] = None
     max_lat: Optional[float] = None
     min_lon: Optional[float] = None
     max_lon: Optional[float] = None
+    # Круг: центр и радиус в метрах
+    center_lat: Optional[float] = None
+    center_lon: Optional[float] = None
+    radius_m: Optional[float] = None
+    # Многоугольник: вершины [[lat, lon], ...]
+    polygon: Optional[List[List[float]]] = None
     top_k: int = 5
     start_datetime: Optional[str] = None
     end_datetime: Optional[str] = None
+    # Точность/скорость поиска: по умолчанию — настройки профиля хранения коллекции
+    hnsw_ef: Optional[int] = None
+    exact: bool = False
+    oversampling: Optional[float] = None
+    rescore: Optional[bool] = None
+
+class SearchRequest(SearchFilters):
+    text: str
+
+class SimilarSearchRequest(SearchFilters):
+    # Точка задаётся идентификатором или исходным путём/URI изображения
+    point_id: Optional[str] = None
+    source: Optional[str] = None
 
 class SearchResult(BaseModel):
+    id: Optional[str] = None
     image: str
     lat: Optional[float] = None
     lon: Optional[float] = None
@@ -50,45 +239,219 @@ class SearchResult(BaseModel):
     date: Optional[List[int]] = None
     time: Optional[List[int]] = None
 
-@app.post("/search", response_model=List[SearchResult])
-async def search_images(request: SearchRequest):
-    coord_range = None
-    if all([request.min_lat, request.max_lat, request.min_lon, request.max_lon]):
-        coord_range = (request.min_lat, request.max_lat, request.min_lon, request.max_lon)
-    results = retriver.search(
-        query=request.text,
-        coord_range=coord_range,
-        top_k=request.top_k,
-        start_datetime=request.start_datetime,
-        end_datetime=request.end_datetime
+class BatchSearchQuery(SearchFilters):
+    # Запрос пакета — текст или изображение в base64 (можно data URL)
+    text: Optional[str] = None
+    image_base64: Optional[str] = None
+
+class BatchSearchRequest(BaseModel):
+    queries: List[BatchSearchQuery]
+
+def format_result(item: dict) -> SearchResult:
+    """Переводит результат retriver.search в ответ API с URL изображения."""
+    source = item['payload']['source']
+    if source.startswith(BASE_DIR):
+        rel = source[len(BASE_DIR):].lstrip('/')
+        url = rel
+    elif source.startswith("s3://"):
+        bucket, key = source[5:].split('/', 1)
+        url = f"https://storage.yandexcloud.net/{bucket}/{key}"
+    else:
+        url = source
+    return SearchResult(
+        id=str(item['id']),
+        image=url,
+        lat=item['payload'].get('lat'),
+        lon=item['payload'].get('lon'),
+        score=item['score'],
+        source=url,
+        date=item['payload'].get('date'),
+        time=item['payload'].get('time')
     )
-    formatted = []
-    for item in results:
-        source = item['payload']['source']
-        if source.startswith(BASE_DIR):
-            rel = source[len(BASE_DIR):].lstrip('/')
-            url = rel
-        elif source.startswith("s3://"):
-            bucket, key = source[5:].split('/', 1)
-            url = f"https://storage.yandexcloud.net/{bucket}/{key}"
-        else:
-            url = source
-        formatted.append(SearchResult(
-            image=url,
-            lat=item['payload'].get('lat'),
-            lon=item['payload'].get('lon'),
-            score=item['score'],
-            source=url,
-            date=item['payload'].get('date'),
-            time=item['payload'].get('time')
+
+def filter_kwargs(request: SearchFilters) -> dict:
+    """Переводит поля запроса в аргументы фильтрации и параметры поиска retriver.search."""
+    bbox = (request.min_lat, request.max_lat, request.min_lon, request.max_lon)
+    circle = (request.center_lat, request.center_lon, request.radius_m)
+    polygon = None
+    if request.polygon:
+        if len(request.polygon) < 3 or any(len(vertex) != 2 for vertex in request.polygon):
+            raise HTTPException(status_code=400, detail="polygon: нужно не меньше трёх вершин [lat, lon]")
+        polygon = [tuple(vertex) for vertex in request.polygon]
+    return {
+        "coord_range": bbox if all(v is not None for v in bbox) else None,
+        "radius": circle if all(v is not None for v in circle) else None,
+        "polygon": polygon,
+        "start_datetime": request.start_datetime,
+        "end_datetime": request.end_datetime,
+        "hnsw_ef": request.hnsw_ef,
+        "exact": request.exact,
+        "oversampling": request.oversampling,
+        "rescore": request.rescore,
+    }
+
+@query_router.post("/search", response_model=List[SearchResult])
+async def search_images(request: SearchRequest):
+    filters = filter_kwargs(request)
+    retriver = await indexer.aget()
+    embedding = await embed_text(retriver, request.text)
+    results = await retriver.asearch(embedding, top_k=request.top_k, **filters)
+    return [format_result(item) for item in results]
+
+@query_router.post("/search/batch", response_model=List[List[SearchResult]])
+async def search_images_batch(request: BatchSearchRequest):
+    if len(request.queries) > MAX_BATCH_QUERIES:
+        raise HTTPException(status_code=400, detail=f"Не больше {MAX_BATCH_QUERIES} запросов в пакете")
+    for idx, query in enumerate(request.queries):
+        if (query.text is None) == (query.image_base64 is None):
+            raise HTTPException(status_code=400, detail=f"queries[{idx}]: нужно ровно одно из полей text и image_base64")
+    queries = [{"query": query.text, "top_k": query.top_k, **filter_kwargs(query)} for query in request.queries]
+    image_indices = [idx for idx, query in enumerate(request.queries) if query.image_base64 is not None]
+    retriver = await indexer.aget()
+    loop = asyncio.get_running_loop()
+    if image_indices:
+        model = await embedder.aget()
+        # Изображения декодируются в пуле потоков одновременно, а не по очереди
+        images = await asyncio.gather(*(
+            decode_base64_image(request.queries[idx].image_base64, model.draft_size, idx) for idx in image_indices
         ))
-    return formatted
-
-@app.post("/process-folder")
-async def process_folder(
-    folder_path: str,
-    batch_size: int = 16,
-    background_tasks: BackgroundTasks = BackgroundTasks()
-):
-    background_tasks.add_task(retriver.process_image_folder, folder_path, batch_size)
-    return {"status": "Processing started"}
\ No newline at end of file
+        # Все изображения пакета — одним проходом модели в пуле инференса
+        with timed("search_encode", len(images)):
+            image_embeddings = await loop.run_in_executor(inference_executor, retriver.encode_images, images)
+        for idx, embedding in zip(image_indices, image_embeddings):
+            queries[idx]["query_vector"] = embedding
+    text_queries = [query for query in queries if query["query"] is not None]
+    if text_queries:
+        # Промахи кэша пакета кодируются одним вызовом encode_texts, а не через text_encoder:
+        # его батч ограничен TEXT_BATCH_MAX_SIZE, и большой пакет разбился бы на несколько проходов модели
+        with timed("search_encode", len(text_queries)):
+            text_embeddings = await loop.run_in_executor(
+                inference_executor, retriver.encode_texts, [query["query"] for query in text_queries])
+        for query, embedding in zip(text_queries, text_embeddings):
+            query["query_vector"] = embedding
+    results = await retriver.asearch_batch(queries)
+    return [[format_result(item) for item in hits] for hits in results]
+
+async def read_upload(file: UploadFile) -> bytes:
+    """Читает загруженный файл кусками, не превышая MAX_UPLOAD_BYTES."""
+    chunks, size = [], 0
+    while True:
+        chunk = await file.read(UPLOAD_CHUNK_BYTES)
+        if not chunk:
+            break
+        size += len(chunk)
+        if size > MAX_UPLOAD_BYTES:
+            raise HTTPException(status_code=413, detail=f"Изображение больше {MAX_UPLOAD_BYTES // (1024 * 1024)} МБ")
+        chunks.append(chunk)
+    return b"".join(chunks)
+
+async def decode_base64_image(data: str, draft_size: Optional[int], idx: int):
+    """Декодирует изображение запроса пакета из base64 (с префиксом data URL или без)."""
+    if data.startswith("data:"):
+        data = data.split(",", 1)[-1]
+    if len(data) * 3 // 4 > MAX_UPLOAD_BYTES:
+        raise HTTPException(status_code=413, detail=f"queries[{idx}]: изображение больше {MAX_UPLOAD_BYTES // (1024 * 1024)} МБ")
+    try:
+        raw = base64.b64decode(data, validate=True)
+        return await run_in_threadpool(load_image, raw, draft_size)
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"queries[{idx}]: не удалось декодировать изображение: {e}")
+
+@query_router.post("/search/image", response_model=List[SearchResult])
+async def search_by_image(file: UploadFile = File(...), filters: str = Form("{}")):
+    """Поиск по загруженному изображению; filters — JSON с полями SearchFilters."""
+    try:
+        request = SearchFilters.model_validate_json(filters)
+    except ValidationError as e:
+        raise HTTPException(status_code=422, detail=e.errors())
+    search_kwargs = filter_kwargs(request)
+    data = await read_upload(file)
+    model = await embedder.aget()
+    try:
+        image = await run_in_threadpool(load_image, data, model.draft_size)
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Не удалось декодировать изображение: {e}")
+    with timed("search_encode"):
+        embedding = await image_encoder.encode(image)
+    retriver = await indexer.aget()
+    results = await retriver.asearch(embedding, top_k=request.top_k, **search_kwargs)
+    return [format_result(item) for item in results]
+
+def parse_point_id(value: str) -> Union[int, str]:
+    """Идентификатор точки Qdrant: целое без знака или UUID (иначе 400, а не ошибка клиента Qdrant)."""
+    value = value.strip()
+    if value.isdigit():
+        return int(value)
+    try:
+        return str(uuid.UUID(value))
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"point_id должен быть целым числом или UUID: {value}")
+
+@query_router.post("/search/similar", response_model=List[SearchResult])
+async def search_similar(request: SimilarSearchRequest):
+    """Поиск кадров, похожих на уже проиндексированный, по его сохранённому вектору (без модели)."""
+    if request.point_id:
+        point_id = parse_point_id(request.point_id)
+    elif request.source:
+        point_id = make_point_id(request.source)
+    else:
+        raise HTTPException(status_code=400, detail="Нужно указать point_id или source")
+    retriver = await indexer.aget()
+    try:
+        results = await retriver.asearch_similar(point_id, top_k=request.top_k, **filter_kwargs(request))
+    except Exception as e:
+        if retriver.is_not_found(e):
+            raise HTTPException(status_code=404, detail=f"Точка {point_id} не найдена")
+        raise
+    return [format_result(item) for item in results]
+
+class JobRequest(BaseModel):
+    folder_path: str
+    batch_size: int = 16
+
+@ingest_router.post("/process-folder")
+async def process_folder(folder_path: str, batch_size: int = 16):
+    job = jobs.submit(folder_path, batch_size)
+    return {"status": "Processing started", "job_id": job["id"]}
+
+@ingest_router.post("/jobs")
+async def create_job(request: JobRequest):
+    return jobs.submit(request.folder_path, request.batch_size)
+
+@ingest_router.get("/jobs")
+async def list_jobs():
+    return jobs.list()
+
+@ingest_router.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    job = jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Задача {job_id} не найдена")
+    return job
+
+@ingest_router.post("/jobs/{job_id}/cancel")
+async def cancel_job(job_id: str):
+    job = jobs.cancel(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Задача {job_id} не найдена")
+    return job
+
+@ingest_router.post("/jobs/{job_id}/resume")
+async def resume_job(job_id: str):
+    try:
+        job = jobs.resume(job_id)
+    except ValueError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Задача {job_id} не найдена")
+    return job
+
+@query_router.get("/cache-stats")
+async def cache_stats():
+    retriver = await indexer.aget()
+    return {"text_embeddings": retriver.text_cache.stats()}
+
+if SERVES_QUERIES:
+    app.include_router(query_router)
+if SERVES_INGEST:
+    app.include_router(ingest_router)
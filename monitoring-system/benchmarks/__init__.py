@@ -0,0 +1 @@
+"""Бенчмарки индексации, очистки и поиска (см. benchmarks.run)."""
@@ -0,0 +1,410 @@
+"""
+Сквозной бенчмарк индексации, очистки дубликатов и поиска.
+
+Генерирует синтетические полёты с EXIF (см. benchmarks.synthetic) и по стадиям измеряет:
+  exif    — разбор EXIF, изображений/с (холодный и тёплый кэш метаданных);
+  scan    — FolderScanner с очистителем: время по resize, пары/с, сколько кадров осталось;
+  encode  — RemoteCLIP.encode_image по размерам батча (предобработка и модель отдельно), задержка encode_text;
+  upsert  — загрузка точек в Qdrant через QdrantUploader, точек/с;
+  ingest  — process_image_folder целиком (статистика конвейера по стадиям);
+  search  — p50/p95/p99 и QPS поиска при разной конкурентности, без фильтров и с bbox/временем:
+            в процессе (ImageQdrantIndexer.search) или по HTTP /search работающего сервиса (--api-url).
+
+По умолчанию Qdrant — встроенный (":memory:"), сервер не нужен. Результат — JSON с коммитом git
+и параметрами запуска, чтобы сравнивать прогоны между коммитами.
+
+Запуск:
+    python -m benchmarks.run --stages exif,encode,upsert,search --batch-sizes 1,8,32 \\
+        --concurrency 1,4,16 --output bench.json
+    python -m benchmarks.run --stages search --api-url http://localhost:8000 --output bench_api.json
+"""
+import os
+import sys
+import json
+import time
+import uuid
+import shutil
+import logging
+import platform
+import argparse
+import tempfile
+import subprocess
+import urllib.request
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List, Optional, Sequence
+
+import numpy as np
+from qdrant_client.http import models
+
+from .synthetic import make_dataset
+
+logger = logging.getLogger(__name__)
+
+STAGES = ("exif", "scan", "encode", "upsert", "ingest", "search")
+
+
+def git_info() -> dict:
+    root = os.path.dirname(os.path.abspath(__file__))
+
+    def git(*args) -> Optional[str]:
+        try:
+            return subprocess.run(["git", *args], cwd=root, capture_output=True, text=True, check=True).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
+    status = git("status", "--porcelain")
+    return {"commit": git("rev-parse", "HEAD"), "branch": git("rev-parse", "--abbrev-ref", "HEAD"),
+            "dirty": bool(status) if status is not None else None}
+
+
+def environment_info() -> dict:
+    info = {"python": sys.version.split()[0], "platform": platform.platform(), "cpu_count": os.cpu_count()}
+    try:
+        import torch
+        info.update(torch=torch.__version__, cuda=torch.cuda.is_available(), torch_threads=torch.get_num_threads())
+    except ImportError:
+        pass
+    return info
+
+
+def latency_summary(latencies: Sequence[float], elapsed: float, errors: int = 0) -> dict:
+    values = np.asarray(latencies, dtype=np.float64) * 1000
+    summary = {"requests": len(latencies) + errors, "errors": errors,
+               "qps": len(latencies) / elapsed if elapsed > 0 else None}
+    if len(values):
+        summary.update(
+            mean_ms=float(values.mean()),
+            p50_ms=float(np.percentile(values, 50)),
+            p95_ms=float(np.percentile(values, 95)),
+            p99_ms=float(np.percentile(values, 99)),
+        )
+    return summary
+
+
+def run_load(call: Callable, requests: Sequence, concurrency: int) -> dict:
+    """
+    Выполняет call(request) для всех запросов в concurrency потоках; задержки — по каждому вызову.
+    Отдельные ошибки учитываются в сводке, а если не удался ни один запрос, стадия считается проваленной.
+    """
+    latencies, errors = [], []
+
+    def timed(request):
+        started = time.perf_counter()
+        try:
+            call(request)
+        except Exception as e:
+            errors.append(str(e))
+            return
+        latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(timed, requests))
+    if errors and not latencies:
+        raise RuntimeError(f"Все {len(errors)} запросов завершились ошибкой, первая: {errors[0]}")
+    summary = latency_summary(latencies, time.perf_counter() - started, len(errors))
+    if errors:
+        summary["first_error"] = errors[0]
+    return summary
+
+
+def filter_variants(dataset: dict) -> dict:
+    """Фильтры поиска: без фильтра, центральная четверть охвата (bbox), первая половина времени и оба сразу."""
+    (min_lat, max_lat), (min_lon, max_lon) = dataset["lat_range"], dataset["lon_range"]
+    lat_pad, lon_pad = (max_lat - min_lat) / 4, (max_lon - min_lon) / 4
+    bbox = {"coord_range": (min_lat + lat_pad, max_lat - lat_pad, min_lon + lon_pad, max_lon - lon_pad)}
+    start, end = (datetime.fromisoformat(v) for v in dataset["time_range"])
+    time_range = {"start_datetime": start.isoformat(), "end_datetime": (start + (end - start) / 2).isoformat()}
+    return {"none": {}, "bbox": bbox, "time": time_range, "bbox_time": {**bbox, **time_range}}
+
+
+class Benchmark:
+    def __init__(self, args: argparse.Namespace):
+        self.args = args
+        self.dataset: Optional[dict] = None
+        self._embedder = None
+        self._search_indexer = None
+        self._collections: List[tuple] = []
+
+    # --- общие компоненты ---
+
+    def prepare_dataset(self) -> dict:
+        args = self.args
+        root = args.data_dir or tempfile.mkdtemp(prefix="bench-data-")
+        started = time.perf_counter()
+        self.dataset = make_dataset(root, flights=args.flights, images_per_flight=args.images_per_flight,
+                                    image_size=tuple(args.image_size), overlap=args.overlap, seed=args.seed)
+        logger.info(f"[bench] Набор данных: {self.dataset['images']} кадров в {root}")
+        return {key: value for key, value in self.dataset.items() if key != "paths"} | {
+            "generate_seconds": time.perf_counter() - started}
+
+    def embedder(self):
+        if self._embedder is None:
+            from src.components import build_embedder
+            self._embedder = build_embedder()
+        return self._embedder
+
+    def make_indexer(self, stage: str, embedder=None, cleaner=None):
+        from src.retrieval import ImageQdrantIndexer
+        args = self.args
+        qdrant_path = args.qdrant_path
+        if qdrant_path and qdrant_path != ":memory:":
+            # Каталог встроенного Qdrant открывается одним клиентом — у каждой стадии свой
+            qdrant_path = os.path.join(qdrant_path, stage)
+        collection = f"bench_{stage}_{uuid.uuid4().hex[:8]}"
+        indexer = ImageQdrantIndexer(
+            embedder, cleaner,
+            qdrant_host=args.qdrant_host, qdrant_port=args.qdrant_port, qdrant_path=qdrant_path,
+            collection_name=collection, storage_profile=args.storage_profile,
+        )
+        self._collections.append(indexer)
+        return indexer
+
+    def cleanup(self) -> None:
+        if self.args.keep:
+            return
+        for indexer in self._collections:
+            indexer.delete_collection()
+            if indexer.local:
+                indexer.client.close()
+        if self.dataset and not self.args.data_dir:
+            shutil.rmtree(self.dataset["root"], ignore_errors=True)
+
+    # --- стадии ---
+
+    def stage_exif(self) -> dict:
+        from src.retrieval.utils import ImageMetadataExtractor, LRUCache
+        paths = self.dataset["paths"]
+        result = {}
+        ImageMetadataExtractor.metadata_cache = LRUCache(max_size=len(paths) + 1, name="exif_metadata")
+        for label in ("cold", "warm"):
+            started = time.perf_counter()
+            found = sum(1 for path in paths if "lat" in ImageMetadataExtractor.extract_metadata(path))
+            elapsed = time.perf_counter() - started
+            result[label] = {"images": len(paths), "with_gps": found, "seconds": elapsed,
+                             "images_per_second": len(paths) / elapsed if elapsed > 0 else None}
+        return result
+
+    def stage_scan(self) -> dict:
+        from src.components import build_cleaner
+        from src.retrieval.processing import FolderScanner
+        cleaner = build_cleaner()
+        if self.args.deletion_threshold is not None:
+            cleaner.deletion_threshold = self.args.deletion_threshold
+        scanner = FolderScanner(cleaner, workers=self.args.cleaner_workers)
+        result = {"deletion_threshold": cleaner.deletion_threshold}
+        for resize in self.args.resize:
+            stats_before = dict(cleaner.stats)
+            started = time.perf_counter()
+            kept = scanner.scan_folder(self.dataset["root"], resize=resize)
+            elapsed = time.perf_counter() - started
+            pairs = {key: cleaner.stats[key] - stats_before.get(key, 0) for key in cleaner.stats}
+            result[f"resize_{resize}"] = {
+                "seconds": elapsed, "images_in": self.dataset["images"], "images_kept": len(kept),
+                "pairs": pairs, "pairs_per_second": pairs["pairs"] / elapsed if elapsed > 0 else None,
+            }
+        return result
+
+    def stage_encode(self) -> dict:
+        embedder = self.embedder()
+        paths = self.dataset["paths"]
+        result = {"device": str(embedder.device), "backend": getattr(embedder, "backend", "torch")}
+        for batch_size in self.args.batch_sizes:
+            batches = [paths[i:i + batch_size] for i in range(0, len(paths), batch_size)]
+            batches = [batch for batch in batches if len(batch) == batch_size] or [paths[:batch_size]]
+            # Первый батч — прогрев (ленивая инициализация, подбор ядер), в замер не входит
+            embedder.encode_image(batches[0])
+            preprocess_seconds = model_seconds = 0.0
+            images = 0
+            for batch in batches[:self.args.encode_batches]:
+                started = time.perf_counter()
+                pixels = embedder.preprocess_images(batch)
+                preprocess_seconds += time.perf_counter() - started
+                started = time.perf_counter()
+                embedder.encode_preprocessed(pixels).cpu()
+                model_seconds += time.perf_counter() - started
+                images += len(batch)
+            total = preprocess_seconds + model_seconds
+            result[f"batch_{batch_size}"] = {
+                "images": images, "preprocess_seconds": preprocess_seconds, "model_seconds": model_seconds,
+                "images_per_second": images / total if total > 0 else None,
+                "model_images_per_second": images / model_seconds if model_seconds > 0 else None,
+            }
+        queries = [f"aerial photo {i}" for i in range(self.args.text_queries)]
+        embedder.encode_text(queries[:1])
+        latencies = []
+        for query in queries:
+            started = time.perf_counter()
+            embedder.encode_text([query]).cpu()
+            latencies.append(time.perf_counter() - started)
+        result["encode_text"] = latency_summary(latencies, sum(latencies))
+        return result
+
+    def stage_upsert(self) -> dict:
+        from src.retrieval.uploader import QdrantUploader
+        args = self.args
+        rng = np.random.default_rng(args.seed)
+        vectors = rng.normal(size=(args.points, 512)).astype(np.float32)
+        vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+        (min_lat, max_lat), (min_lon, max_lon) = self.dataset["lat_range"], self.dataset["lon_range"]
+        start, end = (datetime.fromisoformat(v).timestamp() for v in self.dataset["time_range"])
+        lats = rng.uniform(min_lat, max_lat, args.points)
+        lons = rng.uniform(min_lon, max_lon, args.points)
+        timestamps = rng.uniform(start, end, args.points)
+        points = [
+            models.PointStruct(
+                id=str(uuid.uuid4()), vector=vectors[i].tolist(),
+                payload={"source": f"bench://{i}", "lat": float(lats[i]), "lon": float(lons[i]),
+                         "location": {"lat": float(lats[i]), "lon": float(lons[i])},
+                         "timestamp": float(timestamps[i])},
+            )
+            for i in range(args.points)
+        ]
+        indexer = self.make_indexer("search")
+        uploader = QdrantUploader(indexer.client, indexer.collection_name, chunk_size=args.upsert_chunk_size,
+                                  max_in_flight=args.upsert_parallel)
+        started = time.perf_counter()
+        uploader.submit(points)
+        stats = uploader.close()
+        elapsed = time.perf_counter() - started
+        self._search_indexer = indexer
+        return {"points": args.points, "chunk_size": args.upsert_chunk_size, "parallel": args.upsert_parallel,
+                "seconds": elapsed, "points_per_second": args.points / elapsed if elapsed > 0 else None,
+                "uploader": stats}
+
+    def stage_ingest(self) -> dict:
+        cleaner = None
+        if self.args.ingest_cleaner:
+            from src.components import build_cleaner
+            cleaner = build_cleaner()
+        indexer = self.make_indexer("ingest", self.embedder(), cleaner)
+        started = time.perf_counter()
+        stats = indexer.process_image_folder(self.dataset["root"], batch_size=self.args.ingest_batch_size,
+                                             resize=self.args.resize[0], show_progress=False, skip_indexed=False)
+        elapsed = time.perf_counter() - started
+        stats = json.loads(json.dumps(stats, default=str))
+        return {"seconds": elapsed, "batch_size": self.args.ingest_batch_size, "cleaner": cleaner is not None,
+                "images_per_second": stats.get("images_done", 0) / elapsed if elapsed > 0 else None,
+                "pipeline": stats}
+
+    def stage_search(self) -> dict:
+        args = self.args
+        variants = filter_variants(self.dataset)
+        result = {}
+        if args.api_url:
+            texts = [f"river near the road {i}" for i in range(args.queries)]
+            for name, filters in variants.items():
+                body = self._api_filters(filters)
+                for concurrency in args.concurrency:
+                    result[f"{name}_c{concurrency}"] = run_load(
+                        lambda text: self._post_search(text, body), texts, concurrency)
+            return {"mode": "http", "api_url": args.api_url, **result}
+
+        if self._search_indexer is None:
+            self.stage_upsert()
+        indexer = self._search_indexer
+        rng = np.random.default_rng(args.seed + 1)
+        queries = rng.normal(size=(args.queries, 512)).astype(np.float32)
+        for name, filters in variants.items():
+            for concurrency in args.concurrency:
+                result[f"{name}_c{concurrency}"] = run_load(
+                    lambda vector: indexer.search(None, top_k=args.top_k, query_vector=vector, **filters),
+                    list(queries), concurrency)
+        return {"mode": "in_process", "points": args.points, **result}
+
+    @staticmethod
+    def _api_filters(filters: dict) -> dict:
+        body = {}
+        if "coord_range" in filters:
+            body.update(zip(("min_lat", "max_lat", "min_lon", "max_lon"), filters["coord_range"]))
+        for key in ("start_datetime", "end_datetime"):
+            if key in filters:
+                body[key] = filters[key]
+        return body
+
+    def _post_search(self, text: str, filters: dict) -> None:
+        data = json.dumps({"text": text, "top_k": self.args.top_k, **filters}).encode("utf-8")
+        request = urllib.request.Request(f"{self.args.api_url.rstrip('/')}/search", data=data,
+                                         headers={"Content-Type": "application/json"})
+        with urllib.request.urlopen(request, timeout=30) as response:
+            response.read()
+
+    def run(self) -> dict:
+        report = {
+            "meta": {"started_at": datetime.now().isoformat(), "git": git_info(), "environment": environment_info(),
+                     "args": {key: value for key, value in vars(self.args).items()}},
+            "dataset": self.prepare_dataset(),
+            "stages": {},
+        }
+        try:
+            for stage in self.args.stages:
+                logger.info(f"[bench] Стадия {stage}")
+                started = time.perf_counter()
+                try:
+                    report["stages"][stage] = getattr(self, f"stage_{stage}")()
+                except Exception as e:
+                    # Стадия без нужных зависимостей (нет весов, мэтчера, сервера) не мешает остальным
+                    logger.error(f"[bench] Стадия {stage} не выполнена: {e}", exc_info=True)
+                    report["stages"][stage] = {"error": f"{type(e).__name__}: {e}"}
+                report["stages"][stage]["wall_seconds"] = time.perf_counter() - started
+        finally:
+            self.cleanup()
+        report["meta"]["finished_at"] = datetime.now().isoformat()
+        return report
+
+
+def _numbers(value: str, cast=int) -> List:
+    return [cast(v) for v in value.split(",") if v]
+
+
+def main(argv: Optional[List[str]] = None) -> dict:
+    parser = argparse.ArgumentParser(description="Бенчмарк индексации, очистки и поиска")
+    parser.add_argument("--stages", default=",".join(STAGES), help=f"Стадии через запятую: {', '.join(STAGES)}")
+    parser.add_argument("--data-dir", default=None, help="Каталог набора данных (по умолчанию — временный)")
+    parser.add_argument("--flights", type=int, default=4)
+    parser.add_argument("--images-per-flight", type=int, default=40)
+    parser.add_argument("--image-size", type=lambda v: _numbers(v.replace("x", ",")), default=[1024, 768])
+    parser.add_argument("--overlap", type=float, default=0.6)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--qdrant-path", default=":memory:", help="Встроенный Qdrant; пусто — сервер --qdrant-host")
+    parser.add_argument("--qdrant-host", default="qdrant")
+    parser.add_argument("--qdrant-port", type=int, default=6333)
+    parser.add_argument("--storage-profile", default="memory")
+    parser.add_argument("--resize", type=_numbers, default=[1024], help="Размеры resize для очистки через запятую")
+    parser.add_argument("--deletion-threshold", type=float, default=None)
+    parser.add_argument("--cleaner-workers", type=int, default=1)
+    parser.add_argument("--batch-sizes", type=_numbers, default=[1, 8, 16, 32])
+    parser.add_argument("--encode-batches", type=int, default=5, help="Сколько батчей замерять на размер")
+    parser.add_argument("--text-queries", type=int, default=50)
+    parser.add_argument("--points", type=int, default=20000)
+    parser.add_argument("--upsert-chunk-size", type=int, default=256)
+    parser.add_argument("--upsert-parallel", type=int, default=4)
+    parser.add_argument("--ingest-batch-size", type=int, default=32)
+    parser.add_argument("--ingest-cleaner", action="store_true", help="Индексация с очисткой дубликатов")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--top-k", type=int, default=10)
+    parser.add_argument("--concurrency", type=_numbers, default=[1, 4, 16])
+    parser.add_argument("--api-url", default=None, help="Нагружать HTTP /search работающего сервиса")
+    parser.add_argument("--keep", action="store_true", help="Не удалять коллекции и набор данных")
+    parser.add_argument("--output", default=None, help="Путь для JSON-отчёта (по умолчанию — stdout)")
+    args = parser.parse_args(argv)
+    args.stages = [stage for stage in args.stages.split(",") if stage]
+    unknown = set(args.stages) - set(STAGES)
+    if unknown:
+        parser.error(f"Неизвестные стадии: {', '.join(sorted(unknown))}")
+    args.qdrant_path = args.qdrant_path or None
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s — %(message)s")
+    report = Benchmark(args).run()
+    text = json.dumps(report, ensure_ascii=False, indent=2, default=str)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text)
+        logger.info(f"[bench] Отчёт сохранён в {args.output}")
+    else:
+        print(text)
+    return report
+
+
+if __name__ == "__main__":
+    main()
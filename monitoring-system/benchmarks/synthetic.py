@@ -0,0 +1,123 @@
+"""
+Синтетические «аэрофотоснимки» для бенчмарков.
+
+Для каждого полёта (директории) строится текстура местности — шум нескольких масштабов с полями,
+дорогами и постройками, — и камера проходит по ней змейкой с заданным перекрытием кадров, как при
+съёмке с дрона. Соседние кадры пересекаются, поэтому очистка дубликатов работает на реалистичных
+парах. В EXIF каждого кадра записываются GPS-координаты центра, высота и время съёмки.
+"""
+import os
+import math
+import random
+from datetime import datetime, timedelta
+from typing import List, Tuple
+
+import numpy as np
+from PIL import Image, ImageDraw, ExifTags
+
+# Метров в градусе широты (для перевода смещения камеры в координаты)
+METERS_PER_DEG_LAT = 111_320.0
+
+
+def make_terrain(width: int, height: int, rng: np.random.Generator) -> Image.Image:
+    """Текстура местности: сумма шумов разных масштабов, раскрашенная в «поля и лес», с дорогами и постройками."""
+    terrain = np.zeros((height, width), dtype=np.float32)
+    for scale, weight in ((64, 0.5), (16, 0.3), (4, 0.2)):
+        small = rng.random((max(2, height // scale), max(2, width // scale))).astype(np.float32)
+        layer = Image.fromarray((small * 255).astype(np.uint8)).resize((width, height), Image.Resampling.BICUBIC)
+        terrain += weight * np.asarray(layer, dtype=np.float32) / 255.0
+    palette = np.array([[60, 90, 40], [95, 130, 60], [150, 160, 90], [120, 110, 80]], dtype=np.float32)
+    index = np.clip((terrain * len(palette)).astype(int), 0, len(palette) - 1)
+    rgb = palette[index] + rng.normal(0, 6, (height, width, 3))
+    image = Image.fromarray(np.clip(rgb, 0, 255).astype(np.uint8))
+
+    draw = ImageDraw.Draw(image)
+    for _ in range(max(2, width // 400)):
+        x0, y0 = rng.integers(0, width), rng.integers(0, height)
+        x1, y1 = rng.integers(0, width), rng.integers(0, height)
+        draw.line((x0, y0, x1, y1), fill=(110, 105, 100), width=int(rng.integers(6, 14)))
+    for _ in range(width * height // 20000):
+        x, y = rng.integers(0, width), rng.integers(0, height)
+        w, h = rng.integers(10, 40), rng.integers(10, 40)
+        shade = int(rng.integers(140, 220))
+        draw.rectangle((x, y, x + w, y + h), fill=(shade, shade - 20, shade - 30), outline=(40, 40, 40))
+    return image
+
+
+def _dms(value: float) -> Tuple[float, float, float]:
+    value = abs(value)
+    degrees = int(value)
+    minutes = int((value - degrees) * 60)
+    seconds = (value - degrees - minutes / 60) * 3600
+    return float(degrees), float(minutes), round(seconds, 4)
+
+
+def make_exif(lat: float, lon: float, altitude: float, taken_at: datetime) -> Image.Exif:
+    exif = Image.Exif()
+    exif[ExifTags.Base.Make] = "SyntheticDrone"
+    exif[ExifTags.Base.Model] = "Bench-1"
+    gps = exif.get_ifd(ExifTags.IFD.GPSInfo)
+    gps[ExifTags.GPS.GPSLatitudeRef] = "N" if lat >= 0 else "S"
+    gps[ExifTags.GPS.GPSLatitude] = _dms(lat)
+    gps[ExifTags.GPS.GPSLongitudeRef] = "E" if lon >= 0 else "W"
+    gps[ExifTags.GPS.GPSLongitude] = _dms(lon)
+    gps[ExifTags.GPS.GPSAltitude] = float(altitude)
+    exif.get_ifd(ExifTags.IFD.Exif)[ExifTags.Base.DateTimeOriginal] = taken_at.strftime("%Y:%m:%d %H:%M:%S")
+    return exif
+
+
+def make_dataset(root: str, flights: int = 4, images_per_flight: int = 40, image_size: Tuple[int, int] = (1024, 768),
+                 overlap: float = 0.6, meters_per_pixel: float = 0.1, base_lat: float = 55.75, base_lon: float = 37.6,
+                 start: datetime = datetime(2024, 6, 1, 10, 0, 0), seed: int = 0, quality: int = 90) -> dict:
+    """
+    Создаёт в root директории flight_XXX с кадрами JPEG и EXIF.
+
+    :param overlap: Доля перекрытия соседних кадров вдоль маршрута.
+    :param meters_per_pixel: Разрешение на местности (для GPS-координат кадров).
+    :return: Описание набора: пути, число кадров, охват координат и времени.
+    """
+    rng = np.random.default_rng(seed)
+    random.seed(seed)
+    width, height = image_size
+    step = max(1, int(width * (1 - overlap)))
+    per_row = max(1, int(math.sqrt(images_per_flight)))
+    rows = math.ceil(images_per_flight / per_row)
+    terrain_size = (width + step * (per_row - 1), height + int(height * (1 - overlap)) * (rows - 1))
+    lats: List[float] = []
+    lons: List[float] = []
+    paths: List[str] = []
+    taken_at = start
+    for flight in range(flights):
+        directory = os.path.join(root, f"flight_{flight:03d}")
+        os.makedirs(directory, exist_ok=True)
+        terrain = make_terrain(*terrain_size, rng)
+        # Полёты разнесены на ~2 км, чтобы кадры разных полётов не пересекались
+        flight_lat = base_lat + flight * 2000 / METERS_PER_DEG_LAT
+        for idx in range(images_per_flight):
+            row, col = divmod(idx, per_row)
+            if row % 2:
+                col = per_row - 1 - col
+            x, y = col * step, row * int(height * (1 - overlap))
+            frame = terrain.crop((x, y, x + width, y + height))
+            east_m = (x + width / 2) * meters_per_pixel
+            south_m = (y + height / 2) * meters_per_pixel
+            lat = flight_lat - south_m / METERS_PER_DEG_LAT
+            lon = base_lon + east_m / (METERS_PER_DEG_LAT * math.cos(math.radians(flight_lat)))
+            path = os.path.join(directory, f"frame_{idx:05d}.jpg")
+            frame.save(path, "JPEG", quality=quality, exif=make_exif(lat, lon, 120.0, taken_at))
+            paths.append(path)
+            lats.append(lat)
+            lons.append(lon)
+            taken_at += timedelta(seconds=2)
+        taken_at += timedelta(hours=1)
+    return {
+        "root": root,
+        "flights": flights,
+        "images": len(paths),
+        "image_size": list(image_size),
+        "overlap": overlap,
+        "lat_range": [min(lats), max(lats)],
+        "lon_range": [min(lons), max(lons)],
+        "time_range": [start.isoformat(), taken_at.isoformat()],
+        "paths": paths,
+    }
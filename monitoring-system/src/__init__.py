@@ -1,3 +1,26 @@
-from .embedding.model import RemoteCLIP
-from .retrieval import ImageQdrantIndexer
-from .duplicate.model import ImageFolderCleaner
+import importlib
+
+# Публичные классы пакета импортируются при первом обращении: лёгким потребителям (индексатор
+# во встроенном режиме, кэши, задачи, тесты) не нужны torch, open_clip и мэтчер дубликатов
+_EXPORTS = {
+    "RemoteCLIP": ".embedding.model",
+    "MicroBatchEncoder": ".embedding.batcher",
+    "ImageQdrantIndexer": ".retrieval",
+    "ImageFolderCleaner": ".duplicate.model",
+    "IngestionRunner": ".ingestion",
+    "IngestionJobManager": ".jobs",
+}
+
+__all__ = list(_EXPORTS)
+
+
+def __getattr__(name: str):
+    if name not in _EXPORTS:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(_EXPORTS[name], __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
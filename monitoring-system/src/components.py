@@ -0,0 +1,143 @@
+import os
+import time
+import asyncio
+import logging
+import threading
+from typing import Any, Callable, Optional
+
+from .embedding.model import RemoteCLIP
+from .duplicate.model import ImageFolderCleaner
+from .retrieval import ImageQdrantIndexer
+
+logger = logging.getLogger(__name__)
+
+# Базовая директория сервиса (веса модели, локальные датасеты)
+BASE_DIR = os.getenv("BASE_DIR", "./")
+EMBED_MODEL_NAME = "ViT-B-32"
+EMBED_CKPT_PATH = os.path.join(BASE_DIR, "weights/RemoteCLIP-ViT-B-32.pt")
+# Встроенный Qdrant без сервера: каталог хранилища или ":memory:" (пусто — сервер QDRANT_HOST:QDRANT_PORT)
+QDRANT_PATH = os.getenv("QDRANT_PATH") or None
+
+
+def build_embedder() -> RemoteCLIP:
+    """Создаёт RemoteCLIP по переменным окружения (используется сервисом и процессом индексации)."""
+    return RemoteCLIP(
+        model_name=EMBED_MODEL_NAME,
+        ckpt_path=EMBED_CKPT_PATH,
+        preprocess_workers=int(os.getenv("PREPROCESS_WORKERS", "4")),
+        preprocess_backend=os.getenv("PREPROCESS_BACKEND", "thread"),
+        device=os.getenv("EMBED_DEVICE") or None,
+        backend=os.getenv("EMBED_BACKEND", "torch"),
+        onnx_dir=os.getenv("ONNX_DIR") or os.path.join(BASE_DIR, "weights/onnx"),
+        onnx_quantize=os.getenv("ONNX_QUANTIZE", "1") == "1",
+        onnx_intra_threads=int(os.getenv("ONNX_INTRA_THREADS", "0")),
+        onnx_inter_threads=int(os.getenv("ONNX_INTER_THREADS", "0")),
+        onnx_parity_threshold=float(os.getenv("ONNX_PARITY_THRESHOLD", "0.98")),
+    )
+
+
+def build_cleaner() -> ImageFolderCleaner:
+    """Создаёт очиститель дубликатов по переменным окружения."""
+    return ImageFolderCleaner(
+        deletion_threshold=60,
+        prefilter=os.getenv("CLEANER_PREFILTER", "1") == "1",
+    )
+
+
+def build_indexer(embedder: RemoteCLIP, cleaner: Optional[ImageFolderCleaner] = None) -> ImageQdrantIndexer:
+    """Создаёт ImageQdrantIndexer по переменным окружения; cleaner=None — без очистки дубликатов."""
+    return ImageQdrantIndexer(
+        embedder, cleaner,
+        qdrant_host=os.getenv("QDRANT_HOST", "qdrant"),
+        qdrant_port=int(os.getenv("QDRANT_PORT", "6333")),
+        text_cache_size=int(os.getenv("TEXT_CACHE_SIZE", "4096")),
+        text_cache_ttl=float(os.getenv("TEXT_CACHE_TTL", "0")) or None,
+        text_cache_path=os.getenv("TEXT_CACHE_PATH") or None,
+        cleaner_workers=int(os.getenv("CLEANER_WORKERS", "1")),
+        cleaner_devices=[d for d in os.getenv("CLEANER_DEVICES", "").split(",") if d] or None,
+        prefer_grpc=os.getenv("QDRANT_PREFER_GRPC", "0") == "1",
+        upsert_chunk_size=int(os.getenv("UPSERT_CHUNK_SIZE", "256")),
+        upsert_parallel=int(os.getenv("UPSERT_PARALLEL", "4")),
+        upsert_retries=int(os.getenv("UPSERT_RETRIES", "3")),
+        storage_profile=os.getenv("QDRANT_STORAGE_PROFILE", "memory"),
+        hnsw_m=int(os.getenv("QDRANT_HNSW_M", "0")) or None,
+        hnsw_ef_construct=int(os.getenv("QDRANT_HNSW_EF_CONSTRUCT", "0")) or None,
+        s3_streaming=os.getenv("S3_STREAMING", "0") == "1",
+        spill_dir=os.getenv("S3_SPILL_DIR") or None,
+        spill_max_bytes=int(float(os.getenv("S3_SPILL_MAX_GB", "20")) * 1024 ** 3),
+        qdrant_path=QDRANT_PATH,
+    )
+
+
+def embedder_model_id() -> str:
+    """Идентификатор модели build_embedder() без загрузки весов (ключи кэша эмбеддингов запросов)."""
+    return RemoteCLIP._build_model_id(EMBED_MODEL_NAME, EMBED_CKPT_PATH)
+
+
+class _LazyProxy:
+    """Объект, который создаёт компонент при первом обращении к атрибуту (кроме заданных заранее)."""
+    def __init__(self, component: "LazyComponent", attrs: dict):
+        self.__dict__.update(attrs)
+        self._component = component
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._component.get(), name)
+
+
+class LazyComponent:
+    """
+    Тяжёлый компонент (модель, очиститель, индексатор), создаваемый при первом обращении
+    или фоновым прогревом. Создание выполняется один раз; при ошибке следующее обращение
+    пробует снова.
+
+    :param name: Имя компонента (для логов и /ready).
+    :param factory: Функция без аргументов, создающая компонент.
+    """
+    def __init__(self, name: str, factory: Callable[[], Any]):
+        self.name = name
+        self.factory = factory
+        self.status = "pending"
+        self.error: Optional[str] = None
+        self.load_seconds: Optional[float] = None
+        self._value = None
+        self._lock = threading.Lock()
+
+    @property
+    def ready(self) -> bool:
+        return self.status == "ready"
+
+    def get(self) -> Any:
+        """Возвращает компонент, при необходимости создавая его (блокирует до готовности)."""
+        if self.ready:
+            return self._value
+        with self._lock:
+            if not self.ready:
+                self.status = "loading"
+                start = time.perf_counter()
+                try:
+                    self._value = self.factory()
+                except Exception as e:
+                    self.status, self.error = "failed", str(e)
+                    logger.error(f"[components] Не удалось создать {self.name}: {e}", exc_info=True)
+                    raise
+                self.load_seconds = time.perf_counter() - start
+                self.status, self.error = "ready", None
+                logger.info(f"[components] {self.name} готов за {self.load_seconds:.1f} с")
+        return self._value
+
+    async def aget(self) -> Any:
+        """Как get, но создание идёт в пуле потоков, не блокируя event loop."""
+        if self.ready:
+            return self._value
+        return await asyncio.get_running_loop().run_in_executor(None, self.get)
+
+    def peek(self) -> Any:
+        """Компонент, если он уже создан, иначе None (без создания)."""
+        return self._value if self.ready else None
+
+    def proxy(self, **attrs) -> _LazyProxy:
+        """Заместитель для передачи в другие компоненты; attrs отдаются без создания компонента."""
+        return _LazyProxy(self, attrs)
+
+    def describe(self) -> dict:
+        return {"status": self.status, "error": self.error, "load_seconds": self.load_seconds}
@@ -1,9 +1,23 @@
 import os
+import logging
 import cv2
 import numpy as np
+import torch
+from typing import Optional
 from shapely.geometry import Polygon
 from matching import get_matcher
 
+from .prefilter import PairPrefilter
+from ..retrieval.utils.cache import LRUCache
+from ..metrics import debug_sampled, timed
+
+logger = logging.getLogger(__name__)
+
+
+def _remove_batch_dim(data: dict) -> dict:
+    """Убирает батч-измерение из словаря признаков/совпадений LightGlue (аналог lightglue.utils.rbd)."""
+    return {k: v[0] if isinstance(v, (torch.Tensor, np.ndarray, list)) else v for k, v in data.items()}
+
 class ImageFolderCleaner:
     """
     Класс для фильтрации изображений в папке на основе процентного пересечения.
@@ -11,11 +25,35 @@ class ImageFolderCleaner:
     Аргументы:
       model_name (str): Название модели для мэтчинга (например, "superpoint-lg").
       deletion_threshold (float): Порог удаления (в процентах пересечения).
-      device (str, optional): Устройство для вычислений (например, "cuda").
+      device (str, optional): Устройство для вычислений (например, "cuda"); None — "cuda", если доступна, иначе "cpu".
+      prefilter (bool, optional): Решать очевидные пары (почти одинаковые по pHash или далёкие по GPS)
+        без мэтчера; неоднозначные пары по-прежнему идут в мэтчер.
+      duplicate_hash_distance (int, optional): Порог расстояния Хэмминга pHash для «дубликата».
+      gps_disjoint_distance_m (float, optional): Расстояние (м) между точками съёмки, начиная с которого
+        кадры считаются непересекающимися.
+      feature_cache_size (int, optional): Сколько последних кадров хранить загруженными вместе с ключевыми
+        точками и дескрипторами (базовый кадр сравнивается со многими кандидатами подряд).
     """
-    def __init__(self, model_name: str = "superpoint-lg", deletion_threshold: int = 40, device: str = "cuda"):
+    def __init__(self, model_name: str = "superpoint-lg", deletion_threshold: int = 40, device: Optional[str] = None,
+                 prefilter: bool = True, duplicate_hash_distance: int = 4, gps_disjoint_distance_m: float = 1000.0,
+                 feature_cache_size: int = 8):
+        device = device or ("cuda" if torch.cuda.is_available() else "cpu")
+        # Параметры конструктора: по ним воркеры параллельной очистки создают собственные копии
+        self.config = {
+            "model_name": model_name,
+            "deletion_threshold": deletion_threshold,
+            "device": device,
+            "prefilter": prefilter,
+            "duplicate_hash_distance": duplicate_hash_distance,
+            "gps_disjoint_distance_m": gps_disjoint_distance_m,
+            "feature_cache_size": feature_cache_size,
+        }
         self.deletion_threshold = deletion_threshold
         self.matcher = get_matcher([model_name], device=device)
+        self.feature_cache = LRUCache(max_size=feature_cache_size, name="matcher_features")
+        self._feature_matcher = self._find_feature_matcher(self.matcher)
+        self.prefilter = PairPrefilter(duplicate_hash_distance, gps_disjoint_distance_m) if prefilter else None
+        self.stats = {"pairs": 0, "prefilter_duplicate": 0, "prefilter_disjoint": 0, "matcher": 0}
 
     def compute_image_overlap(self, image_path1: str, image_path2: str, resize: int = 1024) -> float:
         """
@@ -30,33 +68,18 @@ class ImageFolderCleaner:
         Возвращает:
           overlap_percentage (float): Процент площади первого изображения, пересекающейся со вторым.
         """
-        # Загрузка изображений через matcher.image_loader
-        img1 = self.matcher.image_loader(image_path1, resize=resize)
-        img2 = self.matcher.image_loader(image_path2, resize=resize)
-
-        def get_image_shape(img):
-            if hasattr(img, 'shape'):
-                # Если изображение в формате (C, H, W)
-                if len(img.shape) == 3:
-                    if img.shape[0] == 3:
-                        return (img.shape[1], img.shape[2])
-                    else:
-                        return img.shape[:2]
-                elif len(img.shape) == 2:
-                    return img.shape
-                else:
-                    raise ValueError("Неверная форма изображения")
-            else:
-                raise ValueError("Изображение не имеет атрибута shape")
-
-        shape1 = get_image_shape(img1)
-        shape2 = get_image_shape(img2)
-        h1, w1 = shape1
-        h2, w2 = shape2
+        # Загрузка изображений и признаков с учётом кэша последних кадров
+        entry1 = self._load_frame(image_path1, resize)
+        entry2 = self._load_frame(image_path2, resize)
+        h1, w1 = entry1["shape"]
+        h2, w2 = entry2["shape"]
 
         # Вычисляем гомографию между изображениями с помощью matcher
-        result = self.matcher(img1, img2)
-        H = result["H"]
+        if "feats" in entry1 and "feats" in entry2:
+            H = self._match_features(entry1["feats"], entry2["feats"])
+        else:
+            result = self.matcher(entry1["image"], entry2["image"])
+            H = result["H"]
 
         # Преобразуем H в numpy-массив типа float32
         H = np.array(H, dtype=np.float32)
@@ -81,6 +104,77 @@ class ImageFolderCleaner:
 
         return overlap_percentage
 
+    @staticmethod
+    def _get_image_shape(img):
+        if hasattr(img, 'shape'):
+            # Если изображение в формате (C, H, W)
+            if len(img.shape) == 3:
+                if img.shape[0] == 3:
+                    return (img.shape[1], img.shape[2])
+                else:
+                    return img.shape[:2]
+            elif len(img.shape) == 2:
+                return img.shape
+            else:
+                raise ValueError("Неверная форма изображения")
+        else:
+            raise ValueError("Изображение не имеет атрибута shape")
+
+    @staticmethod
+    def _find_feature_matcher(matcher):
+        """
+        Возвращает внутренний мэтчер с раздельными extractor/matcher (семейство *-lg), если он единственный
+        в ансамбле. Для него признаки кадра можно извлечь один раз и переиспользовать; иначе возвращает None.
+        """
+        inner = getattr(matcher, "matchers", [matcher])
+        if len(inner) != 1:
+            return None
+        inner = inner[0]
+        if hasattr(inner, "extractor") and hasattr(getattr(inner, "extractor"), "extract") and hasattr(inner, "matcher"):
+            return inner
+        return None
+
+    def _load_frame(self, image_path: str, resize: int) -> dict:
+        """
+        Загружает кадр через matcher.image_loader и, если возможно, извлекает ключевые точки и дескрипторы.
+        Результат хранится в LRU-кэше по (путь, resize, mtime).
+        """
+        key = (image_path, resize, os.stat(image_path).st_mtime_ns)
+        entry = self.feature_cache.get(key)
+        if entry is not None:
+            return entry
+        img = self.matcher.image_loader(image_path, resize=resize)
+        entry = {"shape": self._get_image_shape(img)}
+        if self._feature_matcher is not None:
+            device = getattr(self._feature_matcher, "device", "cpu")
+            with torch.inference_mode():
+                entry["feats"] = self._feature_matcher.extractor.extract(img.to(device))
+        else:
+            entry["image"] = img
+        self.feature_cache.put(key, entry)
+        return entry
+
+    def _match_features(self, feats1: dict, feats2: dict):
+        """Сопоставляет закэшированные признаки двух кадров и оценивает гомографию (USAC MAGSAC, как в matching)."""
+        inner = self._feature_matcher
+        with torch.inference_mode():
+            matches = inner.matcher({"image0": feats1, "image1": feats2})
+        feats1, feats2, matches = [_remove_batch_dim(x) for x in (feats1, feats2, matches)]
+        pairs = matches["matches"]
+        mkpts1 = feats1["keypoints"][pairs[..., 0]].cpu().numpy()
+        mkpts2 = feats2["keypoints"][pairs[..., 1]].cpu().numpy()
+        if len(mkpts1) < 4:
+            raise ValueError(f"Недостаточно совпадений для гомографии: {len(mkpts1)}")
+        H, _ = cv2.findHomography(
+            mkpts1, mkpts2, cv2.USAC_MAGSAC,
+            getattr(inner, "ransac_reproj_thresh", 3),
+            getattr(inner, "ransac_conf", 0.95),
+            getattr(inner, "ransac_iters", 2000),
+        )
+        if H is None:
+            raise ValueError("Не удалось оценить гомографию")
+        return H
+
     def process_folder(self, folder_path: str, resize: int = 1024) -> list:
         """
         Проходит по изображениям в указанной папке и возвращает список путей, 
@@ -112,21 +206,53 @@ class ImageFolderCleaner:
         file_paths = [os.path.join(folder_path, f) for f in files]
         kept_images = [file_paths[0]]
         current_image = file_paths[0]
-        print(f"Базовое изображение: {current_image}")
+        debug_sampled(logger, "cleaner.base", "Базовое изображение: %s", current_image)
+        signatures = {}
 
         for next_image in file_paths[1:]:
-            try:
-                overlap = self.compute_image_overlap(current_image, next_image, resize=resize)
-                print(f"Пересечение между '{current_image}' и '{next_image}' = {overlap:.2f}%")
-            except Exception as e:
-                print(f"Ошибка при обработке '{current_image}' и '{next_image}': {e}")
-                overlap = 0.0  # При ошибке считаем пересечение равным 0
+            self.stats["pairs"] += 1
+            overlap = self._prefilter_overlap(current_image, next_image, signatures)
+            if overlap is not None:
+                debug_sampled(logger, "cleaner.pair", "Пересечение между '%s' и '%s' = %.2f%% (предфильтр)",
+                              current_image, next_image, overlap)
+            else:
+                self.stats["matcher"] += 1
+                try:
+                    with timed("matcher"):
+                        overlap = self.compute_image_overlap(current_image, next_image, resize=resize)
+                    debug_sampled(logger, "cleaner.pair", "Пересечение между '%s' и '%s' = %.2f%%",
+                                  current_image, next_image, overlap)
+                except Exception as e:
+                    print(f"Ошибка при обработке '{current_image}' и '{next_image}': {e}")
+                    overlap = 0.0  # При ошибке считаем пересечение равным 0
 
             if overlap > self.deletion_threshold:
-                print(f"Изображение '{next_image}' пропущено (пересечение > порога)")
+                debug_sampled(logger, "cleaner.skip", "Изображение '%s' пропущено (пересечение > порога)", next_image)
+                signatures.pop(next_image, None)
             else:
                 kept_images.append(next_image)
+                signatures.pop(current_image, None)
                 current_image = next_image
-                print(f"Новое базовое изображение: {current_image}")
+                debug_sampled(logger, "cleaner.base", "Новое базовое изображение: %s", current_image)
 
         return kept_images
+
+    def _prefilter_overlap(self, image_path1: str, image_path2: str, signatures: dict):
+        """
+        Оценивает пересечение пары по дешёвым признакам. Возвращает процент (100.0 / 0.0)
+        или None, если пару должен проверить мэтчер. Признаки кэшируются в signatures на время обхода папки.
+        """
+        if self.prefilter is None:
+            return None
+        with timed("prefilter"):
+            try:
+                for path in (image_path1, image_path2):
+                    if path not in signatures:
+                        signatures[path] = self.prefilter.signature(path)
+            except Exception as e:
+                print(f"Ошибка предфильтра для '{image_path1}' и '{image_path2}': {e}")
+                return None
+            overlap = self.prefilter.decide(signatures[image_path1], signatures[image_path2])
+        if overlap is not None:
+            self.stats["prefilter_duplicate" if overlap > 0 else "prefilter_disjoint"] += 1
+        return overlap
@@ -0,0 +1,83 @@
+import math
+import cv2
+import numpy as np
+from typing import Optional
+
+from ..retrieval.utils.metadata_extractor import ImageMetadataExtractor
+
+
+def perceptual_hash(image_path: str, hash_size: int = 8) -> Optional[int]:
+    """
+    Вычисляет DCT-хэш (pHash) изображения: hash_size**2 - 1 бит без DC-компоненты.
+    JPEG декодируется сразу в уменьшенном виде (IMREAD_REDUCED_GRAYSCALE_8).
+    """
+    image = cv2.imread(image_path, cv2.IMREAD_REDUCED_GRAYSCALE_8)
+    if image is None:
+        image = cv2.imread(image_path, cv2.IMREAD_GRAYSCALE)
+    if image is None:
+        return None
+    side = hash_size * 4
+    small = cv2.resize(image, (side, side), interpolation=cv2.INTER_AREA).astype(np.float32)
+    dct = cv2.dct(small)[:hash_size, :hash_size].flatten()[1:]
+    bits = dct > np.median(dct)
+    return int("".join("1" if b else "0" for b in bits), 2)
+
+
+def haversine_m(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    """Расстояние по поверхности Земли в метрах."""
+    r = 6371000.0
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    dphi = phi2 - phi1
+    dlambda = math.radians(lon2 - lon1)
+    a = math.sin(dphi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(dlambda / 2) ** 2
+    return 2 * r * math.asin(math.sqrt(a))
+
+
+class PairPrefilter:
+    """
+    Дешёвая предварительная оценка пары изображений перед мэтчингом SuperPoint-LightGlue.
+
+    Очевидные случаи решаются без мэтчера:
+      - почти одинаковые кадры (расстояние Хэмминга pHash не больше duplicate_hash_distance) — пересечение 100%;
+      - кадры, снятые далеко друг от друга по EXIF GPS (дальше gps_disjoint_distance_m и трёх высот съёмки),
+        — пересечение 0%.
+    Для остальных пар возвращается None, и решение принимает мэтчер.
+
+    Аргументы:
+      duplicate_hash_distance (int): Порог расстояния Хэмминга между pHash для «дубликата».
+      gps_disjoint_distance_m (float): Минимальное расстояние (м) между точками съёмки для «непересекающихся» кадров.
+      hash_size (int): Размер стороны DCT-блока pHash.
+    """
+    def __init__(self, duplicate_hash_distance: int = 4, gps_disjoint_distance_m: float = 1000.0, hash_size: int = 8):
+        self.duplicate_hash_distance = duplicate_hash_distance
+        self.gps_disjoint_distance_m = gps_disjoint_distance_m
+        self.hash_size = hash_size
+
+    def signature(self, image_path: str) -> dict:
+        """Собирает дешёвые признаки изображения: pHash, координаты и высоту съёмки."""
+        try:
+            metadata = ImageMetadataExtractor.extract_metadata(image_path)
+        except OSError:
+            metadata = {}
+        return {
+            "phash": perceptual_hash(image_path, self.hash_size),
+            "lat": metadata.get("lat"),
+            "lon": metadata.get("lon"),
+            "altitude": metadata.get("altitude"),
+        }
+
+    def decide(self, sig1: dict, sig2: dict) -> Optional[float]:
+        """
+        Возвращает предполагаемый процент пересечения (100.0 или 0.0) или None, если пара неоднозначна.
+        """
+        if None not in (sig1["lat"], sig1["lon"], sig2["lat"], sig2["lon"]):
+            distance = haversine_m(sig1["lat"], sig1["lon"], sig2["lat"], sig2["lon"])
+            # Ширина кадра при обычных углах обзора примерно в 1.5 раза больше высоты, берём с запасом
+            altitudes = [abs(a) for a in (sig1["altitude"], sig2["altitude"]) if a is not None]
+            threshold = max([self.gps_disjoint_distance_m] + [3 * a for a in altitudes])
+            if distance > threshold:
+                return 0.0
+        if sig1["phash"] is not None and sig2["phash"] is not None:
+            if bin(sig1["phash"] ^ sig2["phash"]).count("1") <= self.duplicate_hash_distance:
+                return 100.0
+        return None
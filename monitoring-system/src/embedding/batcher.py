@@ -0,0 +1,111 @@
+import asyncio
+import logging
+from concurrent.futures import Executor, ThreadPoolExecutor
+from typing import Any, Callable, List, Optional, Sequence
+
+import numpy as np
+
+from ..metrics import debug_sampled, set_queue_depth, timed
+
+logger = logging.getLogger(__name__)
+
+
+class MicroBatchEncoder:
+    """
+    Объединяет одновременные запросы на кодирование в один батч.
+
+    Запросы, пришедшие в течение окна ``max_wait_ms`` после первого запроса батча
+    (или пока не набрано ``max_batch_size`` штук), кодируются одним вызовом ``encode_fn``
+    в отдельном пуле потоков, не блокируя event loop. Каждый вызывающий получает свою строку.
+
+    :param encode_fn: Функция, принимающая список входов и возвращающая массив эмбеддингов (N, D).
+    :param max_batch_size: Максимальный размер батча.
+    :param max_wait_ms: Окно ожидания (мс) для набора батча.
+    :param executor: Пул для выполнения encode_fn. По умолчанию — собственный однопоточный пул.
+    """
+    def __init__(self, encode_fn: Callable[[List[Any]], Sequence], max_batch_size: int = 32,
+                 max_wait_ms: float = 5.0, executor: Optional[Executor] = None):
+        self.encode_fn = encode_fn
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max(0.0, float(max_wait_ms)) / 1000.0
+        self._own_executor = executor is None
+        self.executor = executor or ThreadPoolExecutor(max_workers=1, thread_name_prefix="micro-batch")
+        self._pending: List[tuple] = []
+        self._has_items: Optional[asyncio.Event] = None
+        self._batch_full: Optional[asyncio.Event] = None
+        self._worker: Optional[asyncio.Task] = None
+
+    async def start(self) -> None:
+        """Запускает фоновую задачу сборки батчей в текущем event loop."""
+        if self._worker is not None:
+            return
+        self._has_items = asyncio.Event()
+        self._batch_full = asyncio.Event()
+        self._worker = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """Останавливает фоновую задачу; ожидающие запросы завершаются ошибкой."""
+        if self._worker is None:
+            return
+        self._worker.cancel()
+        try:
+            await self._worker
+        except asyncio.CancelledError:
+            pass
+        self._worker = None
+        for _, future in self._pending:
+            if not future.done():
+                future.set_exception(RuntimeError("MicroBatchEncoder остановлен"))
+        self._pending.clear()
+        if self._own_executor:
+            self.executor.shutdown(wait=False)
+
+    async def encode(self, item: Any) -> np.ndarray:
+        """Ставит вход в очередь и возвращает его эмбеддинг после обработки батча."""
+        if self._worker is None:
+            await self.start()
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((item, future))
+        set_queue_depth("micro_batch", len(self._pending))
+        self._has_items.set()
+        if len(self._pending) >= self.max_batch_size:
+            self._batch_full.set()
+        return await future
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            await self._has_items.wait()
+            if len(self._pending) < self.max_batch_size and self.max_wait > 0:
+                self._batch_full.clear()
+                try:
+                    await asyncio.wait_for(self._batch_full.wait(), self.max_wait)
+                except asyncio.TimeoutError:
+                    pass
+
+            batch = self._pending[:self.max_batch_size]
+            del self._pending[:self.max_batch_size]
+            set_queue_depth("micro_batch", len(self._pending))
+            if not self._pending:
+                self._has_items.clear()
+                self._batch_full.clear()
+
+            batch = [(item, future) for item, future in batch if not future.cancelled()]
+            if not batch:
+                continue
+
+            inputs = [item for item, _ in batch]
+            try:
+                with timed("micro_batch", len(inputs)):
+                    rows = await loop.run_in_executor(self.executor, self.encode_fn, inputs)
+            except Exception as e:
+                logger.error(f"[MicroBatchEncoder] Ошибка кодирования батча из {len(inputs)}: {e}", exc_info=True)
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+
+            debug_sampled(logger, "micro_batch", "[MicroBatchEncoder] Закодирован батч: %d шт.", len(inputs))
+            for row, (_, future) in zip(rows, batch):
+                if not future.done():
+                    future.set_result(row)
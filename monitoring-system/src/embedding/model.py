@@ -1,17 +1,88 @@
+import io
+import os
+import pickle
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
+import numpy as np
 import torch
 import open_clip
 from PIL import Image
 
+from .onnx_backend import OnnxCLIP, parity_check
+from ..metrics import timed
+
+# Преобразование модели в процессе-воркере (задаётся инициализатором пула процессов)
+_worker_preprocess = None
+
+
+def _init_preprocess_worker(preprocess):
+    global _worker_preprocess
+    _worker_preprocess = preprocess
+    torch.set_num_threads(1)
+
+
+def load_image(item, draft_size=None):
+    """
+    Открывает изображение из пути, байтов, numpy-массива (H, W, C) или PIL.Image и приводит его к RGB.
+
+    :param item: Источник изображения.
+    :param draft_size: Минимальная сторона для уменьшенного JPEG-декодирования (draft mode); None — полное декодирование.
+    :return: PIL.Image в режиме RGB.
+    """
+    if isinstance(item, Image.Image):
+        return item.convert("RGB")
+    if isinstance(item, np.ndarray):
+        return Image.fromarray(item).convert("RGB")
+    if isinstance(item, (bytes, bytearray, memoryview)):
+        item = io.BytesIO(item)
+    with Image.open(item) as image:
+        if draft_size and image.format == "JPEG":
+            # Декодер JPEG масштабирует в 1/2, 1/4, 1/8 прямо при распаковке, не опускаясь ниже draft_size
+            image.draft("RGB", (draft_size, draft_size))
+        return image.convert("RGB")
+
+
+def _preprocess_item(item, draft_size, preprocess=None):
+    with timed("decode"):
+        image = load_image(item, draft_size)
+    with timed("preprocess"):
+        if preprocess is None:
+            # Вызов в процессе-воркере: тензор возвращается как numpy-массив
+            return _worker_preprocess(image).numpy()
+        return preprocess(image)
+
+
 class RemoteCLIP:
-    def __init__(self, model_name='ViT-B-32', ckpt_path=None, device='cuda'):
+    def __init__(self, model_name='ViT-B-32', ckpt_path=None, device=None,
+                 preprocess_workers=4, preprocess_backend='thread', jpeg_draft=True,
+                 backend='torch', onnx_dir=None, onnx_quantize=True, onnx_intra_threads=0, onnx_inter_threads=0,
+                 onnx_parity_threshold=0.98):
         """
         Инициализация модели RemoteCLIP.
 
         :param model_name: Название модели (например, 'ViT-B-32').
         :param ckpt_path: Путь к файлу с предобученными весами модели.
-        :param device: Устройство для вычислений ('cpu' или 'cuda').
+        :param device: Устройство для вычислений ('cpu' или 'cuda'); None — 'cuda', если доступна, иначе 'cpu'.
+        :param preprocess_workers: Число воркеров для декодирования и преобразования изображений (0 или 1 — в текущем потоке).
+        :param preprocess_backend: Тип пула воркеров: 'thread' или 'process'.
+        :param jpeg_draft: Использовать уменьшенное JPEG-декодирование (draft mode) под входной размер модели.
+        :param backend: Бэкенд инференса: 'torch' или 'onnx' (ONNX Runtime, для узлов без GPU).
+        :param onnx_dir: Директория экспортированных ONNX-графов (для backend='onnx').
+        :param onnx_quantize: Использовать int8-графы (динамическая квантизация).
+        :param onnx_intra_threads: Потоки ONNX Runtime внутри оператора; 0 — по числу ядер.
+        :param onnx_inter_threads: Потоки ONNX Runtime между операторами; 0 — по умолчанию.
+        :param onnx_parity_threshold: Минимальное косинусное сходство эмбеддингов ONNX и PyTorch при запуске;
+                                      ниже — остаёмся на PyTorch. 0 — без проверки.
         """
-        self.device = device
+        if preprocess_backend not in ('thread', 'process'):
+            raise ValueError(f"Неизвестный preprocess_backend: {preprocess_backend}")
+        if backend not in ('torch', 'onnx'):
+            raise ValueError(f"Неизвестный backend: {backend}")
+        self.device = device or ('cuda' if torch.cuda.is_available() else 'cpu')
+        self.model_id = self._build_model_id(model_name, ckpt_path)
+        self.preprocess_workers = preprocess_workers
+        self.preprocess_backend = preprocess_backend
+        self._preprocess_pool = None
 
         # Загрузка модели и преобразований
         self.model, _, self.preprocess = open_clip.create_model_and_transforms(model_name)
@@ -19,12 +90,74 @@ class RemoteCLIP:
 
         # Загрузка предобученных весов
         if ckpt_path:
-            checkpoint = torch.load(ckpt_path, map_location='cpu')
-            msg = self.model.load_state_dict(checkpoint, strict=False)
+            checkpoint, mmapped = self._load_checkpoint(ckpt_path)
+            # Тензоры из mmap становятся параметрами модели без копирования: страницы весов
+            # подгружаются из файла по мере обращения и делятся между процессами через page cache.
+            # При другом dtype (например, fp16-чекпоинт) веса копируются в параметры модели как раньше
+            model_state = self.model.state_dict()
+            assign = mmapped and all(
+                tensor.dtype == model_state[name].dtype and tensor.shape == model_state[name].shape
+                for name, tensor in checkpoint.items() if name in model_state
+            )
+            msg = self.model.load_state_dict(checkpoint, strict=False, assign=assign)
             print(f"Model state dict loaded with message: {msg}")
 
         self.model = self.model.to(self.device).eval()
 
+        # Декодируем JPEG с запасом x2 относительно входа модели, дальше работает обычный resize
+        image_size = getattr(self.model.visual, 'image_size', 224)
+        image_size = max(image_size) if isinstance(image_size, (tuple, list)) else image_size
+        self.draft_size = 2 * image_size if jpeg_draft else None
+
+        self.backend = 'torch'
+        self.onnx = None
+        if backend == 'onnx':
+            self._init_onnx(image_size, onnx_dir or 'weights/onnx', onnx_quantize,
+                            onnx_intra_threads, onnx_inter_threads, onnx_parity_threshold)
+
+    def _init_onnx(self, image_size, onnx_dir, quantize, intra_threads, inter_threads, parity_threshold):
+        onnx = OnnxCLIP(
+            self.model, self.model_id, onnx_dir, image_size,
+            context_length=getattr(self.model, 'context_length', 77),
+            quantize=quantize, device=self.device,
+            intra_op_threads=intra_threads, inter_op_threads=inter_threads,
+        )
+        if parity_threshold > 0:
+            similarity = parity_check(self.model, onnx, self.tokenizer, image_size)
+            print(f"ONNX parity (min cosine vs PyTorch): {similarity}")
+            if min(similarity.values()) < parity_threshold:
+                print(f"ONNX-эмбеддинги расходятся с PyTorch сильнее порога {parity_threshold}, используется PyTorch")
+                return
+        self.onnx = onnx
+        self.backend = 'onnx'
+
+    @staticmethod
+    def _load_checkpoint(ckpt_path):
+        """
+        Загружает state dict через mmap (torch.load(mmap=True), только веса), не читая файл в память целиком.
+        Для старых форматов чекпоинта и версий torch без mmap — обычная загрузка.
+
+        :return: (state dict, загружен ли он через mmap).
+        """
+        try:
+            return torch.load(ckpt_path, map_location='cpu', mmap=True, weights_only=True), True
+        except (TypeError, RuntimeError, ValueError, pickle.UnpicklingError) as e:
+            print(f"mmap-загрузка чекпоинта недоступна ({e}), обычная загрузка")
+            return torch.load(ckpt_path, map_location='cpu'), False
+
+    @staticmethod
+    def _build_model_id(model_name, ckpt_path):
+        """
+        Формирует идентификатор модели и чекпоинта (используется как часть ключей кэшей эмбеддингов).
+        """
+        if not ckpt_path:
+            return model_name
+        try:
+            stat = os.stat(ckpt_path)
+            return f"{model_name}:{os.path.basename(ckpt_path)}:{stat.st_size}:{int(stat.st_mtime)}"
+        except OSError:
+            return f"{model_name}:{os.path.basename(ckpt_path)}"
+
     def encode_text(self, texts):
         """
         Создает эмбеддинги для текста.
@@ -32,23 +165,108 @@ class RemoteCLIP:
         :param texts: Список текстовых строк.
         :return: Нормализованные эмбеддинги текста.
         """
-        with torch.no_grad():
-            text_tokens = self.tokenizer(texts).to(self.device)
-            text_features = self.model.encode_text(text_tokens)
-            text_features /= text_features.norm(dim=-1, keepdim=True)
-        return text_features
+        with timed("text_forward", len(texts)):
+            if self.onnx is not None:
+                text_features = self.onnx.encode_text(self.tokenizer(texts).numpy())
+                return torch.from_numpy(text_features / np.linalg.norm(text_features, axis=-1, keepdims=True))
+            with torch.no_grad():
+                text_tokens = self.tokenizer(texts).to(self.device)
+                text_features = self.model.encode_text(text_tokens)
+                text_features /= text_features.norm(dim=-1, keepdim=True)
+            return text_features
+
+    def _get_preprocess_pool(self):
+        if self._preprocess_pool is None:
+            if self.preprocess_backend == 'process':
+                # spawn: fork процесса с инициализированной CUDA небезопасен
+                self._preprocess_pool = ProcessPoolExecutor(
+                    max_workers=self.preprocess_workers,
+                    mp_context=multiprocessing.get_context('spawn'),
+                    initializer=_init_preprocess_worker,
+                    initargs=(self.preprocess,),
+                )
+            else:
+                self._preprocess_pool = ThreadPoolExecutor(
+                    max_workers=self.preprocess_workers, thread_name_prefix='clip-preprocess'
+                )
+        return self._preprocess_pool
+
+    def close(self):
+        """Останавливает пул воркеров предобработки."""
+        if self._preprocess_pool is not None:
+            self._preprocess_pool.shutdown(wait=True)
+            self._preprocess_pool = None
+
+    def preprocess_images(self, images):
+        """
+        Декодирует изображения и применяет к ним преобразования модели.
+        При preprocess_workers > 1 изображения обрабатываются параллельно, а результаты по мере готовности
+        записываются в общий буфер (в pinned memory при работе на CUDA).
+
+        :param images: Список путей, байтов, numpy-массивов (H, W, C) или PIL.Image.
+        :return: Тензор (N, 3, H, W) на CPU.
+        """
+        images = list(images)
+        if not images:
+            raise ValueError("Пустой список изображений")
+        pin = self.onnx is None and str(self.device).startswith('cuda') and torch.cuda.is_available()
+
+        def allocate(first):
+            return torch.empty((len(images), *first.shape), dtype=first.dtype, pin_memory=pin)
+
+        if self.preprocess_workers <= 1 or len(images) == 1:
+            buffer = None
+            for idx, item in enumerate(images):
+                tensor = _preprocess_item(item, self.draft_size, self.preprocess)
+                if buffer is None:
+                    buffer = allocate(tensor)
+                buffer[idx].copy_(tensor)
+            return buffer
+
+        pool = self._get_preprocess_pool()
+        if self.preprocess_backend == 'process':
+            futures = {pool.submit(_preprocess_item, item, self.draft_size): idx for idx, item in enumerate(images)}
+        else:
+            futures = {pool.submit(_preprocess_item, item, self.draft_size, self.preprocess): idx
+                       for idx, item in enumerate(images)}
+        buffer = None
+        try:
+            for future in as_completed(futures):
+                tensor = future.result()
+                if isinstance(tensor, np.ndarray):
+                    tensor = torch.from_numpy(tensor)
+                if buffer is None:
+                    buffer = allocate(tensor)
+                buffer[futures[future]].copy_(tensor)
+        except Exception:
+            for future in futures:
+                future.cancel()
+            raise
+        return buffer
+
+    def encode_preprocessed(self, images_preprocessed):
+        """
+        Создает эмбеддинги для уже подготовленных изображений (результат preprocess_images).
+
+        :param images_preprocessed: Тензор (N, 3, H, W).
+        :return: Нормализованные эмбеддинги изображений.
+        """
+        with timed("model_forward", len(images_preprocessed)):
+            if self.onnx is not None:
+                image_features = self.onnx.encode_image(images_preprocessed.numpy())
+                return torch.from_numpy(image_features / np.linalg.norm(image_features, axis=-1, keepdims=True))
+            images_preprocessed = images_preprocessed.to(self.device, non_blocking=images_preprocessed.is_pinned())
+            with torch.no_grad():
+                image_features = self.model.encode_image(images_preprocessed)
+                image_features /= image_features.norm(dim=-1, keepdim=True)
+            return image_features
 
     def encode_image(self, image_paths):
         """
         Создает эмбеддинги для изображений.
 
-        :param image_paths: Список путей к изображениям.
+        :param image_paths: Список путей к изображениям; также принимаются байты, numpy-массивы (H, W, C)
+                            и PIL.Image, чтобы не сохранять уже загруженные данные на диск.
         :return: Нормализованные эмбеддинги изображений.
         """
-        images = [Image.open(path).convert("RGB") for path in image_paths]
-        images_preprocessed = torch.stack([self.preprocess(image) for image in images]).to(self.device)
-
-        with torch.no_grad():
-            image_features = self.model.encode_image(images_preprocessed)
-            image_features /= image_features.norm(dim=-1, keepdim=True)
-        return image_features
+        return self.encode_preprocessed(self.preprocess_images(image_paths))
@@ -0,0 +1,149 @@
+import os
+import logging
+from typing import Sequence
+
+import numpy as np
+import torch
+
+logger = logging.getLogger(__name__)
+
+
+class _ImageTower(torch.nn.Module):
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+
+    def forward(self, pixels):
+        return self.model.encode_image(pixels)
+
+
+class _TextTower(torch.nn.Module):
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+
+    def forward(self, tokens):
+        return self.model.encode_text(tokens)
+
+
+def export_onnx(model, out_dir: str, image_size: int, context_length: int, opset: int = 17) -> dict:
+    """
+    Экспортирует башни изображений и текста модели open_clip в ONNX (динамический размер батча).
+
+    :return: Пути {"image": ..., "text": ...} к fp32-графам.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    paths = {"image": os.path.join(out_dir, "image.onnx"), "text": os.path.join(out_dir, "text.onnx")}
+    device = next(model.parameters()).device
+    towers = {
+        "image": (_ImageTower(model), torch.randn(1, 3, image_size, image_size, device=device), "pixels"),
+        "text": (_TextTower(model), torch.zeros(1, context_length, dtype=torch.long, device=device), "tokens"),
+    }
+    for name, (tower, example, input_name) in towers.items():
+        tmp_path = f"{paths[name]}.{os.getpid()}.tmp"
+        with torch.no_grad():
+            torch.onnx.export(
+                tower, (example,), tmp_path,
+                input_names=[input_name], output_names=["features"],
+                dynamic_axes={input_name: {0: "batch"}, "features": {0: "batch"}},
+                opset_version=opset, do_constant_folding=True,
+            )
+        os.replace(tmp_path, paths[name])
+    return paths
+
+
+def quantize_int8(fp32_path: str, int8_path: str) -> str:
+    """Динамическая int8-квантизация весов (MatMul/Gemm) — активации квантуются на лету, калибровка не нужна."""
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+    tmp_path = f"{int8_path}.{os.getpid()}.tmp"
+    quantize_dynamic(fp32_path, tmp_path, weight_type=QuantType.QInt8)
+    os.replace(tmp_path, int8_path)
+    return int8_path
+
+
+class OnnxCLIP:
+    """
+    Башни изображений и текста RemoteCLIP в ONNX Runtime.
+
+    Графы экспортируются из PyTorch-модели один раз и хранятся в onnx_dir/<model_id> (при смене
+    чекпоинта model_id меняется и экспорт повторяется); int8-версия строится из fp32 динамической
+    квантизацией. Возвращает ненормированные признаки, как model.encode_image/encode_text.
+
+    :param model: Модель open_clip (для экспорта при отсутствии графов).
+    :param model_id: Идентификатор модели и чекпоинта (RemoteCLIP.model_id).
+    :param onnx_dir: Корневая директория экспортированных графов.
+    :param image_size: Входной размер башни изображений.
+    :param context_length: Длина последовательности токенов.
+    :param quantize: Использовать int8-графы.
+    :param device: 'cpu' или 'cuda' (CUDAExecutionProvider, если он есть в сборке onnxruntime).
+    :param intra_op_threads: Потоки внутри оператора; 0 — по числу ядер.
+    :param inter_op_threads: Потоки между независимыми операторами; 0 — по умолчанию.
+    """
+    def __init__(self, model, model_id: str, onnx_dir: str, image_size: int, context_length: int,
+                 quantize: bool = True, device: str = "cpu", intra_op_threads: int = 0, inter_op_threads: int = 0):
+        import onnxruntime as ort
+        safe_id = "".join(c if c.isalnum() or c in "-._" else "_" for c in model_id)
+        out_dir = os.path.join(onnx_dir, safe_id)
+        paths = {name: os.path.join(out_dir, f"{name}.onnx") for name in ("image", "text")}
+        if not all(os.path.exists(path) for path in paths.values()):
+            logger.info(f"[onnx] Экспорт {model_id} в {out_dir}")
+            paths = export_onnx(model, out_dir, image_size, context_length)
+        if quantize:
+            for name, path in list(paths.items()):
+                int8_path = path.replace(".onnx", ".int8.onnx")
+                if not os.path.exists(int8_path):
+                    logger.info(f"[onnx] Квантизация {path} → int8")
+                    quantize_int8(path, int8_path)
+                paths[name] = int8_path
+        self.paths = paths
+        self.quantize = quantize
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        options.intra_op_num_threads = intra_op_threads
+        options.inter_op_num_threads = inter_op_threads
+        if inter_op_threads > 1:
+            options.execution_mode = ort.ExecutionMode.ORT_PARALLEL
+        providers = ["CPUExecutionProvider"]
+        if str(device).startswith("cuda") and "CUDAExecutionProvider" in ort.get_available_providers():
+            providers.insert(0, "CUDAExecutionProvider")
+        self.sessions = {name: ort.InferenceSession(path, options, providers=providers) for name, path in paths.items()}
+        logger.info(f"[onnx] Сессии {list(paths.values())}, провайдеры {providers}")
+
+    def _run(self, name: str, inputs: np.ndarray) -> np.ndarray:
+        session = self.sessions[name]
+        return session.run(None, {session.get_inputs()[0].name: inputs})[0]
+
+    def encode_image(self, pixels: np.ndarray) -> np.ndarray:
+        return self._run("image", np.ascontiguousarray(pixels, dtype=np.float32))
+
+    def encode_text(self, tokens: np.ndarray) -> np.ndarray:
+        return self._run("text", np.ascontiguousarray(tokens, dtype=np.int64))
+
+
+def _normalize(features: np.ndarray) -> np.ndarray:
+    return features / np.linalg.norm(features, axis=-1, keepdims=True)
+
+
+def parity_check(model, onnx_model: OnnxCLIP, tokenizer, image_size: int,
+                 texts: Sequence[str] = ("aerial photo of a river", "a road in the forest", "buildings"),
+                 num_images: int = 4, seed: int = 0) -> dict:
+    """
+    Сравнивает эмбеддинги ONNX и PyTorch на одних и тех же входах.
+
+    :return: Минимальное косинусное сходство по изображениям и текстам {"image": ..., "text": ...}.
+    """
+    generator = torch.Generator().manual_seed(seed)
+    pixels = torch.randn(num_images, 3, image_size, image_size, generator=generator)
+    tokens = tokenizer(list(texts))
+    device = next(model.parameters()).device
+    with torch.no_grad():
+        reference = {
+            "image": model.encode_image(pixels.to(device)).float().cpu().numpy(),
+            "text": model.encode_text(tokens.to(device)).float().cpu().numpy(),
+        }
+    candidate = {"image": onnx_model.encode_image(pixels.numpy()), "text": onnx_model.encode_text(tokens.numpy())}
+    return {
+        name: float(np.min(np.sum(_normalize(reference[name]) * _normalize(candidate[name]), axis=-1)))
+        for name in reference
+    }
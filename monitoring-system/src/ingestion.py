@@ -0,0 +1,109 @@
+import os
+import logging
+import multiprocessing
+from concurrent.futures import Executor, Future, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+# Индексатор в процессе индексации (создаётся инициализатором пула)
+_worker_indexer = None
+
+
+def _init_ingest_worker(nice: int, torch_threads: int) -> None:
+    global _worker_indexer
+    import torch
+    from .components import build_embedder, build_cleaner, build_indexer
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s — %(message)s")
+    if nice:
+        # Пониженный приоритет: при нехватке CPU планировщик отдаёт его процессу с запросами
+        os.nice(nice)
+    if torch_threads:
+        torch.set_num_threads(torch_threads)
+    logger.info(f"[ingestion] Процесс индексации {os.getpid()} (nice={nice}, torch_threads={torch_threads})")
+    _worker_indexer = build_indexer(build_embedder(), build_cleaner())
+
+
+def _call_in_worker(fn: Callable, args: tuple):
+    return fn(_worker_indexer, *args)
+
+
+def _worker_ready(indexer) -> bool:
+    return indexer is not None
+
+
+class IngestionRunner:
+    """
+    Выполняет индексацию папок вне пути обработки запросов.
+
+    В режиме "process" индексация идёт в отдельном процессе (spawn) со своими моделью, очистителем
+    и клиентом Qdrant: декодирование, очистка дубликатов и кодирование не делят с сервисом ни GIL,
+    ни потоки PyTorch, а процесс работает с пониженным приоритетом. Процесс создаётся при первой
+    задаче и переиспользуется. В режиме "thread" индексация идёт в фоновом потоке текущего процесса
+    с переданным индексатором (для отладки и машин без запаса памяти на вторую копию модели).
+    Одновременно выполняется не больше max_workers задач (в режиме "process" — по процессу на каждую),
+    остальные ждут в очереди в порядке поступления.
+
+    Аргументы:
+      mode (str): "process" или "thread".
+      indexer (ImageQdrantIndexer, optional): Индексатор для режима "thread".
+      nice (int): Прибавка к nice процесса индексации.
+      torch_threads (int): Число потоков PyTorch в процессе индексации; 0 — по умолчанию.
+      max_workers (int): Число одновременно выполняемых задач.
+    """
+    def __init__(self, mode: str = "process", indexer=None, nice: int = 10, torch_threads: int = 0,
+                 max_workers: int = 1):
+        if mode not in ("process", "thread"):
+            raise ValueError(f"Неизвестный режим индексации: {mode}")
+        if mode == "thread" and indexer is None:
+            raise ValueError("Для режима 'thread' нужен indexer")
+        self.mode = mode
+        self.indexer = indexer
+        self.nice = nice
+        self.torch_threads = torch_threads
+        self.max_workers = max(1, max_workers)
+        self._executor: Optional[Executor] = None
+
+    def _get_executor(self) -> Executor:
+        if self._executor is None:
+            if self.mode == "process":
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.max_workers,
+                    mp_context=multiprocessing.get_context("spawn"),
+                    initializer=_init_ingest_worker,
+                    initargs=(self.nice, self.torch_threads),
+                )
+            else:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="ingest")
+        return self._executor
+
+    def call(self, fn: Callable, *args) -> Future:
+        """
+        Выполняет fn(indexer, *args) там, где идёт индексация. В режиме "process" fn и аргументы
+        передаются в процесс через pickle, поэтому fn должна быть функцией уровня модуля.
+        """
+        if self.mode == "thread":
+            return self._get_executor().submit(fn, self.indexer, *args)
+        try:
+            return self._get_executor().submit(_call_in_worker, fn, args)
+        except BrokenProcessPool:
+            # Процесс индексации упал (например, OOM) — поднимаем новый
+            logger.warning("[ingestion] Процесс индексации завершился аварийно, перезапуск")
+            self._executor = None
+            return self._get_executor().submit(_call_in_worker, fn, args)
+
+    def warm_up(self) -> Optional[Future]:
+        """
+        В режиме "process" заранее запускает процесс индексации (загрузка модели и очистителя идёт
+        в фоне, а не при первой задаче); в режиме "thread" ничего не делает.
+        """
+        if self.mode != "process":
+            return None
+        return self.call(_worker_ready)
+
+    def shutdown(self, wait: bool = False) -> None:
+        """Останавливает исполнителя; задачи из очереди, которые ещё не начались, отменяются."""
+        if self._executor is not None:
+            self._executor.shutdown(wait=wait, cancel_futures=True)
+            self._executor = None
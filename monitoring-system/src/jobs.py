@@ -0,0 +1,408 @@
+import os
+import json
+import time
+import uuid
+import fcntl
+import logging
+import threading
+from concurrent.futures import Future
+from concurrent.futures.process import BrokenProcessPool
+from typing import Dict, List, Optional
+
+from .ingestion import IngestionRunner
+
+logger = logging.getLogger(__name__)
+
+# Состояния задачи; queued и running — активные (возобновляются после перезапуска сервиса)
+JOB_STATES = ("queued", "running", "completed", "failed", "cancelled")
+ACTIVE_STATES = ("queued", "running")
+
+
+class JobStore:
+    """
+    Файлы задач индексации в jobs_dir: <id>.json — состояние и контрольная точка,
+    <id>.cancel — запрос отмены, <id>.lock — блокировка владельца задачи. Через файлы состояние
+    видно и сервису, и процессу индексации, и другим экземплярам с тем же jobs_dir.
+    """
+    def __init__(self, jobs_dir: str):
+        self.jobs_dir = jobs_dir
+        os.makedirs(jobs_dir, exist_ok=True)
+
+    def path(self, job_id: str) -> str:
+        return os.path.join(self.jobs_dir, f"{job_id}.json")
+
+    def cancel_path(self, job_id: str) -> str:
+        return os.path.join(self.jobs_dir, f"{job_id}.cancel")
+
+    def load(self, job_id: str) -> Optional[dict]:
+        try:
+            with open(self.path(job_id)) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            logger.error(f"[jobs] Не удалось прочитать задачу {job_id}: {e}")
+            return None
+
+    def save(self, job: dict) -> None:
+        """Атомарно перезаписывает файл задачи (через временный файл и os.replace)."""
+        job["updated_at"] = time.time()
+        path = self.path(job["id"])
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(job, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+    def list(self) -> List[dict]:
+        jobs = []
+        for name in os.listdir(self.jobs_dir):
+            if name.endswith(".json"):
+                job = self.load(name[:-len(".json")])
+                if job is not None:
+                    jobs.append(job)
+        return sorted(jobs, key=lambda job: job["created_at"])
+
+    def request_cancel(self, job_id: str) -> None:
+        open(self.cancel_path(job_id), "w").close()
+
+    def cancel_requested(self, job_id: str) -> bool:
+        return os.path.exists(self.cancel_path(job_id))
+
+    def lock_path(self, job_id: str) -> str:
+        return os.path.join(self.jobs_dir, f"{job_id}.lock")
+
+    def try_lock(self, job_id: str) -> Optional[int]:
+        """
+        Захватывает задачу (эксклюзивный fcntl.flock на <id>.lock без ожидания). Возвращает дескриптор
+        блокировки или None, если задачей уже владеет другой процесс. Блокировка снимается unlock
+        или автоматически при завершении процесса-владельца.
+        """
+        fd = os.open(self.lock_path(job_id), os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            os.close(fd)
+            return None
+        return fd
+
+    @staticmethod
+    def unlock(fd: int) -> None:
+        try:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+        finally:
+            os.close(fd)
+
+    def clear_cancel(self, job_id: str) -> None:
+        try:
+            os.remove(self.cancel_path(job_id))
+        except FileNotFoundError:
+            pass
+
+
+def run_job(indexer, jobs_dir: str, job_id: str, checkpoint_interval: float = 5.0) -> dict:
+    """
+    Выполняет задачу индексации там, где идёт индексация (см. IngestionRunner.call).
+
+    Директории, завершённые в предыдущих запусках (done_dirs), пропускаются до скачивания и очистки;
+    новые завершённые директории и прогресс конвейера сохраняются в файл задачи не реже
+    checkpoint_interval секунд. Запрос отмены (файл <id>.cancel) проверяется раз в секунду.
+    """
+    store = JobStore(jobs_dir)
+    job = store.load(job_id)
+    if job is None:
+        raise ValueError(f"Задача {job_id} не найдена")
+    if store.cancel_requested(job_id):
+        job.update(status="cancelled", finished_at=time.time())
+        store.save(job)
+        store.clear_cancel(job_id)
+        return job
+
+    done_dirs = set(job.get("done_dirs", []))
+    lock = threading.Lock()
+    last_saved = [0.0]
+    cancel_event = threading.Event()
+    finished = threading.Event()
+    job.update(
+        status="running",
+        started_at=time.time(),
+        finished_at=None,
+        attempts=job.get("attempts", 0) + 1,
+        # Изображения, загруженные в прошлых запусках; прогресс текущего запуска — в progress
+        images_done_before=job.get("images_done_before", 0) + job.get("progress", {}).get("images_done", 0),
+        progress={},
+        error=None,
+    )
+    store.save(job)
+
+    def checkpoint(force: bool = False) -> None:
+        with lock:
+            if not force and time.time() - last_saved[0] < checkpoint_interval:
+                return
+            job["done_dirs"] = sorted(done_dirs)
+            store.save(job)
+            last_saved[0] = time.time()
+
+    def on_directory_done(directory: str) -> None:
+        with lock:
+            done_dirs.add(directory)
+        checkpoint()
+
+    def on_progress(stats: dict) -> None:
+        with lock:
+            job["progress"] = {**stats, "stage_seconds": dict(stats.get("stage_seconds", {}))}
+        checkpoint()
+
+    def watch_cancel() -> None:
+        while not finished.wait(1.0):
+            if store.cancel_requested(job_id):
+                cancel_event.set()
+                return
+
+    threading.Thread(target=watch_cancel, name=f"job-cancel-{job_id}", daemon=True).start()
+    logger.info(f"[jobs] Задача {job_id}: {job['folder_path']} (запуск {job['attempts']}, "
+                f"завершённых директорий {len(done_dirs)})")
+    try:
+        stats = indexer.process_image_folder(
+            job["folder_path"], job["batch_size"], show_progress=False,
+            skip_dirs=set(done_dirs),
+            on_directory_done=on_directory_done,
+            progress_callback=on_progress,
+            cancel_event=cancel_event,
+        )
+    except Exception as e:
+        logger.error(f"[jobs] Задача {job_id} завершилась ошибкой: {e}", exc_info=True)
+        with lock:
+            job.update(status="failed", error=str(e), finished_at=time.time())
+        checkpoint(force=True)
+        raise
+    finally:
+        finished.set()
+
+    with lock:
+        job.update(
+            status="cancelled" if stats.get("cancelled") else "completed",
+            progress={**stats, "stage_seconds": dict(stats["stage_seconds"])},
+            finished_at=time.time(),
+        )
+    checkpoint(force=True)
+    store.clear_cancel(job_id)
+    logger.info(f"[jobs] Задача {job_id}: {job['status']}")
+    return job
+
+
+class IngestionJobManager:
+    """
+    Задачи индексации с идентификаторами, прогрессом, отменой и возобновлением.
+
+    Каждая задача — вызов process_image_folder через IngestionRunner (число одновременно выполняемых
+    задач ограничено его max_workers). Состояние и контрольные точки хранятся в jobs_dir (JobStore),
+    поэтому после перезапуска сервиса resume_pending() снова ставит в очередь незавершённые задачи,
+    и они продолжаются с последних завершённых директорий.
+
+    Задачу выполняет только владелец её блокировки (JobStore.try_lock): менеджер держит её от постановки
+    в очередь до завершения, поэтому несколько воркеров или экземпляров с общим jobs_dir не запускают
+    одну задачу дважды; задачи упавшего экземпляра возобновит первый перезапущенный.
+    Если аварийно завершился процесс индексации (BrokenProcessPool: OOM, сигнал), задача снова ставится
+    в очередь с контрольной точки, пока число запусков меньше max_attempts; упавшие и отменённые задачи
+    можно продолжить вручную через resume().
+
+    Аргументы:
+      runner (IngestionRunner): Исполнитель индексации.
+      jobs_dir (str): Директория файлов задач.
+      checkpoint_interval (float): Как часто (с) задача сохраняет прогресс.
+      max_attempts (int): Сколько раз задача запускается, прежде чем падение процесса индексации станет failed.
+    """
+    def __init__(self, runner: IngestionRunner, jobs_dir: str, checkpoint_interval: float = 5.0,
+                 max_attempts: int = 3):
+        self.runner = runner
+        self.store = JobStore(jobs_dir)
+        self.checkpoint_interval = checkpoint_interval
+        self.max_attempts = max(1, max_attempts)
+        self._futures: Dict[str, Future] = {}
+        self._job_locks: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def submit(self, folder_path: str, batch_size: int = 32) -> dict:
+        """Создаёт задачу и ставит её в очередь."""
+        job = {
+            "id": uuid.uuid4().hex,
+            "folder_path": folder_path,
+            "batch_size": batch_size,
+            "status": "queued",
+            "created_at": time.time(),
+            "started_at": None,
+            "finished_at": None,
+            "attempts": 0,
+            "done_dirs": [],
+            "progress": {},
+            "error": None,
+        }
+        lock_fd = self.store.try_lock(job["id"])
+        self.store.save(job)
+        self._enqueue(job["id"], lock_fd)
+        return self.describe(job)
+
+    def _enqueue(self, job_id: str, lock_fd: int) -> None:
+        """Ставит захваченную задачу в очередь; блокировка снимается после её завершения (_on_done)."""
+        with self._lock:
+            self._job_locks[job_id] = lock_fd
+        try:
+            future = self.runner.call(run_job, self.store.jobs_dir, job_id, self.checkpoint_interval)
+        except Exception:
+            self._release(job_id)
+            raise
+        with self._lock:
+            self._futures[job_id] = future
+        future.add_done_callback(lambda f: self._on_done(job_id, f))
+
+    def _release(self, job_id: str) -> None:
+        with self._lock:
+            lock_fd = self._job_locks.pop(job_id, None)
+        if lock_fd is not None:
+            self.store.unlock(lock_fd)
+
+    def _on_done(self, job_id: str, future: Future) -> None:
+        with self._lock:
+            self._futures.pop(job_id, None)
+        requeue = False
+        try:
+            job = self.store.load(job_id)
+            if job is None or job["status"] not in ACTIVE_STATES:
+                return
+            # Задача не записала итог сама: отменена в очереди или процесс индексации упал
+            if future.cancelled():
+                job.update(status="cancelled", finished_at=time.time())
+            else:
+                error = future.exception()
+                if job["status"] == "queued":
+                    # Процесс упал до начала задачи (например, в инициализаторе) — запуск тоже засчитывается
+                    job["attempts"] = job.get("attempts", 0) + 1
+                if (isinstance(error, BrokenProcessPool) and not self.store.cancel_requested(job_id)
+                        and job.get("attempts", 0) < self.max_attempts):
+                    requeue = True
+                    job.update(status="queued", error=str(error) or "Процесс индексации завершился аварийно")
+                    logger.warning(f"[jobs] Задача {job_id}: процесс индексации упал (запуск {job['attempts']} "
+                                   f"из {self.max_attempts}), задача продолжится с контрольной точки")
+                else:
+                    job.update(status="failed", finished_at=time.time(),
+                               error=str(error) if error else "Задача завершилась без результата")
+            self.store.save(job)
+            if not requeue:
+                self.store.clear_cancel(job_id)
+        finally:
+            if not requeue:
+                self._release(job_id)
+        if requeue:
+            # Из отдельного потока: колбэк вызывается исполнителем, пул которого только что сломался
+            threading.Thread(target=self._requeue, args=(job_id,), name=f"job-requeue-{job_id}",
+                             daemon=True).start()
+
+    def _requeue(self, job_id: str) -> None:
+        """Снова ставит задачу в очередь, не отпуская её блокировку (IngestionRunner поднимет новый процесс)."""
+        with self._lock:
+            lock_fd = self._job_locks.get(job_id)
+        try:
+            self._enqueue(job_id, lock_fd)
+        except Exception as e:
+            logger.error(f"[jobs] Не удалось снова поставить задачу {job_id} в очередь: {e}")
+            job = self.store.load(job_id)
+            if job is not None:
+                job.update(status="failed", error=str(e), finished_at=time.time())
+                self.store.save(job)
+
+    def resume_pending(self) -> List[str]:
+        """
+        Ставит в очередь задачи, прерванные перезапуском сервиса; возвращает их идентификаторы.
+        Задачи, которыми владеет другой воркер или экземпляр (их блокировка занята), не трогает.
+        """
+        resumed = []
+        for job in self.store.list():
+            if job["status"] not in ACTIVE_STATES or job["id"] in self._futures:
+                continue
+            lock_fd = self.store.try_lock(job["id"])
+            if lock_fd is None:
+                continue
+            # Состояние перечитывается под блокировкой: прежний владелец мог успеть завершить задачу
+            job = self.store.load(job["id"])
+            if job is None or job["status"] not in ACTIVE_STATES:
+                self.store.unlock(lock_fd)
+                continue
+            job["status"] = "queued"
+            self.store.save(job)
+            self._enqueue(job["id"], lock_fd)
+            resumed.append(job["id"])
+        if resumed:
+            logger.info(f"[jobs] Возобновлены задачи: {resumed}")
+        return resumed
+
+    def resume(self, job_id: str) -> Optional[dict]:
+        """
+        Снова ставит в очередь упавшую или отменённую задачу; она продолжится с контрольной точки
+        (done_dirs сохраняются). Активная задача возвращается как есть, завершённую продолжить нельзя
+        (ValueError). Возвращает None, если задачи нет.
+        """
+        job = self.store.load(job_id)
+        if job is None:
+            return None
+        if job["status"] == "completed":
+            raise ValueError(f"Задача {job_id} уже завершена")
+        if job["status"] in ACTIVE_STATES:
+            return self.describe(job)
+        lock_fd = self.store.try_lock(job_id)
+        if lock_fd is None:
+            # Задачу уже возобновил другой воркер или экземпляр
+            return self.describe(self.store.load(job_id))
+        # Состояние перечитывается под блокировкой, как в resume_pending
+        job = self.store.load(job_id)
+        if job is None or job["status"] not in ("failed", "cancelled"):
+            self.store.unlock(lock_fd)
+            return self.describe(job) if job is not None else None
+        self.store.clear_cancel(job_id)
+        job.update(status="queued", finished_at=None, error=None)
+        self.store.save(job)
+        self._enqueue(job_id, lock_fd)
+        logger.info(f"[jobs] Задача {job_id} возобновлена с {len(job.get('done_dirs', []))} завершённых директорий")
+        return self.describe(job)
+
+    def cancel(self, job_id: str) -> Optional[dict]:
+        """Отменяет задачу: из очереди — сразу, выполняющуюся — после текущих батчей."""
+        job = self.store.load(job_id)
+        if job is None:
+            return None
+        if job["status"] in ACTIVE_STATES:
+            with self._lock:
+                future = self._futures.get(job_id)
+            if future is None or not future.cancel():
+                self.store.request_cancel(job_id)
+            job = self.store.load(job_id)
+        return self.describe(job)
+
+    def get(self, job_id: str) -> Optional[dict]:
+        job = self.store.load(job_id)
+        return self.describe(job) if job is not None else None
+
+    def list(self) -> List[dict]:
+        return [self.describe(job) for job in self.store.list()]
+
+    def describe(self, job: dict) -> dict:
+        """
+        Публичное представление задачи: без списка директорий (он может быть большим),
+        со скоростью (изображений/с) и оценкой оставшегося времени по уже перечисленным изображениям.
+        """
+        progress = job.get("progress") or {}
+        view = {key: value for key, value in job.items() if key != "done_dirs"}
+        view["done_dirs"] = len(job.get("done_dirs", []))
+        view["images_done_total"] = job.get("images_done_before", 0) + progress.get("images_done", 0)
+        view["cancel_requested"] = self.store.cancel_requested(job["id"])
+        images_per_second, eta = None, None
+        if job.get("started_at"):
+            elapsed = (job.get("finished_at") or time.time()) - job["started_at"]
+            if elapsed > 0 and progress.get("images_done"):
+                images_per_second = progress["images_done"] / elapsed
+                remaining = (progress.get("images_listed", 0) - progress.get("images_skipped", 0)
+                             - progress["images_done"])
+                if job["status"] == "running":
+                    eta = max(0, remaining) / images_per_second
+        view["images_per_second"] = images_per_second
+        view["eta_seconds"] = eta
+        return view
@@ -0,0 +1,93 @@
+"""
+Метрики Prometheus горячего пути: время и число элементов по стадиям (скачивание из S3, декодирование,
+предобработка, прямой проход модели, EXIF, мэтчер, загрузка в Qdrant, поиск), обращения к кэшам и глубина очередей.
+
+Метрики отдаёт GET /metrics (см. render_metrics). Если задан PROMETHEUS_MULTIPROC_DIR (пустой каталог, общий
+для процессов), собираются метрики всех процессов: воркеров gunicorn, процесса индексации (INGEST_MODE=process)
+и пула предобработки (PREPROCESS_BACKEND=process).
+
+Поштучные сообщения (каждая пара изображений, каждое попадание в кэш) пишутся через debug_sampled — только
+при уровне DEBUG и лишь каждое LOG_SAMPLE_EVERY-е, чтобы логирование не занимало время в горячих циклах.
+"""
+import os
+import time
+import logging
+import itertools
+from contextlib import contextmanager
+from typing import Iterator, Tuple
+
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Gauge, Histogram, generate_latest
+
+# Каждое N-е поштучное сообщение по ключу попадает в debug-лог (1 — все)
+LOG_SAMPLE_EVERY = max(1, int(os.getenv("LOG_SAMPLE_EVERY", "100")))
+
+_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+STAGE_SECONDS = Histogram(
+    "geo_stage_seconds", "Время операции стадии (один вызов: файл, батч, пара, запрос)",
+    ["stage"], buckets=_BUCKETS,
+)
+STAGE_ITEMS = Counter("geo_stage_items_total", "Обработано элементов по стадиям (изображений, пар, точек)", ["stage"])
+STAGE_ERRORS = Counter("geo_stage_errors_total", "Ошибки по стадиям", ["stage"])
+CACHE_REQUESTS = Counter("geo_cache_requests_total", "Обращения к кэшам по результату (hit/miss)", ["cache", "result"])
+HTTP_SECONDS = Histogram(
+    "geo_http_request_seconds", "Время ответа HTTP по маршрутам", ["method", "route", "status"], buckets=_BUCKETS,
+)
+QUEUE_DEPTH = Gauge("geo_queue_depth", "Глубина очередей (батчей, запросов, запросов загрузки в полёте)", ["queue"],
+                    multiprocess_mode="livesum")
+
+_sample_counters = {}
+
+
+@contextmanager
+def timed(stage: str, items: int = 1) -> Iterator[None]:
+    """Замеряет время блока в geo_stage_seconds; при успехе добавляет items к geo_stage_items_total, при исключении — ошибку."""
+    started = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        STAGE_ERRORS.labels(stage).inc()
+        raise
+    finally:
+        STAGE_SECONDS.labels(stage).observe(time.perf_counter() - started)
+    STAGE_ITEMS.labels(stage).inc(items)
+
+
+def observe(stage: str, seconds: float, items: int = 1) -> None:
+    """Учитывает уже измеренную операцию (когда блок неудобно обернуть в timed)."""
+    STAGE_SECONDS.labels(stage).observe(seconds)
+    STAGE_ITEMS.labels(stage).inc(items)
+
+
+def cache_result(cache: str, hit: bool) -> None:
+    CACHE_REQUESTS.labels(cache, "hit" if hit else "miss").inc()
+
+
+def observe_request(method: str, route: str, status: int, seconds: float) -> None:
+    HTTP_SECONDS.labels(method, route, str(status)).observe(seconds)
+
+
+def set_queue_depth(queue: str, depth: int) -> None:
+    QUEUE_DEPTH.labels(queue).set(depth)
+
+
+def debug_sampled(logger: logging.Logger, key: str, message: str, *args) -> None:
+    """Пишет debug-сообщение (формат logging, %-аргументы) только для каждого LOG_SAMPLE_EVERY-го вызова с этим ключом."""
+    if not logger.isEnabledFor(logging.DEBUG):
+        return
+    counter = _sample_counters.get(key)
+    if counter is None:
+        counter = _sample_counters.setdefault(key, itertools.count())
+    if next(counter) % LOG_SAMPLE_EVERY == 0:
+        logger.debug(message, *args)
+
+
+def render_metrics() -> Tuple[bytes, str]:
+    """Метрики в текстовом формате Prometheus и их Content-Type."""
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        from prometheus_client import multiprocess
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
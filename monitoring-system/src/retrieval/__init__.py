@@ -1,15 +1,19 @@
 from .base_client import BaseQdrantClient
 from .indexer import ImageQdrantIndexer
+from .uploader import QdrantUploader
 
-from .processing import ImageDataProcessor, ImageBatchProcessor, FolderScanner
-from .utils import ImageMetadataExtractor, S3ImageHandler
+from .processing import ImageDataProcessor, ImageBatchProcessor, FolderScanner, IngestionPipeline
+from .utils import ImageMetadataExtractor, S3ImageHandler, LRUCache
 
 __all__ = [
     "BaseQdrantClient",
     "ImageQdrantIndexer",
+    "QdrantUploader",
     "ImageDataProcessor",
     "ImageBatchProcessor",
     "FolderScanner",
+    "IngestionPipeline",
     "ImageMetadataExtractor",
     "S3ImageHandler",
+    "LRUCache",
 ]
@@ -1,14 +1,131 @@
-from qdrant_client import QdrantClient
+import asyncio
+import threading
+from typing import Optional
+from qdrant_client import AsyncQdrantClient, QdrantClient
 from qdrant_client.http import models
+from qdrant_client.http.exceptions import UnexpectedResponse
+
+# Профили хранения векторов:
+#   memory — float32 в RAM (как раньше);
+#   disk   — float32 на диске (mmap), в RAM только граф HNSW;
+#   scalar — int8-квантование в RAM (в 4 раза меньше памяти), оригиналы на диске для rescoring;
+#   binary — бинарное квантование в RAM (в 32 раза меньше), оригиналы на диске, поиск с oversampling.
+STORAGE_PROFILES = ("memory", "disk", "scalar", "binary")
+
+
+def make_search_params(profile: str, hnsw_ef: Optional[int] = None, exact: bool = False,
+                       oversampling: Optional[float] = None, rescore: Optional[bool] = None) -> Optional[models.SearchParams]:
+    """
+    Собирает параметры поиска Qdrant. Для квантованных профилей по умолчанию включается rescoring
+    по оригинальным векторам, для бинарного — ещё и oversampling x2 (иначе заметно падает recall).
+    """
+    if profile in ("scalar", "binary"):
+        if rescore is None:
+            rescore = True
+        if oversampling is None and profile == "binary":
+            oversampling = 2.0
+    quantization = None
+    if oversampling is not None or rescore is not None:
+        quantization = models.QuantizationSearchParams(oversampling=oversampling, rescore=rescore)
+    if hnsw_ef is None and not exact and quantization is None:
+        return None
+    return models.SearchParams(hnsw_ef=hnsw_ef, exact=exact, quantization=quantization)
+
+
+class _SerializedClient:
+    """
+    Клиент локального режима Qdrant для нескольких потоков: локальное хранилище не рассчитано
+    на одновременные вызовы (поиск во время upsert), поэтому вызовы выполняются по очереди.
+    """
+    def __init__(self, client: QdrantClient):
+        self._client = client
+        self._lock = threading.RLock()
+
+    def __getattr__(self, name: str):
+        attr = getattr(self._client, name)
+        if not callable(attr):
+            return attr
+
+        def call(*args, **kwargs):
+            with self._lock:
+                return attr(*args, **kwargs)
+        return call
+
+
+class _AsyncLocalClient:
+    """
+    Асинхронный интерфейс к клиенту локального режима: каталог хранилища может открыть только
+    один клиент, поэтому вызовы идут в синхронный клиент через пул потоков.
+    """
+    def __init__(self, client: _SerializedClient):
+        self._client = client
+
+    def __getattr__(self, name: str):
+        method = getattr(self._client, name)
+
+        async def call(*args, **kwargs):
+            return await asyncio.to_thread(method, *args, **kwargs)
+        return call
+
+    async def close(self) -> None:
+        # Синхронный клиент продолжает работать; его закрывает владелец
+        pass
+
 
 class BaseQdrantClient:
+    # Индексы payload, по которым фильтруется поиск: без них каждый отфильтрованный запрос
+    # просматривает payload всех точек коллекции
+    payload_indexes = {
+        "location": models.PayloadSchemaType.GEO,
+        "timestamp": models.PayloadSchemaType.FLOAT,
+    }
+
     def __init__(self, qdrant_host: str = "qdrant", qdrant_port: int = 6333,
-                 collection_name: str = "geo_embeddings", vector_size: int = 512):
-        self.client = QdrantClient(host=qdrant_host, port=qdrant_port)
+                 collection_name: str = "geo_embeddings", vector_size: int = 512,
+                 prefer_grpc: bool = False, grpc_port: int = 6334,
+                 storage_profile: str = "memory", hnsw_m: Optional[int] = None,
+                 hnsw_ef_construct: Optional[int] = None, qdrant_path: Optional[str] = None):
+        # qdrant_path: встроенный (локальный) режим Qdrant без сервера — каталог хранилища или ":memory:";
+        # фильтры и API те же, поиск — точный перебор в процессе (подходит до ~сотен тысяч точек)
+        self.local = qdrant_path is not None
+        if self.local:
+            local_client = QdrantClient(location=":memory:") if qdrant_path == ":memory:" else QdrantClient(path=qdrant_path)
+            self.client = _SerializedClient(local_client)
+        else:
+            # prefer_grpc: бинарный gRPC-транспорт вместо JSON по HTTP (быстрее для пакетных upsert)
+            self.client = QdrantClient(host=qdrant_host, port=qdrant_port, grpc_port=grpc_port, prefer_grpc=prefer_grpc)
+        self._client_kwargs = {"host": qdrant_host, "port": qdrant_port, "grpc_port": grpc_port, "prefer_grpc": prefer_grpc}
+        self._async_client: Optional[AsyncQdrantClient] = None
         self.collection_name = collection_name
         self.vector_size = vector_size
+        if storage_profile not in STORAGE_PROFILES:
+            raise ValueError(f"Неизвестный профиль хранения: {storage_profile} (доступны: {', '.join(STORAGE_PROFILES)})")
+        self.storage_profile = storage_profile
+        self.hnsw_m = hnsw_m
+        self.hnsw_ef_construct = hnsw_ef_construct
         self._connect_collection()
 
+    @property
+    def async_client(self) -> AsyncQdrantClient:
+        """
+        Асинхронный клиент Qdrant для вызовов из event loop (создаётся при первом обращении,
+        чтобы соединения открывались в том loop, где будут использоваться).
+        """
+        if self._async_client is None:
+            if self.local:
+                self._async_client = _AsyncLocalClient(self.client)
+            else:
+                self._async_client = AsyncQdrantClient(**self._client_kwargs)
+        return self._async_client
+
+    async def aclose(self) -> None:
+        """Закрывает соединения асинхронного клиента (в локальном режиме — освобождает каталог хранилища)."""
+        if self._async_client is not None:
+            await self._async_client.close()
+            self._async_client = None
+        if self.local:
+            self.client.close()
+
     def _connect_collection(self):
         try:
             collections = self.client.get_collections().collections
@@ -18,15 +135,99 @@ class BaseQdrantClient:
             else:
                 self.client.create_collection(
                     collection_name=self.collection_name,
-                    vectors_config=models.VectorParams(
-                        size=self.vector_size,
-                        distance=models.Distance.COSINE,
-                    ),
+                    **self.collection_config(self.storage_profile, self.vector_size,
+                                             self.hnsw_m, self.hnsw_ef_construct),
                 )
-                print(f"Коллекция '{self.collection_name}' создана")
+                print(f"Коллекция '{self.collection_name}' создана (профиль хранения '{self.storage_profile}')")
+            if not self.local:
+                # В локальном режиме индексы payload не используются (фильтры применяются перебором)
+                self._ensure_payload_indexes()
         except Exception as e:
             print(f"❌ Ошибка при подключении или создании коллекции: {str(e)}")
 
+    def _ensure_payload_indexes(self):
+        """Создаёт недостающие индексы payload (в том числе для уже существующей коллекции)."""
+        existing = self.client.get_collection(self.collection_name).payload_schema or {}
+        for field_name, field_schema in self.payload_indexes.items():
+            if field_name in existing:
+                continue
+            self.client.create_payload_index(
+                collection_name=self.collection_name,
+                field_name=field_name,
+                field_schema=field_schema,
+                wait=True,
+            )
+            print(f"Создан индекс payload '{field_name}' ({field_schema.value}) в коллекции '{self.collection_name}'")
+
+    @staticmethod
+    def collection_config(profile: str, vector_size: int, hnsw_m: Optional[int] = None,
+                          hnsw_ef_construct: Optional[int] = None) -> dict:
+        """
+        Возвращает аргументы create_collection для профиля хранения:
+        vectors_config, quantization_config и hnsw_config.
+        """
+        quantization = None
+        if profile == "scalar":
+            quantization = models.ScalarQuantization(scalar=models.ScalarQuantizationConfig(
+                type=models.ScalarType.INT8, quantile=0.99, always_ram=True,
+            ))
+        elif profile == "binary":
+            quantization = models.BinaryQuantization(binary=models.BinaryQuantizationConfig(always_ram=True))
+        hnsw = None
+        if hnsw_m is not None or hnsw_ef_construct is not None:
+            hnsw = models.HnswConfigDiff(m=hnsw_m, ef_construct=hnsw_ef_construct)
+        return {
+            "vectors_config": models.VectorParams(
+                size=vector_size,
+                distance=models.Distance.COSINE,
+                on_disk=profile != "memory",
+            ),
+            "quantization_config": quantization,
+            "hnsw_config": hnsw,
+        }
+
+    def apply_storage_profile(self) -> bool:
+        """
+        Переводит существующую коллекцию на текущий профиль хранения и параметры HNSW.
+        Qdrant перестраивает сегменты в фоне; поиск во время перестройки продолжает работать.
+        """
+        config = self.collection_config(self.storage_profile, self.vector_size, self.hnsw_m, self.hnsw_ef_construct)
+        try:
+            self.client.update_collection(
+                collection_name=self.collection_name,
+                vectors_config={"": models.VectorParamsDiff(on_disk=config["vectors_config"].on_disk)},
+                quantization_config=config["quantization_config"] or models.Disabled.DISABLED,
+                hnsw_config=config["hnsw_config"],
+            )
+            print(f"Коллекция '{self.collection_name}' переведена на профиль хранения '{self.storage_profile}'")
+            return True
+        except Exception as e:
+            print(f"❌ Ошибка смены профиля хранения: {str(e)}")
+            return False
+
+    def search_params(self, hnsw_ef: Optional[int] = None, exact: bool = False,
+                      oversampling: Optional[float] = None, rescore: Optional[bool] = None) -> Optional[models.SearchParams]:
+        """Параметры поиска Qdrant с умолчаниями текущего профиля хранения (см. make_search_params)."""
+        return make_search_params(self.storage_profile, hnsw_ef, exact, oversampling, rescore)
+
+    @staticmethod
+    def is_not_found(error: BaseException) -> bool:
+        """
+        Ошибка «точка не найдена» от любого вида клиента: HTTP (404), gRPC (NOT_FOUND)
+        и локального режима (ValueError «... is not found in the collection»).
+        """
+        if isinstance(error, UnexpectedResponse):
+            return error.status_code == 404
+        if isinstance(error, ValueError):
+            return "not found" in str(error).lower()
+        try:
+            import grpc
+        except ImportError:
+            return False
+        if isinstance(error, grpc.RpcError) and hasattr(error, "code"):
+            return error.code() == grpc.StatusCode.NOT_FOUND or "not found" in (error.details() or "").lower()
+        return False
+
     def delete_collection(self) -> bool:
         try:
             self.client.delete_collection(collection_name=self.collection_name)
@@ -0,0 +1,230 @@
+"""
+Отчёт «recall против задержки» для профилей хранения Qdrant.
+
+Из рабочей коллекции берётся выборка векторов; часть из них служит запросами, остальные
+загружаются во временные коллекции с разными профилями хранения (см. STORAGE_PROFILES).
+Для каждой комбинации профиля и параметров поиска (hnsw_ef, oversampling) измеряются
+recall@k относительно точного поиска и задержки запросов.
+
+Запуск:
+    python -m src.retrieval.evaluation --host qdrant --collection geo_embeddings \\
+        --profiles memory,scalar,binary --hnsw-ef 0,64,128,256 --oversampling 0,2,4 --output report.json
+"""
+import json
+import time
+import logging
+import argparse
+from itertools import product
+from typing import List, Optional, Sequence, Tuple
+
+import numpy as np
+from qdrant_client import QdrantClient
+from qdrant_client.http import models
+
+from .base_client import BaseQdrantClient, STORAGE_PROFILES, make_search_params
+
+logger = logging.getLogger(__name__)
+
+
+def sample_vectors(client: QdrantClient, collection_name: str, limit: int,
+                   page_size: int = 1024) -> Tuple[list, np.ndarray]:
+    """Читает до limit точек коллекции вместе с векторами."""
+    ids, vectors = [], []
+    offset = None
+    while len(ids) < limit:
+        records, offset = client.scroll(
+            collection_name=collection_name,
+            limit=min(page_size, limit - len(ids)),
+            offset=offset,
+            with_payload=False,
+            with_vectors=True,
+        )
+        for record in records:
+            ids.append(record.id)
+            vectors.append(record.vector)
+        if offset is None:
+            break
+    return ids, np.asarray(vectors, dtype=np.float32)
+
+
+def exact_top_k(queries: np.ndarray, vectors: np.ndarray, ids: Sequence, top_k: int) -> List[set]:
+    """Точные ближайшие соседи по косинусной близости (эталон для recall)."""
+    def normalize(x):
+        return x / np.clip(np.linalg.norm(x, axis=1, keepdims=True), 1e-12, None)
+    scores = normalize(queries) @ normalize(vectors).T
+    top = np.argsort(-scores, axis=1)[:, :top_k]
+    return [{ids[i] for i in row} for row in top]
+
+
+def build_collection(client: QdrantClient, name: str, profile: str, ids: Sequence, vectors: np.ndarray,
+                     hnsw_m: Optional[int] = None, hnsw_ef_construct: Optional[int] = None,
+                     batch_size: int = 512, timeout: float = 600.0) -> None:
+    """Создаёт временную коллекцию с профилем хранения, загружает векторы и ждёт построения индекса."""
+    if client.collection_exists(name):
+        client.delete_collection(name)
+    client.create_collection(
+        collection_name=name,
+        # Маленький порог индексации: иначе выборка целиком останется в неиндексированном сегменте
+        optimizers_config=models.OptimizersConfigDiff(indexing_threshold=1),
+        **BaseQdrantClient.collection_config(profile, vectors.shape[1], hnsw_m, hnsw_ef_construct),
+    )
+    for start in range(0, len(ids), batch_size):
+        client.upsert(
+            collection_name=name,
+            points=models.Batch(ids=list(ids[start:start + batch_size]),
+                                vectors=vectors[start:start + batch_size].tolist()),
+            wait=True,
+        )
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        info = client.get_collection(name)
+        if info.status == models.CollectionStatus.GREEN and (info.indexed_vectors_count or 0) >= len(ids):
+            return
+        time.sleep(1.0)
+    logger.warning(f"[evaluation] Индекс коллекции '{name}' не построен за {timeout:.0f} с, замеры могут быть неточны")
+
+
+def measure(client: QdrantClient, name: str, queries: np.ndarray, truth: List[set], top_k: int,
+            params: Optional[models.SearchParams], warmup: int = 10) -> dict:
+    """Прогоняет запросы последовательно и возвращает recall@k и перцентили задержки (мс)."""
+    for query in queries[:warmup]:
+        client.query_points(collection_name=name, query=query.tolist(), search_params=params, limit=top_k)
+    latencies, recalls = [], []
+    for query, expected in zip(queries, truth):
+        started = time.perf_counter()
+        hits = client.query_points(collection_name=name, query=query.tolist(), search_params=params, limit=top_k).points
+        latencies.append((time.perf_counter() - started) * 1000)
+        recalls.append(len({hit.id for hit in hits} & expected) / max(1, len(expected)))
+    latencies = np.asarray(latencies)
+    return {
+        f"recall@{top_k}": float(np.mean(recalls)),
+        "latency_ms_mean": float(latencies.mean()),
+        "latency_ms_p50": float(np.percentile(latencies, 50)),
+        "latency_ms_p95": float(np.percentile(latencies, 95)),
+        "latency_ms_p99": float(np.percentile(latencies, 99)),
+    }
+
+
+def ram_bytes_per_vector(profile: str, dim: int) -> int:
+    """Оценка памяти под векторы одной точки без учёта графа HNSW."""
+    return {"memory": 4 * dim, "disk": 0, "scalar": dim, "binary": dim // 8}[profile]
+
+
+def profile_report(client: QdrantClient, collection_name: str,
+                   profiles: Sequence[str] = STORAGE_PROFILES, sample_size: int = 20000,
+                   num_queries: int = 200, top_k: int = 10,
+                   hnsw_efs: Sequence[Optional[int]] = (None, 64, 128, 256),
+                   oversamplings: Sequence[Optional[float]] = (None, 2.0, 4.0),
+                   hnsw_m: Optional[int] = None, hnsw_ef_construct: Optional[int] = None,
+                   keep_collections: bool = False) -> dict:
+    """
+    Строит отчёт по профилям хранения.
+
+    Возвращает:
+      dict: параметры замера и строки results — по одной на (профиль, hnsw_ef, oversampling)
+        с recall@k, задержками и оценкой памяти на вектор.
+    """
+    ids, vectors = sample_vectors(client, collection_name, sample_size + num_queries)
+    if len(ids) <= num_queries:
+        raise ValueError(f"В коллекции '{collection_name}' слишком мало точек для замера: {len(ids)}")
+    queries, ids, vectors = vectors[:num_queries], ids[num_queries:], vectors[num_queries:]
+    truth = exact_top_k(queries, vectors, ids, top_k)
+    dim = vectors.shape[1]
+
+    results = []
+    for profile in profiles:
+        name = f"{collection_name}__eval_{profile}"
+        logger.info(f"[evaluation] Профиль '{profile}': загрузка {len(ids)} векторов в '{name}'")
+        # oversampling имеет смысл только для квантованных профилей
+        profile_oversamplings = oversamplings if profile in ("scalar", "binary") else (None,)
+        seen = set()
+        try:
+            build_collection(client, name, profile, ids, vectors, hnsw_m, hnsw_ef_construct)
+            for hnsw_ef, oversampling in product(hnsw_efs, profile_oversamplings):
+                params = make_search_params(profile, hnsw_ef=hnsw_ef, oversampling=oversampling)
+                # Умолчания профиля (например, oversampling x2 для binary) могут совпасть с явным значением
+                effective = params.quantization.oversampling if params and params.quantization else None
+                if (hnsw_ef, effective) in seen:
+                    continue
+                seen.add((hnsw_ef, effective))
+                row = {
+                    "profile": profile,
+                    "hnsw_ef": hnsw_ef,
+                    "oversampling": effective,
+                    "ram_bytes_per_vector": ram_bytes_per_vector(profile, dim),
+                }
+                row.update(measure(client, name, queries, truth, top_k, params))
+                logger.info(f"[evaluation] {row}")
+                results.append(row)
+        finally:
+            if not keep_collections:
+                client.delete_collection(name)
+    return {
+        "collection": collection_name,
+        "points": len(ids),
+        "queries": num_queries,
+        "top_k": top_k,
+        "dim": dim,
+        "hnsw_m": hnsw_m,
+        "hnsw_ef_construct": hnsw_ef_construct,
+        "results": results,
+    }
+
+
+def format_report(report: dict) -> str:
+    """Таблица отчёта для вывода в консоль."""
+    recall_key = f"recall@{report['top_k']}"
+    lines = [f"{'profile':<8} {'hnsw_ef':>7} {'overs.':>6} {recall_key:>10} {'p50 ms':>8} {'p95 ms':>8} {'RAM B/vec':>9}"]
+    for row in report["results"]:
+        lines.append(
+            f"{row['profile']:<8} {str(row['hnsw_ef'] or '-'):>7} {str(row['oversampling'] or '-'):>6} "
+            f"{row[recall_key]:>10.4f} {row['latency_ms_p50']:>8.2f} {row['latency_ms_p95']:>8.2f} "
+            f"{row['ram_bytes_per_vector']:>9}"
+        )
+    return "\n".join(lines)
+
+
+def _optional_numbers(value: str, cast) -> list:
+    # 0 в списке означает «по умолчанию» (параметр не передаётся)
+    return [cast(v) or None for v in value.split(",") if v]
+
+
+def main(argv: Optional[Sequence[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Recall/latency report for Qdrant storage profiles")
+    parser.add_argument("--host", default="qdrant")
+    parser.add_argument("--port", type=int, default=6333)
+    parser.add_argument("--collection", default="geo_embeddings")
+    parser.add_argument("--profiles", default=",".join(STORAGE_PROFILES))
+    parser.add_argument("--sample", type=int, default=20000)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--top-k", type=int, default=10)
+    parser.add_argument("--hnsw-ef", default="0,64,128,256")
+    parser.add_argument("--oversampling", default="0,2,4")
+    parser.add_argument("--hnsw-m", type=int, default=None)
+    parser.add_argument("--hnsw-ef-construct", type=int, default=None)
+    parser.add_argument("--keep", action="store_true", help="Не удалять временные коллекции")
+    parser.add_argument("--output", default=None, help="Путь для JSON-отчёта")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s — %(message)s")
+    client = QdrantClient(host=args.host, port=args.port)
+    report = profile_report(
+        client, args.collection,
+        profiles=[p for p in args.profiles.split(",") if p],
+        sample_size=args.sample,
+        num_queries=args.queries,
+        top_k=args.top_k,
+        hnsw_efs=_optional_numbers(args.hnsw_ef, int),
+        oversamplings=_optional_numbers(args.oversampling, float),
+        hnsw_m=args.hnsw_m,
+        hnsw_ef_construct=args.hnsw_ef_construct,
+        keep_collections=args.keep,
+    )
+    print(format_report(report))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
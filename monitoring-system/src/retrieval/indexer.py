@@ -1,29 +1,65 @@
 import os
-import uuid
-from typing import List, Optional, Tuple, Union
+import threading
+from typing import Callable, Dict, List, Optional, Sequence, Set, Tuple, Union
 from datetime import datetime
 from concurrent.futures import ThreadPoolExecutor, as_completed
+import numpy as np
 from tqdm import tqdm
 from PIL import Image
 from qdrant_client.http import models
 
 from .base_client import BaseQdrantClient
-from .processing import ImageDataProcessor, ImageBatchProcessor, FolderScanner
+from .uploader import QdrantUploader
+from .processing import ImageDataProcessor, ImageBatchProcessor, FolderScanner, IngestionPipeline
+from .utils import LRUCache, SpillCache, make_point_id
+from .utils.s3_handler import CACHE_DIR
+from ..metrics import timed
 import logging
 
 # Логгер для ImageProcessor
 logger = logging.getLogger(__name__)
 
 class ImageQdrantIndexer(BaseQdrantClient):
+    # Аргументы search, которые относятся к фильтрам и параметрам поиска (общие для search и search_batch)
+    _filter_args = ("coord_range", "start_datetime", "end_datetime", "radius", "polygon")
+    _param_args = ("hnsw_ef", "exact", "oversampling", "rescore")
+
     def __init__(self, embedder: any, cleaner: any,
                  qdrant_host: str = "qdrant", qdrant_port: int = 6333,
-                 collection_name: str = "geo_embeddings", vector_size: int = 512):
+                 collection_name: str = "geo_embeddings", vector_size: int = 512,
+                 text_cache_size: int = 4096, text_cache_ttl: Optional[float] = None,
+                 text_cache_path: Optional[str] = None,
+                 cleaner_workers: int = 1, cleaner_devices: Optional[List[str]] = None,
+                 prefer_grpc: bool = False, grpc_port: int = 6334,
+                 upsert_chunk_size: int = 256, upsert_parallel: int = 4, upsert_retries: int = 3,
+                 storage_profile: str = "memory", hnsw_m: Optional[int] = None,
+                 hnsw_ef_construct: Optional[int] = None,
+                 s3_streaming: bool = False, spill_dir: Optional[str] = None,
+                 spill_max_bytes: int = 20 * 1024 ** 3, qdrant_path: Optional[str] = None):
         super().__init__(qdrant_host=qdrant_host, qdrant_port=qdrant_port,
-                         collection_name=collection_name, vector_size=vector_size)
+                         collection_name=collection_name, vector_size=vector_size,
+                         prefer_grpc=prefer_grpc, grpc_port=grpc_port,
+                         storage_profile=storage_profile, hnsw_m=hnsw_m,
+                         hnsw_ef_construct=hnsw_ef_construct, qdrant_path=qdrant_path)
+        self.upsert_chunk_size = upsert_chunk_size
+        self.upsert_parallel = upsert_parallel
+        self.upsert_retries = upsert_retries
         self.embedder = embedder
         self.cleaner = cleaner
-        self.batch_processor = ImageBatchProcessor(embedder)
-        self.folder_scanner = FolderScanner(cleaner)
+        # Кэш эмбеддингов текстовых запросов: ключ — (идентификатор модели, нормализованный текст)
+        self.text_cache = LRUCache(max_size=text_cache_size, ttl=text_cache_ttl, persist_path=text_cache_path,
+                                   name="text_embedding")
+        # Потоковый режим S3: объекты читаются в память, на диск (в ограниченный spill-кэш,
+        # свой у каждого процесса) попадают только директории для очистки дубликатов
+        self.spill_cache = None
+        if s3_streaming:
+            self.spill_cache = SpillCache(
+                os.path.join(spill_dir or os.path.join(CACHE_DIR, ".spill"), str(os.getpid())),
+                spill_max_bytes,
+            )
+        self.batch_processor = ImageBatchProcessor(embedder, spill_cache=self.spill_cache)
+        self.folder_scanner = FolderScanner(cleaner, workers=cleaner_workers, devices=cleaner_devices,
+                                            spill_cache=self.spill_cache)
 
     def add_image_data(self, image_path: str, metadata: dict) -> None:
         """
@@ -33,8 +69,7 @@ class ImageQdrantIndexer(BaseQdrantClient):
         data_processor = ImageDataProcessor(self.embedder)
         embedding, new_metadata = data_processor.process_single_image(image_path)
         metadata.update(new_metadata)
-        file_name = os.path.basename(image_path)
-        point_id = abs(hash(file_name)) % (10**18)
+        point_id = make_point_id(metadata.get("source", image_path))
         self.client.upsert(
             collection_name=self.collection_name,
             points=[models.PointStruct(
@@ -53,71 +88,343 @@ class ImageQdrantIndexer(BaseQdrantClient):
                 points=points,
             )
 
+    def filter_unindexed(self, fingerprints: Dict[str, Optional[str]], chunk_size: int = 256) -> List[str]:
+        """
+        Возвращает источники, которых ещё нет в коллекции или содержимое которых изменилось.
+        Проверка идёт по детерминированным идентификаторам точек и отпечатку в payload;
+        источники без известного отпечатка считаются изменившимися.
+        """
+        sources = list(fingerprints)
+        indexed = {}
+        for start in range(0, len(sources), chunk_size):
+            chunk = sources[start:start + chunk_size]
+            ids = {make_point_id(source): source for source in chunk}
+            records = self.client.retrieve(
+                collection_name=self.collection_name,
+                ids=list(ids),
+                with_payload=["fingerprint"],
+                with_vectors=False,
+            )
+            for record in records:
+                indexed[ids[str(record.id)]] = (record.payload or {}).get("fingerprint")
+        return [source for source in sources
+                if fingerprints[source] is None or indexed.get(source) != fingerprints[source]]
+
     def process_image_folder(
         self,
         folder_path: str,
         batch_size: int = 32,
         resize: int = 1024,
-        show_progress: bool = True
-    ) -> None:
-        logger.info(f"[process_image_folder] Старт обработки: {folder_path}")
-        images = self.folder_scanner.scan_folder(folder_path, resize=resize)
-        total = len(images)
-        if not images:
-            logger.warning("[process_image_folder] Нет изображений для обработки")
-            print("В указанной корневой папке нет изображений для обработки.")
-            return
-
-        logger.info(f"[process_image_folder] Всего изображений: {total}")
+        show_progress: bool = True,
+        queue_size: int = 2,
+        skip_indexed: bool = True,
+        skip_dirs: Optional[Set[str]] = None,
+        on_directory_done: Optional[Callable[[str], None]] = None,
+        progress_callback: Optional[Callable[[dict], None]] = None,
+        cancel_event: Optional[threading.Event] = None
+    ) -> dict:
+        """
+        Индексирует папку (локальную или s3://) потоковым конвейером IngestionPipeline:
+        первые точки попадают в Qdrant, пока обход и очистка остальных директорий ещё идут.
+        При skip_indexed уже проиндексированные неизменённые изображения пропускаются до скачивания и кодирования.
 
+        Для задач индексации (src/jobs.py): skip_dirs — уже завершённые директории, on_directory_done
+        сообщает о полностью загруженных директориях, progress_callback получает текущую статистику
+        конвейера после каждого батча, cancel_event останавливает обработку.
+        """
+        logger.info(f"[process_image_folder] Старт обработки: {folder_path}")
         progress = tqdm(
-            total=total,
             desc="🔄 Обработка изображений",
             unit="img",
             disable=not show_progress
         )
+        uploader = QdrantUploader(
+            self.client, self.collection_name,
+            chunk_size=self.upsert_chunk_size,
+            max_in_flight=self.upsert_parallel,
+            max_retries=self.upsert_retries,
+        )
+        pipeline = IngestionPipeline(
+            self.embedder, self.folder_scanner, self.batch_processor,
+            upsert_fn=uploader.submit,
+            batch_size=batch_size,
+            queue_size=queue_size,
+            filter_fn=self.filter_unindexed if skip_indexed else None,
+        )
+        def on_batch_done(count: int) -> None:
+            progress.update(count)
+            if progress_callback:
+                progress_callback(pipeline.stats)
 
-        # Обрабатываем батчи один за другим
-        num_batches = (total + batch_size - 1) // batch_size
-        for batch_idx in range(num_batches):
-            start = batch_idx * batch_size
-            batch = images[start:start + batch_size]
-            logger.info(f"[process_image_folder] Обработка батча #{batch_idx+1}/{num_batches}: {len(batch)} шт.")
-            try:
-                self.add_image_data_batch(batch)
-                logger.info("[process_image_folder] Батч успешно обработан")
-            except Exception as e:
-                logger.error(f"[process_image_folder] Ошибка в батче #{batch_idx+1}: {e}", exc_info=True)
-                print(f"\n🚨 Ошибка в батче #{batch_idx+1}: {e}")
-            progress.update(len(batch))
+        try:
+            stats = pipeline.run(folder_path, resize=resize, on_batch_done=on_batch_done,
+                                 skip_dirs=skip_dirs, on_directory_done=on_directory_done,
+                                 cancel_event=cancel_event)
+        finally:
+            progress.close()
+            stats_upload = uploader.close()
+            self.batch_processor.metadata_cache.save()
+        stats["upload"] = stats_upload
 
-        progress.close()
-        logger.info("[process_image_folder] Обработка завершена")
+        if not stats["images_listed"]:
+            logger.warning("[process_image_folder] Нет изображений для обработки")
+            print("В указанной корневой папке нет изображений для обработки.")
+            return stats
+        if stats["batches_failed"] or stats_upload["points_failed"]:
+            print(f"\n🚨 Ошибок в батчах: {stats['batches_failed']}, не загружено точек: {stats_upload['points_failed']}")
+        logger.info(f"[process_image_folder] Обработка завершена: {stats}")
+        return stats
+
+    @staticmethod
+    def normalize_query_text(text: str) -> str:
+        """Нормализует текст запроса для ключа кэша (регистр и пробелы не влияют на токенизацию CLIP)."""
+        return " ".join(text.lower().split())
+
+    def _text_cache_key(self, text: str) -> tuple:
+        model_id = getattr(self.embedder, "model_id", type(self.embedder).__name__)
+        return (model_id, self.normalize_query_text(text))
+
+    def lookup_text_embedding(self, text: str) -> Optional[np.ndarray]:
+        """Возвращает эмбеддинг запроса из кэша или None, не обращаясь к модели."""
+        return self.text_cache.get(self._text_cache_key(text))
+
+    def encode_texts(self, texts: List[str], record_stats: bool = True) -> np.ndarray:
+        """
+        Кодирует список текстовых запросов, возвращает массив (N, D).
+        Запросы из кэша модель не вызывают; промахи кодируются одним проходом.
+        record_stats=False — если обращение к кэшу уже учтено через lookup_text_embedding.
+        """
+        rows: List[Optional[np.ndarray]] = [None] * len(texts)
+        missing = {}
+        for idx, text in enumerate(texts):
+            key = self._text_cache_key(text)
+            cached = self.text_cache.get(key, record=record_stats)
+            if cached is not None:
+                rows[idx] = cached
+            else:
+                missing.setdefault(key, []).append(idx)
+
+        if missing:
+            embeddings = self.embedder.encode_text([key[1] for key in missing]).cpu().numpy()
+            for (key, indices), embedding in zip(missing.items(), embeddings):
+                self.text_cache.put(key, embedding)
+                for idx in indices:
+                    rows[idx] = embedding
+        return np.stack(rows) if rows else np.empty((0, self.vector_size), dtype=np.float32)
+
+    def encode_images(self, images: List[Union[str, bytes, np.ndarray, Image.Image]]) -> np.ndarray:
+        """Кодирует изображения (пути, байты, массивы или PIL.Image) одним проходом модели, возвращает массив (N, D)."""
+        return self.embedder.encode_image(list(images)).cpu().numpy()
 
     def search(self, query: Union[str, Image.Image], top_k: int = 5,
                coord_range: Optional[Tuple[float, float, float, float]] = None,
-               start_datetime: Optional[str] = None, end_datetime: Optional[str] = None) -> List[dict]:
+               start_datetime: Optional[str] = None, end_datetime: Optional[str] = None,
+               query_vector: Optional[Sequence[float]] = None,
+               radius: Optional[Tuple[float, float, float]] = None,
+               polygon: Optional[Sequence[Tuple[float, float]]] = None,
+               hnsw_ef: Optional[int] = None, exact: bool = False,
+               oversampling: Optional[float] = None, rescore: Optional[bool] = None) -> List[dict]:
         """
         Выполняет поиск по тексту или изображению с дополнительной фильтрацией по координатам и времени.
+        Если передан query_vector (например, из MicroBatchEncoder), кодирование запроса пропускается.
+        Пространственные фильтры (см. build_filter) работают по индексированному geo-полю location.
+        hnsw_ef, exact, oversampling и rescore управляют точностью/скоростью поиска (см. search_params).
         """
-        if isinstance(query, str):
-            embedding = self.embedder.encode_text([query]).cpu().numpy()[0]
+        if query_vector is not None:
+            embedding = np.asarray(query_vector, dtype=np.float32)
         else:
-            embedding = self.embedder.encode_image([query]).cpu().numpy()[0]
+            with timed("search_encode"):
+                if isinstance(query, str):
+                    embedding = self.encode_texts([query])[0]
+                else:
+                    embedding = self.encode_images([query])[0]
+
+        filter_ = self.build_filter(coord_range, start_datetime, end_datetime, radius=radius, polygon=polygon)
+        with timed("search_qdrant"):
+            results = self.client.query_points(
+                collection_name=self.collection_name,
+                query=embedding.tolist(),
+                query_filter=filter_,
+                search_params=self.search_params(hnsw_ef, exact, oversampling, rescore),
+                limit=top_k,
+                with_payload=True,
+            )
+        return self._format_hits(results.points)
+
+    def search_batch(self, queries: Sequence[dict]) -> List[List[dict]]:
+        """
+        Выполняет несколько поисков за один проход модели и один запрос к Qdrant.
+
+        Каждый элемент queries — словарь с ключом "query" (текст или PIL.Image) и, при необходимости,
+        "query_vector", "top_k" и теми же фильтрами и параметрами поиска, что у search.
+        Все тексты кодируются одним вызовом encode_texts (с кэшем), все изображения — одним encode_images.
+
+        Возвращает:
+          Список результатов в порядке запросов; формат каждого — как у search.
+        """
+        if not queries:
+            return []
+        with timed("search_encode", len(queries)):
+            vectors = self.encode_queries(queries)
+        requests = self._batch_requests(queries, vectors)
+        with timed("search_qdrant", len(queries)):
+            results = self.client.query_batch_points(collection_name=self.collection_name, requests=requests)
+        return [self._format_hits(response.points) for response in results]
 
+    def encode_queries(self, queries: Sequence[dict]) -> List[np.ndarray]:
+        """Векторы запросов search_batch: готовые query_vector, тексты и изображения — по одному проходу модели."""
+        vectors: List[Optional[np.ndarray]] = [None] * len(queries)
+        texts, images = {}, {}
+        for idx, item in enumerate(queries):
+            if item.get("query_vector") is not None:
+                vectors[idx] = np.asarray(item["query_vector"], dtype=np.float32)
+            elif isinstance(item["query"], str):
+                texts[idx] = item["query"]
+            else:
+                images[idx] = item["query"]
+        if texts:
+            for idx, embedding in zip(texts, self.encode_texts(list(texts.values()))):
+                vectors[idx] = embedding
+        if images:
+            for idx, embedding in zip(images, self.encode_images(list(images.values()))):
+                vectors[idx] = embedding
+        return vectors
+
+    def _batch_requests(self, queries: Sequence[dict], vectors: Sequence[np.ndarray]) -> list:
+        requests = []
+        for item, vector in zip(queries, vectors):
+            filter_, params = self._search_options(item)
+            requests.append(models.QueryRequest(
+                query=np.asarray(vector, dtype=np.float32).tolist(),
+                filter=filter_,
+                params=params,
+                limit=item.get("top_k", 5),
+                with_payload=True,
+            ))
+        return requests
+
+    def _search_options(self, options: dict) -> Tuple[Optional[models.Filter], Optional[models.SearchParams]]:
+        """Фильтр и параметры поиска из словаря с аргументами search (лишние ключи игнорируются)."""
+        filters = {name: options[name] for name in self._filter_args if name in options}
+        params = {name: options[name] for name in self._param_args if name in options}
+        return self.build_filter(**filters), self.search_params(**params)
+
+    def search_similar(self, point_id: Union[str, int], top_k: int = 5, **kwargs) -> List[dict]:
+        """
+        Ищет кадры, похожие на уже проиндексированную точку («ещё такие же»).
+        Используется сохранённый в Qdrant вектор точки (RecommendQuery), модель не вызывается;
+        сама точка в результаты не попадает. kwargs — фильтры и параметры поиска, как у search.
+        """
+        filter_, params = self._search_options(kwargs)
+        with timed("search_qdrant"):
+            results = self.client.query_points(
+                collection_name=self.collection_name,
+                query=self._recommend_query(point_id),
+                query_filter=filter_,
+                search_params=params,
+                limit=top_k,
+                with_payload=True,
+            )
+        return self._format_hits(results.points)
+
+    # Асинхронные варианты для event loop сервиса: вектор запроса уже посчитан
+    # (кодирование идёт в пуле инференса), в Qdrant ходит AsyncQdrantClient
+
+    async def asearch(self, query_vector: Sequence[float], top_k: int = 5, **kwargs) -> List[dict]:
+        """Асинхронный search по готовому вектору; kwargs — фильтры и параметры поиска, как у search."""
+        filter_, params = self._search_options(kwargs)
+        with timed("search_qdrant"):
+            results = await self.async_client.query_points(
+                collection_name=self.collection_name,
+                query=np.asarray(query_vector, dtype=np.float32).tolist(),
+                query_filter=filter_,
+                search_params=params,
+                limit=top_k,
+                with_payload=True,
+            )
+        return self._format_hits(results.points)
+
+    async def asearch_batch(self, queries: Sequence[dict]) -> List[List[dict]]:
+        """Асинхронный search_batch; у каждого запроса должен быть query_vector."""
+        if not queries:
+            return []
+        if any(item.get("query_vector") is None for item in queries):
+            raise ValueError("asearch_batch: у каждого запроса должен быть query_vector")
+        requests = self._batch_requests(queries, [item["query_vector"] for item in queries])
+        with timed("search_qdrant", len(queries)):
+            results = await self.async_client.query_batch_points(collection_name=self.collection_name, requests=requests)
+        return [self._format_hits(response.points) for response in results]
+
+    async def asearch_similar(self, point_id: Union[str, int], top_k: int = 5, **kwargs) -> List[dict]:
+        """Асинхронный search_similar."""
+        filter_, params = self._search_options(kwargs)
+        with timed("search_qdrant"):
+            results = await self.async_client.query_points(
+                collection_name=self.collection_name,
+                query=self._recommend_query(point_id),
+                query_filter=filter_,
+                search_params=params,
+                limit=top_k,
+                with_payload=True,
+            )
+        return self._format_hits(results.points)
+
+    @staticmethod
+    def _recommend_query(point_id: Union[str, int]) -> models.RecommendQuery:
+        """Запрос «похожие на точку»: вектор берётся из Qdrant, сама точка в результаты не попадает."""
+        return models.RecommendQuery(recommend=models.RecommendInput(positive=[point_id]))
+
+    @staticmethod
+    def _format_hits(hits) -> List[dict]:
+        return [{
+            "id": hit.id,
+            "score": hit.score,
+            "payload": {**hit.payload, "coordinates": (hit.payload.get("lat"), hit.payload.get("lon"))}
+        } for hit in hits]
+
+    @staticmethod
+    def build_filter(coord_range: Optional[Tuple[float, float, float, float]] = None,
+                     start_datetime: Optional[str] = None, end_datetime: Optional[str] = None,
+                     radius: Optional[Tuple[float, float, float]] = None,
+                     polygon: Optional[Sequence[Tuple[float, float]]] = None) -> Optional[models.Filter]:
+        """
+        Собирает фильтр Qdrant для поиска.
+
+        Параметры:
+          coord_range: (min_lat, max_lat, min_lon, max_lon) — прямоугольник на geo-поле location.
+          start_datetime / end_datetime: границы времени съёмки (ISO, дата без времени допускается).
+          radius: (lat, lon, radius_m) — круг вокруг точки.
+          polygon: вершины многоугольника [(lat, lon), ...]; контур замыкается автоматически.
+
+        Возвращает:
+          models.Filter или None, если условий нет.
+        """
         must_conditions = []
         if coord_range:
             min_lat, max_lat, min_lon, max_lon = coord_range
-            must_conditions.extend([
-                models.FieldCondition(
-                    key="lat",
-                    range=models.Range(gte=min_lat, lte=max_lat)
-                ),
-                models.FieldCondition(
-                    key="lon",
-                    range=models.Range(gte=min_lon, lte=max_lon)
+            must_conditions.append(models.FieldCondition(
+                key="location",
+                geo_bounding_box=models.GeoBoundingBox(
+                    top_left=models.GeoPoint(lat=max_lat, lon=min_lon),
+                    bottom_right=models.GeoPoint(lat=min_lat, lon=max_lon),
                 )
-            ])
+            ))
+        if radius:
+            lat, lon, radius_m = radius
+            must_conditions.append(models.FieldCondition(
+                key="location",
+                geo_radius=models.GeoRadius(center=models.GeoPoint(lat=lat, lon=lon), radius=radius_m)
+            ))
+        if polygon:
+            points = [models.GeoPoint(lat=lat, lon=lon) for lat, lon in polygon]
+            if len(points) < 3:
+                raise ValueError("Многоугольник должен содержать не меньше трёх вершин")
+            if (points[0].lat, points[0].lon) != (points[-1].lat, points[-1].lon):
+                points.append(points[0])
+            must_conditions.append(models.FieldCondition(
+                key="location",
+                geo_polygon=models.GeoPolygon(exterior=models.GeoLineString(points=points))
+            ))
         if start_datetime and start_datetime.strip():
             try:
                 if "T" not in start_datetime:
@@ -138,15 +445,41 @@ class ImageQdrantIndexer(BaseQdrantClient):
                 ))
             except Exception as e:
                 print(f"Ошибка преобразования end_datetime: {e}")
-        filter_ = models.Filter(must=must_conditions) if must_conditions else None
-        results = self.client.search(
-            collection_name=self.collection_name,
-            query_vector=embedding.tolist(),
-            query_filter=filter_,
-            limit=top_k,
+        return models.Filter(must=must_conditions) if must_conditions else None
+
+    def backfill_locations(self, batch_size: int = 256) -> int:
+        """
+        Дописывает geo-поле location точкам, проиндексированным до его появления (есть lat/lon, нет location).
+        Без него такие точки не попадают под пространственные фильтры. Возвращает число обновлённых точек.
+        """
+        missing = models.Filter(
+            must=[models.IsEmptyCondition(is_empty=models.PayloadField(key="location"))],
+            must_not=[models.IsEmptyCondition(is_empty=models.PayloadField(key="lat"))],
         )
-        return [{
-            "id": hit.id,
-            "score": hit.score,
-            "payload": {**hit.payload, "coordinates": (hit.payload.get("lat"), hit.payload.get("lon"))}
-        } for hit in results]
+        updated = 0
+        offset = None
+        while True:
+            records, offset = self.client.scroll(
+                collection_name=self.collection_name,
+                scroll_filter=missing,
+                limit=batch_size,
+                offset=offset,
+                with_payload=["lat", "lon"],
+                with_vectors=False,
+            )
+            operations = []
+            for record in records:
+                payload = record.payload or {}
+                if payload.get("lat") is None or payload.get("lon") is None:
+                    continue
+                operations.append(models.SetPayloadOperation(set_payload=models.SetPayload(
+                    payload={"location": {"lat": payload["lat"], "lon": payload["lon"]}},
+                    points=[record.id],
+                )))
+            if operations:
+                self.client.batch_update_points(collection_name=self.collection_name, update_operations=operations)
+                updated += len(operations)
+            if offset is None:
+                break
+        logger.info(f"[backfill_locations] Обновлено точек: {updated}")
+        return updated
@@ -1,9 +1,11 @@
 from .image_processor import ImageDataProcessor
 from .batch_processor import ImageBatchProcessor
 from .folder_scanner import FolderScanner
+from .pipeline import IngestionPipeline
 
 __all__ = [
     "ImageDataProcessor",
     "ImageBatchProcessor",
     "FolderScanner",
+    "IngestionPipeline",
 ]
@@ -1,28 +1,54 @@
 import os
-import uuid
-from typing import List
+from typing import List, Optional, Tuple
 from concurrent.futures import ThreadPoolExecutor, as_completed
 from qdrant_client.http import models
 
-from ..utils import ImageMetadataExtractor, S3ImageHandler
+from ..utils import ImageMetadataExtractor, S3ImageHandler, SpillCache, make_point_id, file_fingerprint
+from ..utils.s3_client import S3_FETCH_WORKERS
+from ...metrics import cache_result
 
 
 class ImageBatchProcessor(ImageMetadataExtractor, S3ImageHandler):
-    def __init__(self, embedder: any):
+    """
+    Скачивание, кодирование и формирование точек Qdrant для батчей изображений.
+
+    Аргументы:
+      embedder: Модель (RemoteCLIP).
+      spill_cache (SpillCache, optional): Потоковый режим S3: объекты читаются в память
+        (или берутся из spill_cache, если их уже скачала очистка) и декодируются из байтов.
+      fetch_workers (int): Число параллельных загрузок из S3 в батче.
+    """
+    def __init__(self, embedder: any, spill_cache: Optional[SpillCache] = None,
+                 fetch_workers: int = S3_FETCH_WORKERS):
         self.embedder = embedder
+        self.spill_cache = spill_cache
+        self.fetch_workers = max(1, fetch_workers)
 
     def process_batch(self, image_paths: List[str]) -> List[models.PointStruct]:
         """
         Обрабатывает батч изображений: скачивает файлы из S3, вычисляет эмбеддинги пакетно и формирует объекты Qdrant.
         """
+        new_paths, downloaded_files = self.fetch_batch(image_paths)
+        embeddings = self.embedder.encode_image(new_paths).cpu().numpy()
+        points = self.build_points(image_paths, new_paths, embeddings)
+        self.cleanup_downloads(downloaded_files)
+        return points
+
+    def fetch_batch(self, image_paths: List[str]) -> Tuple[List[str], List[str]]:
+        """
+        Скачивает S3-файлы батча параллельно.
+        Возвращает пути для обработки (локальные или исходные) и список скачанных файлов для последующей очистки.
+        В потоковом режиме вместо путей S3-объектов возвращаются их байты.
+        """
+        if self.spill_cache is not None:
+            return self._fetch_stream(image_paths)
         new_paths = []       # Пути для обработки (локальные или исходные)
         downloaded_files = []  # Скачанные локальные файлы (для последующей очистки)
-        original_paths = []    # Исходные пути для метаданных
 
         s3_paths = [p for p in image_paths if p.startswith("s3://")]
         downloaded_mapping = {}
         if s3_paths:
-            with ThreadPoolExecutor(max_workers=8) as executor:
+            with ThreadPoolExecutor(max_workers=self.fetch_workers) as executor:
                 future_to_s3 = {executor.submit(self.get_local_image_path, s3): s3 for s3 in s3_paths}
                 for future in as_completed(future_to_s3):
                     s3_path = future_to_s3[future]
@@ -33,7 +59,6 @@ class ImageBatchProcessor(ImageMetadataExtractor, S3ImageHandler):
                         print(f"Ошибка загрузки {s3_path}: {e}")
 
         for path in image_paths:
-            original_paths.append(path)
             if path.startswith("s3://"):
                 if path in downloaded_mapping:
                     local_path = downloaded_mapping[path]
@@ -43,33 +68,68 @@ class ImageBatchProcessor(ImageMetadataExtractor, S3ImageHandler):
                     new_paths.append(path)
             else:
                 new_paths.append(path)
+        return new_paths, downloaded_files
 
-        embeddings = self.embedder.encode_image(new_paths).cpu().numpy()
-        points = []
-        for idx, local_path in enumerate(new_paths):
-            point_id = str(uuid.uuid4())
-            metadata = {"source": original_paths[idx]}
+    def _fetch_stream(self, image_paths: List[str]) -> Tuple[list, List[str]]:
+        """Потоковый fetch: файл из spill_cache, если он есть, иначе байты объекта из S3 (без записи на диск)."""
+        new_paths: list = list(image_paths)
+        spilled = []
+        to_read = {}
+        for idx, path in enumerate(image_paths):
+            if not path.startswith("s3://"):
+                continue
+            bucket, key = path[5:].split('/', 1)
+            local = self.spill_cache.get(self.spill_cache.local_path(bucket, key))
+            cache_result("s3_spill", bool(local))
+            if local:
+                new_paths[idx] = local
+                spilled.append(local)
+            else:
+                to_read[idx] = path
+        if to_read:
+            with ThreadPoolExecutor(max_workers=self.fetch_workers) as executor:
+                futures = {executor.submit(self.read_s3_object, path): idx for idx, path in to_read.items()}
+                for future in as_completed(futures):
+                    idx = futures[future]
+                    try:
+                        new_paths[idx] = future.result()
+                    except Exception as e:
+                        print(f"Ошибка загрузки {to_read[idx]}: {e}")
+        return new_paths, spilled
 
-            geo_data = self.extract_gps_coordinates(local_path)
-            if geo_data:
-                metadata.update({"lat": float(geo_data[0]), "lon": float(geo_data[1])})
+    @staticmethod
+    def source_fingerprint(path: str) -> Optional[str]:
+        """Отпечаток содержимого источника; для s3:// без данных листинга неизвестен."""
+        if path.startswith("s3://"):
+            return None
+        return file_fingerprint(path)
 
-            dt = self.extract_datetime(local_path)
-            if dt:
-                metadata.update({
-                    "timestamp": dt.timestamp(),
-                    "date": [dt.year, dt.month, dt.day],
-                    "time": [dt.hour, dt.minute, dt.second]
-                })
+    def build_points(self, original_paths: List[str], local_paths: List[str], embeddings,
+                     fingerprints: Optional[List[Optional[str]]] = None) -> List[models.PointStruct]:
+        """
+        Извлекает метаданные и формирует объекты Qdrant для уже вычисленных эмбеддингов.
+        Идентификатор точки детерминированно выводится из источника, отпечаток содержимого сохраняется в payload.
+        """
+        if fingerprints is None:
+            fingerprints = [self.source_fingerprint(p) for p in original_paths]
+        points = []
+        for idx, local_path in enumerate(local_paths):
+            point_id = make_point_id(original_paths[idx])
+            metadata = {"source": original_paths[idx]}
+            if fingerprints[idx]:
+                metadata["fingerprint"] = fingerprints[idx]
+            metadata.update(self.metadata_to_payload(self.extract_metadata(local_path)))
 
             points.append(models.PointStruct(
                 id=point_id,
                 vector=embeddings[idx].tolist(),
                 payload=metadata
             ))
+        return points
 
+    def cleanup_downloads(self, downloaded_files: List[str]) -> None:
+        if self.spill_cache is not None:
+            self.spill_cache.discard(downloaded_files)
         for f in downloaded_files:
             if os.path.exists(f):
                 os.remove(f)
-
-        return points
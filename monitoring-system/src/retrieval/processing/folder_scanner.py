@@ -1,50 +1,280 @@
 import os
 import logging
-from typing import List
+import multiprocessing
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Iterator, List, Optional, Sequence, Set, Tuple
 from ..utils.s3_handler import S3ImageHandler, CACHE_DIR
+from ..utils.spill_cache import SpillCache
+from ..utils.point_ids import file_fingerprint
+from ...metrics import timed
 
 logger=logging.getLogger(__name__)
 
+# Экземпляр очистителя в процессе-воркере (создаётся инициализатором пула)
+_worker_cleaner=None
+
+
+def _init_clean_worker(config: dict, devices, threads: int) -> None:
+    global _worker_cleaner
+    import torch
+    from ...duplicate.model import ImageFolderCleaner
+    torch.set_num_threads(threads)
+    config=dict(config, device=devices.get())
+    logger.info(f"[scan_folder] Воркер очистки {os.getpid()} на устройстве {config['device']}")
+    _worker_cleaner=ImageFolderCleaner(**config)
+
+
+def _clean_in_worker(directory: str, resize: int) -> Tuple[List[str], Dict[str, int]]:
+    """Очищает директорию в воркере; возвращает оставленные изображения и приращение счётчиков пар очистителя."""
+    before=dict(_worker_cleaner.stats)
+    filtered=_worker_cleaner.process_folder(directory, resize=resize)
+    return filtered,{key:value-before.get(key,0) for key,value in _worker_cleaner.stats.items()}
+
+
 class FolderScanner(S3ImageHandler):
+    """
+    Обходит папку и очищает каждую директорию от дубликатов.
+
+    Аргументы:
+      cleaner (ImageFolderCleaner, optional): Очиститель дубликатов.
+      workers (int): Число процессов для параллельной очистки директорий; 1 — очистка в текущем процессе.
+      devices (list, optional): Устройства, распределяемые между воркерами по кругу (например, ["cuda:0", "cuda:1"]).
+        По умолчанию — устройство исходного очистителя.
+      spill_cache (SpillCache, optional): Потоковый режим S3. Вместо зеркалирования префикса в DATASETS_DIR
+        директории возвращаются как s3:// URI (директория — s3://bucket/dir), а на диск, в ограниченный
+        по размеру кэш, скачиваются только директории, которые нужно очистить от дубликатов.
+    """
     valid_extensions = ('.jpg','.jpeg','.png','.bmp','.tiff','.tif')
-    def __init__(self, cleaner=None):
+    def __init__(self, cleaner=None, workers:int=1, devices:Optional[Sequence[str]]=None,
+                 spill_cache:Optional[SpillCache]=None):
         self.cleaner=cleaner
+        self.workers=max(1,workers)
+        self.devices=list(devices) if devices else None
+        self.spill_cache=spill_cache
+        # Отпечатки объектов S3 из листинга (потоковый режим), забираются через source_fingerprint
+        self._listing_fingerprints:Dict[str,str]={}
+        # Корни зеркал S3 в DATASETS_DIR (режим без spill_cache) -> бакет, см. source_uri
+        self._s3_mirrors:Dict[str,str]={}
+
+    def source_uri(self, path: str) -> str:
+        """
+        Источник изображения для payload и идентификатора точки. Файл зеркала S3 в DATASETS_DIR заменяется
+        его s3:// URI, как в потоковом режиме, поэтому точки не зависят от S3_STREAMING.
+        """
+        for root,bucket in self._s3_mirrors.items():
+            if path.startswith(root):
+                return f"s3://{bucket}/{path[len(root):]}"
+        return path
+
+    def source_fingerprint(self, path: str) -> Optional[str]:
+        """Отпечаток содержимого источника: для s3:// — ETag и размер из листинга, для файлов — размер и mtime."""
+        if path.startswith('s3://'):
+            return self._listing_fingerprints.pop(path,None)
+        return file_fingerprint(path)
 
     def scan_folder(self, folder_path: str, resize:int=1024) -> List[str]:
         logger.info(f"[scan_folder] Начало сканирования: {folder_path}")
         images:List[str]=[]
-        if folder_path.startswith('s3://'):
-            self.download_s3_folder(folder_path)
-            path=folder_path[5:]
-            bucket,prefix=(path.split('/',1)+[''])[:2]
-            root=os.path.join(CACHE_DIR,bucket,prefix)
-            logger.info(f"[scan_folder] Local cache root: {root}")
-            for r,_,fs in os.walk(root):
-                imgs=[os.path.join(r,f) for f in fs if f.lower().endswith(self.valid_extensions)]
-                if not imgs: continue
-                if self.cleaner and len(imgs)>1:
-                    logger.info(f"[scan_folder] Running cleaner on {r}")
-                    filtered=self.cleaner.process_folder(r,resize=resize)
-                    logger.info(f"[scan_folder] Filtered: {len(filtered)} in {r}")
-                    images.extend(filtered)
-                else:
-                    images.extend(imgs)
-        else:
-            from pathlib import Path
-            p=Path(folder_path)
-            if not p.is_dir():
-                logger.error(f"[scan_folder] Directory not found: {folder_path}")
-                raise ValueError(f"Directory not found: {folder_path}")
-            for r,_,fs in os.walk(folder_path):
-                imgs=[os.path.join(r,f) for f in fs if f.lower().endswith(self.valid_extensions)]
-                if not imgs: continue
-                if self.cleaner and len(imgs)>1:
-                    logger.info(f"[scan_folder] Running cleaner on {r}")
-                    filtered=self.cleaner.process_folder(r,resize=resize)
-                    logger.info(f"[scan_folder] Filtered: {len(filtered)} in {r}")
-                    images.extend(filtered)
-                else:
-                    images.extend(imgs)
+        for _,filtered in self.iter_folder(folder_path, resize=resize):
+            images.extend(filtered)
         images.sort()
         logger.info(f"[scan_folder] Final list ({len(images)}): {images[:5]} …")
         return images
+
+    def iter_folder(self, folder_path: str, resize:int=1024,
+                    skip_dirs:Optional[Set[str]]=None) -> Iterator[Tuple[str, List[str]]]:
+        """
+        Потоково обходит папку (локальную или s3://) и по одной директории возвращает
+        пары (директория, отфильтрованные изображения) в детерминированном порядке обхода.
+        Директории сканируются и очищаются только по мере запроса потребителем, поэтому индексация
+        может начаться до окончания обхода всего дерева. При workers > 1 несколько директорий
+        очищаются одновременно в отдельных процессах, но результаты всё равно выдаются по порядку.
+        Директории из skip_dirs (например, уже завершённые в прерванной задаче) пропускаются
+        до скачивания и очистки.
+        """
+        skip_dirs=skip_dirs or set()
+        if folder_path.startswith('s3://') and self.spill_cache is not None:
+            candidates=self._iter_s3_stream_dirs(folder_path, skip_dirs)
+        elif folder_path.startswith('s3://'):
+            candidates=self._iter_s3_dirs(folder_path, skip_dirs)
+        else:
+            candidates=((d,imgs) for d,imgs in self._iter_local_dirs(folder_path) if d not in skip_dirs)
+        if self.cleaner and self.workers>1:
+            cleaned=self._clean_parallel(candidates, resize)
+        else:
+            cleaned=((directory,self._clean_directory(directory,imgs,resize)) for directory,imgs in candidates)
+        if self.spill_cache is None:
+            yield from cleaned
+            return
+        for directory,filtered in cleaned:
+            yield self._spill_to_source(directory,filtered)
+
+    def _iter_local_dirs(self, folder_path: str) -> Iterator[Tuple[str, List[str]]]:
+        from pathlib import Path
+        p=Path(folder_path)
+        if not p.is_dir():
+            logger.error(f"[scan_folder] Directory not found: {folder_path}")
+            raise ValueError(f"Directory not found: {folder_path}")
+        for r,dirs,fs in os.walk(folder_path):
+            dirs.sort()
+            imgs=sorted(os.path.join(r,f) for f in fs if f.lower().endswith(self.valid_extensions))
+            if imgs:
+                yield r,imgs
+
+    def _clean_directory(self, directory: str, imgs: List[str], resize:int) -> List[str]:
+        # s3:// — директория, не поместившаяся в spill-кэш: индексируется без очистки
+        if self.cleaner and len(imgs)>1 and not directory.startswith('s3://'):
+            logger.info(f"[scan_folder] Running cleaner on {directory}")
+            with timed("clean_directory",len(imgs)):
+                filtered=self.cleaner.process_folder(directory,resize=resize)
+            logger.info(f"[scan_folder] Filtered: {len(filtered)} in {directory}")
+            return filtered
+        return imgs
+
+    def _clean_parallel(self, candidates: Iterator[Tuple[str, List[str]]], resize:int) -> Iterator[Tuple[str, List[str]]]:
+        """
+        Очищает директории пулом процессов, у каждого воркера свой мэтчер и своё устройство.
+        В работе одновременно не больше 2 * workers директорий; результаты выдаются в порядке обхода.
+        Счётчики пар воркеров суммируются в cleaner.stats исходного очистителя.
+        """
+        ctx=multiprocessing.get_context('spawn')
+        devices=self.devices or [self.cleaner.config['device']]
+        device_queue=ctx.Queue()
+        for idx in range(self.workers):
+            device_queue.put(devices[idx%len(devices)])
+        threads=max(1,(os.cpu_count() or 1)//self.workers)
+        pending=deque()
+        with ProcessPoolExecutor(max_workers=self.workers, mp_context=ctx, initializer=_init_clean_worker,
+                                 initargs=(self.cleaner.config, device_queue, threads)) as pool:
+            def ready():
+                return pending and (pending[0][2] is None or pending[0][2].done())
+
+            def pop():
+                directory,imgs,future=pending.popleft()
+                if future is None:
+                    return directory,imgs
+                filtered,stats=future.result()
+                for key,value in stats.items():
+                    self.cleaner.stats[key]=self.cleaner.stats.get(key,0)+value
+                logger.info(f"[scan_folder] Filtered: {len(filtered)} in {directory}")
+                return directory,filtered
+
+            for directory,imgs in candidates:
+                if len(imgs)>1 and not directory.startswith('s3://'):
+                    logger.info(f"[scan_folder] Running cleaner on {directory} (parallel)")
+                    pending.append((directory,imgs,pool.submit(_clean_in_worker,directory,resize)))
+                else:
+                    pending.append((directory,imgs,None))
+                while ready() or len(pending)>=2*self.workers:
+                    yield pop()
+            while pending:
+                yield pop()
+
+    def _iter_s3_dirs(self, s3_path: str, skip_dirs:Set[str]=frozenset()) -> Iterator[Tuple[str, List[str]]]:
+        """
+        Перечисляет ключи S3 постранично и группирует их по «директориям». Ключи приходят
+        в лексикографическом порядке, поэтому директория закрывается, как только очередной ключ
+        оказывается за пределами её префикса; после этого она скачивается в локальный кэш.
+        """
+        bucket,_=self.split_s3_path(s3_path)
+        logger.info(f"[scan_folder] Local cache root: {os.path.join(CACHE_DIR,bucket)}")
+        self._s3_mirrors[os.path.join(CACHE_DIR,bucket,'')]=bucket
+        open_dirs:"OrderedDict[str, List[str]]"=OrderedDict()
+
+        def flush(directory):
+            keys=open_dirs.pop(directory)
+            local_dir=os.path.join(CACHE_DIR,bucket,directory)
+            if local_dir in skip_dirs:
+                return None
+            imgs=self.download_s3_keys(bucket,keys)
+            return local_dir,imgs
+
+        for obj in self.iter_s3_objects(s3_path):
+            key=obj['Key']
+            for directory in list(open_dirs):
+                prefix=f"{directory}/" if directory else ""
+                if key>prefix and not key.startswith(prefix):
+                    flushed=flush(directory)
+                    if flushed:
+                        yield flushed
+            directory=key.rsplit('/',1)[0] if '/' in key else ''
+            open_dirs.setdefault(directory,[]).append(key)
+        for directory in list(open_dirs):
+            flushed=flush(directory)
+            if flushed:
+                yield flushed
+
+    def _iter_s3_stream_dirs(self, s3_path: str, skip_dirs:Set[str]=frozenset()) -> Iterator[Tuple[str, List[str]]]:
+        """
+        Потоковый вариант _iter_s3_dirs: ключи перечисляются постранично и группируются по директориям,
+        но ничего не скачивается, кроме директорий для очистки дубликатов (в spill_cache).
+        Такие директории возвращаются локальными путями кэша, остальные — s3:// URI.
+        Место под директорию резервируется в spill_cache до скачивания, и её файлы закреплены до конца
+        очистки (см. iter_folder). Директория, которая не помещается в кэш (больше S3_SPILL_MAX_GB
+        или вместе с директориями, которые ещё очищаются), индексируется целиком без очистки дубликатов.
+        """
+        bucket,_=self.split_s3_path(s3_path)
+        open_dirs:"OrderedDict[str, List[str]]"=OrderedDict()
+        sizes:Dict[str,int]={}
+
+        def flush(directory):
+            keys=open_dirs.pop(directory)
+            uri=f"s3://{bucket}/{directory}" if directory else f"s3://{bucket}"
+            key_sizes={key:sizes.pop(key) for key in keys}
+            if uri in skip_dirs:
+                for key in keys:
+                    self._listing_fingerprints.pop(f"s3://{bucket}/{key}",None)
+                return None
+            if self.cleaner and len(keys)>1:
+                local_dir=self.spill_cache.local_path(bucket,directory).rstrip('/')
+                files={self.spill_cache.local_path(bucket,key):size for key,size in key_sizes.items()}
+                if self.spill_cache.reserve(local_dir,files):
+                    try:
+                        local=self.download_s3_keys(bucket,keys,root=self.spill_cache.root)
+                    except Exception:
+                        self.spill_cache.unpin(local_dir)
+                        raise
+                    for path in local:
+                        self.spill_cache.register(path)
+                    return local_dir,local
+                logger.warning(f"[scan_folder] {uri}: {sum(key_sizes.values())} байт не помещаются в spill-кэш "
+                               f"({self.spill_cache.stats()}), директория индексируется без очистки дубликатов")
+            return uri,[f"s3://{bucket}/{key}" for key in keys]
+
+        for obj in self.iter_s3_objects(s3_path):
+            key=obj['Key']
+            for directory in list(open_dirs):
+                prefix=f"{directory}/" if directory else ""
+                if key>prefix and not key.startswith(prefix):
+                    flushed=flush(directory)
+                    if flushed:
+                        yield flushed
+            self._listing_fingerprints[f"s3://{bucket}/{key}"]=self.listing_fingerprint(obj)
+            sizes[key]=obj['Size']
+            directory=key.rsplit('/',1)[0] if '/' in key else ''
+            open_dirs.setdefault(directory,[]).append(key)
+        for directory in list(open_dirs):
+            flushed=flush(directory)
+            if flushed:
+                yield flushed
+
+    def _spill_to_source(self, directory: str, filtered: List[str]) -> Tuple[str, List[str]]:
+        """
+        Переводит результат очистки директории из spill_cache обратно в s3:// URI и снимает её закрепление.
+        Файлы, отброшенные очисткой, сразу удаляются; оставленные живут в кэше до стадии fetch
+        (если их вытеснят раньше, fetch прочитает объекты из S3).
+        """
+        root=self.spill_cache.root.rstrip('/')+'/'
+        if not directory.startswith(root):
+            return directory,filtered
+        self.spill_cache.unpin(directory)
+        kept=set(filtered)
+        rel_dir=directory[len(root):]
+        local_dir=os.path.join(self.spill_cache.root,rel_dir)
+        dropped=[os.path.join(local_dir,f) for f in os.listdir(local_dir)
+                 if os.path.join(local_dir,f) not in kept and f.lower().endswith(self.valid_extensions)]
+        self.spill_cache.discard(dropped)
+        for path in dropped:
+            self._listing_fingerprints.pop(f"s3://{path[len(root):]}",None)
+        return f"s3://{rel_dir}",[f"s3://{path[len(root):]}" for path in filtered]
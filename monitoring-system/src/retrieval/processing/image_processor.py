@@ -16,17 +16,7 @@ class ImageDataProcessor(ImageMetadataExtractor, S3ImageHandler):
         if source:
             metadata["source"] = source
 
-        geo_data = self.extract_gps_coordinates(local_path)
-        if geo_data:
-            metadata.update({"lat": float(geo_data[0]), "lon": float(geo_data[1])})
-
-        dt = self.extract_datetime(local_path)
-        if dt:
-            metadata.update({
-                "timestamp": dt.timestamp(),
-                "date": [dt.year, dt.month, dt.day],
-                "time": [dt.hour, dt.minute, dt.second]
-            })
+        metadata.update(self.metadata_to_payload(self.extract_metadata(local_path)))
 
         embedding = self.embedder.encode_image([local_path]).cpu().numpy()[0]
 
@@ -0,0 +1,293 @@
+import time
+import queue
+import logging
+import threading
+from collections import Counter
+from typing import Callable, Dict, List, Optional, Set
+
+from .batch_processor import ImageBatchProcessor
+from .folder_scanner import FolderScanner
+from ...metrics import debug_sampled, observe, set_queue_depth
+
+logger = logging.getLogger(__name__)
+
+_END = object()
+
+
+class IngestionPipeline:
+    """
+    Потоковый конвейер индексации: list → fetch → decode → encode → metadata → upsert.
+
+    Каждая стадия работает в своём потоке, стадии связаны ограниченными очередями
+    (queue_size батчей), поэтому скачивание, декодирование, инференс и загрузка в Qdrant
+    выполняются одновременно, а объём данных «в полёте» не растёт с размером папки.
+    Ошибка в батче логируется, батч отбрасывается, остальные продолжают обрабатываться.
+    Конвейер следит, какие директории обработаны целиком (все их точки подтверждены загрузчиком
+    и ни один батч не упал), — это точки восстановления для прерванной индексации.
+
+    Аргументы:
+      embedder: Модель с методами preprocess_images и encode_preprocessed (RemoteCLIP).
+      scanner (FolderScanner): Источник директорий с отфильтрованными изображениями.
+      batch_processor (ImageBatchProcessor): Скачивание файлов и формирование точек Qdrant.
+      upsert_fn (callable): Функция загрузки списка точек в Qdrant. Может вернуть список Future
+        (QdrantUploader.submit) — тогда директория считается завершённой после их выполнения.
+      filter_fn (callable, optional): Принимает {источник (FolderScanner.source_uri): отпечаток} и возвращает
+        источники, которые ещё не проиндексированы; остальные пропускаются до скачивания и кодирования.
+      batch_size (int): Размер батча.
+      queue_size (int): Ёмкость очереди между стадиями (в батчах).
+    """
+    stages = ("list", "fetch", "decode", "encode", "metadata", "upsert")
+
+    def __init__(self, embedder: any, scanner: FolderScanner, batch_processor: ImageBatchProcessor,
+                 upsert_fn: Callable[[list], None], batch_size: int = 32, queue_size: int = 2,
+                 filter_fn: Optional[Callable[[Dict[str, Optional[str]]], List[str]]] = None):
+        self.embedder = embedder
+        self.scanner = scanner
+        self.batch_processor = batch_processor
+        self.upsert_fn = upsert_fn
+        self.filter_fn = filter_fn
+        self.batch_size = max(1, batch_size)
+        self.queue_size = max(1, queue_size)
+        self._stop = threading.Event()
+        self._error: Optional[BaseException] = None
+        self._lock = threading.Lock()
+        self._remaining: Dict[str, int] = {}
+        self._failed_dirs: Set[str] = set()
+        self._on_directory_done: Optional[Callable[[str], None]] = None
+        self.stats = {}
+
+    def stop(self) -> None:
+        """Просит конвейер остановиться после текущих батчей."""
+        self._stop.set()
+
+    def run(self, folder_path: str, resize: int = 1024,
+            on_batch_done: Optional[Callable[[int], None]] = None,
+            skip_dirs: Optional[Set[str]] = None,
+            on_directory_done: Optional[Callable[[str], None]] = None,
+            cancel_event: Optional[threading.Event] = None) -> dict:
+        """
+        Запускает конвейер и блокируется до его завершения.
+
+        Параметры:
+          folder_path (str): Локальная папка или s3:// префикс.
+          resize (int): Размер для очистки дубликатов.
+          on_batch_done (callable, optional): Вызывается с числом изображений после загрузки каждого батча.
+          skip_dirs (set, optional): Директории, которые не нужно обрабатывать (уже завершены).
+          on_directory_done (callable, optional): Вызывается с путём директории, когда все её изображения
+            загружены в Qdrant. Может вызываться из потоков загрузчика.
+          cancel_event (threading.Event, optional): Внешний сигнал остановки (аналог stop()).
+
+        Возвращает:
+          dict: Статистика (число изображений и батчей, время работы каждой стадии).
+        """
+        self._stop.clear()
+        self._error = None
+        self._remaining = {}
+        self._failed_dirs = set()
+        self._on_directory_done = on_directory_done
+        self.stats = {
+            "images_listed": 0,
+            "images_skipped": 0,
+            "images_done": 0,
+            "batches_done": 0,
+            "batches_failed": 0,
+            "stage_seconds": {name: 0.0 for name in self.stages},
+        }
+        started = time.time()
+        queues = [queue.Queue(maxsize=self.queue_size) for _ in self.stages[1:]]
+
+        def process_fn(name):
+            return {
+                "fetch": self._fetch,
+                "decode": self._decode,
+                "encode": self._encode,
+                "metadata": self._metadata,
+                "upsert": lambda batch: self._upsert(batch, on_batch_done),
+            }[name]
+
+        threads = [threading.Thread(target=self._list_stage, args=(folder_path, resize, queues[0], skip_dirs),
+                                    name="ingest-list", daemon=True)]
+        for idx, name in enumerate(self.stages[1:]):
+            out_q = queues[idx + 1] if idx + 1 < len(queues) else None
+            threads.append(threading.Thread(target=self._stage, args=(name, process_fn(name), queues[idx], out_q),
+                                            name=f"ingest-{name}", daemon=True))
+        finished = threading.Event()
+        if cancel_event is not None:
+            threading.Thread(target=self._watch_cancel, args=(cancel_event, finished),
+                             name="ingest-cancel", daemon=True).start()
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        finished.set()
+
+        self.stats["cancelled"] = self._stop.is_set() and self._error is None
+        self.stats["elapsed_seconds"] = time.time() - started
+        if self._error is not None:
+            raise self._error
+        return self.stats
+
+    def _watch_cancel(self, cancel_event: threading.Event, finished: threading.Event) -> None:
+        while not finished.is_set():
+            if cancel_event.wait(0.5):
+                logger.info("[pipeline] Получен сигнал отмены")
+                self.stop()
+                return
+
+    def _list_stage(self, folder_path: str, resize: int, out_q: queue.Queue,
+                    skip_dirs: Optional[Set[str]] = None) -> None:
+        batch: List[str] = []
+        uris: Dict[str, str] = {}
+        fingerprints: Dict[str, Optional[str]] = {}
+        directories: Dict[str, str] = {}
+
+        def make_batch():
+            return {
+                "sources": batch,
+                "uris": [uris.pop(p) for p in batch],
+                "fingerprints": [fingerprints.pop(p) for p in batch],
+                "directories": [directories.pop(p) for p in batch],
+            }
+
+        started = time.time()
+        try:
+            for directory, images in self.scanner.iter_folder(folder_path, resize=resize, skip_dirs=skip_dirs):
+                if self._stop.is_set():
+                    break
+                self.stats["images_listed"] += len(images)
+                # Точки и фильтр уже проиндексированного работают с каноническим источником (source_uri),
+                # а скачивание — с путём, который вернул обход
+                paths_by_uri = {self.scanner.source_uri(path): path for path in images}
+                listed = {uri: self.scanner.source_fingerprint(path) for uri, path in paths_by_uri.items()}
+                if self.filter_fn and listed:
+                    new_images = [paths_by_uri[uri] for uri in self.filter_fn(listed)]
+                    self.stats["images_skipped"] += len(images) - len(new_images)
+                    images = new_images
+                if not images:
+                    self._directory_done(directory)
+                    continue
+                with self._lock:
+                    self._remaining[directory] = self._remaining.get(directory, 0) + len(images)
+                for path in images:
+                    batch.append(path)
+                    uris[path] = uri = self.scanner.source_uri(path)
+                    fingerprints[path] = listed[uri]
+                    directories[path] = directory
+                    if len(batch) >= self.batch_size:
+                        self.stats["stage_seconds"]["list"] += time.time() - started
+                        # put блокируется при заполненной очереди — это и есть backpressure
+                        out_q.put(make_batch())
+                        started = time.time()
+                        batch = []
+            if batch and not self._stop.is_set():
+                out_q.put(make_batch())
+            self.stats["stage_seconds"]["list"] += time.time() - started
+        except BaseException as e:
+            logger.error(f"[pipeline] Ошибка на стадии list: {e}", exc_info=True)
+            self._error = e
+            self._stop.set()
+        finally:
+            # Сигнал завершения передаётся всегда: нижние стадии дочитывают очередь до него
+            out_q.put(_END)
+
+    def _stage(self, name: str, fn: Callable[[dict], Optional[dict]],
+               in_q: queue.Queue, out_q: Optional[queue.Queue]) -> None:
+        while True:
+            batch = in_q.get()
+            set_queue_depth(f"ingest_{name}", in_q.qsize())
+            if batch is _END:
+                if out_q is not None:
+                    out_q.put(_END)
+                return
+            if self._stop.is_set():
+                # После остановки батчи только дочитываются, чтобы не блокировать верхние стадии
+                self.batch_processor.cleanup_downloads(batch.get("downloaded", []))
+                continue
+            started = time.time()
+            try:
+                result = fn(batch)
+            except Exception as e:
+                with self._lock:
+                    self.stats["batches_failed"] += 1
+                logger.error(f"[pipeline] Ошибка на стадии {name} ({len(batch['sources'])} шт.): {e}", exc_info=True)
+                self.batch_processor.cleanup_downloads(batch.get("downloaded", []))
+                self._release(batch, failed=True)
+                continue
+            finally:
+                elapsed = time.time() - started
+                self.stats["stage_seconds"][name] += elapsed
+                observe(f"ingest_{name}", elapsed, len(batch["sources"]))
+            if out_q is not None:
+                out_q.put(result)
+
+    def _fetch(self, batch: dict) -> dict:
+        batch["paths"], batch["downloaded"] = self.batch_processor.fetch_batch(batch["sources"])
+        return batch
+
+    def _decode(self, batch: dict) -> dict:
+        batch["pixels"] = self.embedder.preprocess_images(batch["paths"])
+        return batch
+
+    def _encode(self, batch: dict) -> dict:
+        batch["embeddings"] = self.embedder.encode_preprocessed(batch.pop("pixels")).cpu().numpy()
+        return batch
+
+    def _metadata(self, batch: dict) -> dict:
+        batch["points"] = self.batch_processor.build_points(batch["uris"], batch["paths"], batch.pop("embeddings"),
+                                                            fingerprints=batch["fingerprints"])
+        self.batch_processor.cleanup_downloads(batch["downloaded"])
+        batch["downloaded"] = []
+        return batch
+
+    def _upsert(self, batch: dict, on_batch_done: Optional[Callable[[int], None]]) -> None:
+        futures = self.upsert_fn(batch["points"]) if batch["points"] else None
+        if futures:
+            self._release_when_uploaded(batch, futures)
+        else:
+            self._release(batch)
+        self.stats["images_done"] += len(batch["sources"])
+        self.stats["batches_done"] += 1
+        debug_sampled(logger, "pipeline.batch", "[pipeline] Батч загружен: %d шт. (всего %d)",
+                      len(batch["sources"]), self.stats["images_done"])
+        if on_batch_done:
+            on_batch_done(len(batch["sources"]))
+
+    def _release_when_uploaded(self, batch: dict, futures: list) -> None:
+        """Освобождает директории батча, когда загрузчик подтвердит все его запросы."""
+        state = {"pending": len(futures), "failed": False}
+
+        def done(future):
+            with self._lock:
+                state["pending"] -= 1
+                state["failed"] |= future.cancelled() or future.exception() is not None
+                last = state["pending"] == 0
+            if last:
+                self._release(batch, failed=state["failed"])
+
+        for future in futures:
+            future.add_done_callback(done)
+
+    def _release(self, batch: dict, failed: bool = False) -> None:
+        """Уменьшает счётчики директорий батча; директории без ошибок, дошедшие до нуля, завершены."""
+        completed = []
+        with self._lock:
+            for directory, count in Counter(batch.get("directories", [])).items():
+                if failed:
+                    self._failed_dirs.add(directory)
+                left = self._remaining.get(directory, 0) - count
+                if left > 0:
+                    self._remaining[directory] = left
+                    continue
+                self._remaining.pop(directory, None)
+                if directory not in self._failed_dirs:
+                    completed.append(directory)
+        for directory in completed:
+            self._directory_done(directory)
+
+    def _directory_done(self, directory: str) -> None:
+        if self._on_directory_done is None:
+            return
+        try:
+            self._on_directory_done(directory)
+        except Exception as e:
+            logger.error(f"[pipeline] Ошибка обработчика завершения директории {directory}: {e}")
@@ -0,0 +1,117 @@
+import time
+import logging
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor, wait as wait_futures
+from typing import List
+
+from qdrant_client.http import models
+
+from ..metrics import set_queue_depth, timed
+
+logger = logging.getLogger(__name__)
+
+
+class QdrantUploader:
+    """
+    Параллельная загрузка точек в Qdrant с ограничением числа запросов «в полёте».
+
+    Точки режутся на чанки по chunk_size и отправляются из пула потоков. Если заняты все
+    max_in_flight слотов, submit блокируется — это backpressure для стадии upsert конвейера.
+    Неудачные запросы повторяются с экспоненциальной задержкой. При wait=False Qdrant отвечает
+    сразу после записи в WAL; flush() дожидается всех запросов и повторно отправляет последний
+    чанк с wait=True — операции коллекции применяются по порядку, поэтому после ответа
+    все ранее отправленные точки видны в поиске.
+
+    Аргументы:
+      client: QdrantClient.
+      collection_name (str): Имя коллекции.
+      chunk_size (int): Число точек в одном запросе upsert.
+      max_in_flight (int): Максимальное число одновременных запросов.
+      max_retries (int): Число повторов при ошибке.
+      backoff (float): Начальная задержка между повторами, с (удваивается с каждой попыткой).
+      wait (bool): Ждать ли применения каждой операции на стороне Qdrant.
+    """
+    def __init__(self, client, collection_name: str, chunk_size: int = 256, max_in_flight: int = 4,
+                 max_retries: int = 3, backoff: float = 0.5, wait: bool = False):
+        self.client = client
+        self.collection_name = collection_name
+        self.chunk_size = max(1, chunk_size)
+        self.max_in_flight = max(1, max_in_flight)
+        self.max_retries = max(0, max_retries)
+        self.backoff = backoff
+        self.wait = wait
+        self._pool = ThreadPoolExecutor(max_workers=self.max_in_flight, thread_name_prefix="qdrant-upload")
+        self._slots = threading.BoundedSemaphore(self.max_in_flight)
+        self._lock = threading.Lock()
+        self._futures: List[Future] = []
+        self._last_chunk = None
+        self._in_flight = 0
+        self.stats = {"points_sent": 0, "points_failed": 0, "requests": 0, "retries": 0}
+
+    def submit(self, points: List[models.PointStruct]) -> List[Future]:
+        """Ставит точки в очередь на загрузку; блокируется, пока нет свободного слота."""
+        futures = []
+        for start in range(0, len(points), self.chunk_size):
+            chunk = points[start:start + self.chunk_size]
+            self._slots.acquire()
+            self._track_in_flight(1)
+            try:
+                future = self._pool.submit(self._upload, chunk)
+            except Exception:
+                self._track_in_flight(-1)
+                self._slots.release()
+                raise
+            future.add_done_callback(self._on_done)
+            futures.append(future)
+            self._last_chunk = chunk
+        with self._lock:
+            self._futures = [f for f in self._futures if not f.done()] + futures
+        return futures
+
+    def _track_in_flight(self, delta: int) -> None:
+        with self._lock:
+            self._in_flight += delta
+            set_queue_depth("upsert_in_flight", self._in_flight)
+
+    def _on_done(self, _: Future) -> None:
+        self._track_in_flight(-1)
+        self._slots.release()
+
+    def _upload(self, chunk: List[models.PointStruct]) -> int:
+        for attempt in range(self.max_retries + 1):
+            try:
+                with timed("upsert", len(chunk)):
+                    self.client.upsert(collection_name=self.collection_name, points=chunk, wait=self.wait)
+                with self._lock:
+                    self.stats["points_sent"] += len(chunk)
+                    self.stats["requests"] += 1
+                return len(chunk)
+            except Exception as e:
+                if attempt == self.max_retries:
+                    with self._lock:
+                        self.stats["points_failed"] += len(chunk)
+                    logger.error(f"[uploader] Не удалось загрузить {len(chunk)} точек: {e}")
+                    raise
+                delay = self.backoff * (2 ** attempt)
+                with self._lock:
+                    self.stats["retries"] += 1
+                logger.warning(f"[uploader] Ошибка upsert (попытка {attempt + 1}), повтор через {delay:.1f} с: {e}")
+                time.sleep(delay)
+
+    def flush(self) -> dict:
+        """Дожидается всех отправленных запросов и выполняет барьер согласованности. Возвращает статистику."""
+        with self._lock:
+            futures, self._futures = self._futures, []
+        wait_futures(futures)
+        if not self.wait and self._last_chunk and self.stats["points_sent"]:
+            try:
+                self.client.upsert(collection_name=self.collection_name, points=self._last_chunk, wait=True)
+            except Exception as e:
+                logger.error(f"[uploader] Ошибка финального upsert с wait=True: {e}")
+        self._last_chunk = None
+        return dict(self.stats)
+
+    def close(self) -> dict:
+        stats = self.flush()
+        self._pool.shutdown(wait=True)
+        return stats
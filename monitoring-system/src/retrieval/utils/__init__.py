@@ -1,7 +1,17 @@
 from .metadata_extractor import ImageMetadataExtractor
 from .s3_handler import S3ImageHandler
+from .s3_client import get_s3_client, get_transfer_config
+from .cache import LRUCache
+from .spill_cache import SpillCache
+from .point_ids import make_point_id, file_fingerprint
 
 __all__ = [
     "ImageMetadataExtractor",
     "S3ImageHandler",
+    "get_s3_client",
+    "get_transfer_config",
+    "LRUCache",
+    "SpillCache",
+    "make_point_id",
+    "file_fingerprint",
 ]
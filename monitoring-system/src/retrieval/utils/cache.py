@@ -0,0 +1,131 @@
+import os
+import time
+import pickle
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any, Hashable, Optional
+
+from ...metrics import cache_result
+
+logger = logging.getLogger(__name__)
+
+_MISSING = object()
+
+
+class LRUCache:
+    """
+    Потокобезопасный LRU-кэш с ограничением размера, опциональным TTL и счётчиками.
+
+    :param max_size: Максимальное число записей; при переполнении вытесняется самая давняя.
+    :param ttl: Время жизни записи в секундах (None — без ограничения).
+    :param persist_path: Файл для сохранения кэша между перезапусками (None — без сохранения).
+    :param name: Имя кэша в метрике geo_cache_requests_total (None — без метрик).
+    """
+    def __init__(self, max_size: int = 1024, ttl: Optional[float] = None, persist_path: Optional[str] = None,
+                 name: Optional[str] = None):
+        self.max_size = max(1, int(max_size))
+        self.name = name
+        self.ttl = ttl if ttl and ttl > 0 else None
+        self.persist_path = persist_path
+        self._data: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        if persist_path:
+            self.load()
+
+    def get(self, key: Hashable, default: Any = None, record: bool = True) -> Any:
+        """
+        Возвращает значение по ключу. При record=False счётчики попаданий и промахов
+        не изменяются (для повторной проверки ключа, уже учтённой вызывающим).
+        """
+        with self._lock:
+            entry = self._data.get(key, _MISSING)
+            if entry is not _MISSING and self.ttl is not None and time.time() - entry[1] > self.ttl:
+                del self._data[key]
+                self.expirations += 1
+                entry = _MISSING
+            if entry is _MISSING:
+                self.misses += record
+            else:
+                self._data.move_to_end(key)
+                self.hits += record
+        if record and self.name:
+            cache_result(self.name, entry is not _MISSING)
+        return default if entry is _MISSING else entry[0]
+
+    def put(self, key: Hashable, value: Any) -> None:
+        with self._lock:
+            self._data[key] = (value, time.time())
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            entry = self._data.pop(key, _MISSING)
+            return default if entry is _MISSING else entry[0]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def __contains__(self, key: Hashable) -> bool:
+        with self._lock:
+            return key in self._data
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def stats(self) -> dict:
+        """Возвращает счётчики попаданий, промахов и вытеснений."""
+        total = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
+
+    def save(self, path: Optional[str] = None) -> None:
+        """Сохраняет содержимое кэша на диск (атомарно, через временный файл)."""
+        path = path or self.persist_path
+        if not path:
+            return
+        with self._lock:
+            items = list(self._data.items())
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        tmp = f"{path}.tmp"
+        try:
+            with open(tmp, "wb") as f:
+                pickle.dump(items, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp, path)
+            logger.info(f"[LRUCache] Сохранено {len(items)} записей в {path}")
+        except Exception as e:
+            logger.error(f"[LRUCache] Ошибка сохранения кэша в {path}: {e}")
+
+    def load(self, path: Optional[str] = None) -> None:
+        """Загружает кэш с диска, пропуская просроченные записи."""
+        path = path or self.persist_path
+        if not path or not os.path.exists(path):
+            return
+        try:
+            with open(path, "rb") as f:
+                items = pickle.load(f)
+        except Exception as e:
+            logger.error(f"[LRUCache] Ошибка загрузки кэша из {path}: {e}")
+            return
+        now = time.time()
+        with self._lock:
+            for key, (value, created) in items[-self.max_size:]:
+                if self.ttl is not None and now - created > self.ttl:
+                    continue
+                self._data[key] = (value, created)
+        logger.info(f"[LRUCache] Загружено {len(self._data)} записей из {path}")
@@ -1,46 +1,162 @@
+import io
+import os
+import hashlib
 import exifread
 from datetime import datetime
-from typing import Optional, Tuple
+from typing import Optional, Tuple, Union
+
+from .cache import LRUCache
+from ...metrics import timed
+
+# Сколько байт с начала файла читать для EXIF: сегмент APP1 в JPEG не превышает 64 КБ
+EXIF_HEADER_BYTES = 256 * 1024
+
+
+def _ratio_to_float(value) -> Optional[float]:
+    try:
+        return value.num / value.den
+    except (AttributeError, ZeroDivisionError):
+        try:
+            return float(value)
+        except (TypeError, ValueError):
+            return None
+
 
 class ImageMetadataExtractor:
+    # Кэш разобранных метаданных: ключ — (путь, размер, mtime) или хэш заголовка для байтов
+    metadata_cache = LRUCache(
+        max_size=int(os.getenv("METADATA_CACHE_SIZE", "50000")),
+        persist_path=os.getenv("METADATA_CACHE_PATH") or None,
+        name="exif_metadata",
+    )
+
+    @classmethod
+    def extract_metadata(cls, image: Union[str, bytes]) -> dict:
+        """
+        Извлекает за один проход все нужные поля EXIF: координаты, высоту, направление съёмки,
+        дату и время, производителя и модель камеры. Для JPEG читается только заголовок файла.
+        Результат кэшируется по (путь, размер, mtime), поэтому повторная индексация не разбирает файл заново.
+        Для байтов (изображение уже в памяти) ключом служит хэш заголовка.
+        """
+        if isinstance(image, (bytes, bytearray, memoryview)):
+            header = bytes(image[:EXIF_HEADER_BYTES])
+            key = ("sha1", hashlib.sha1(header).hexdigest())
+        else:
+            stat = os.stat(image)
+            key = (os.path.abspath(image), stat.st_size, stat.st_mtime_ns)
+        cached = cls.metadata_cache.get(key)
+        if cached is not None:
+            return cached
+
+        with timed("exif"):
+            if not isinstance(image, str):
+                if header[:2] == b"\xff\xd8":
+                    tags = cls._process_tags(io.BytesIO(header), image)
+                else:
+                    tags = cls._process_tags(io.BytesIO(image), image)
+            else:
+                with open(image, 'rb') as f:
+                    header = f.read(EXIF_HEADER_BYTES)
+                    if header[:2] == b"\xff\xd8":
+                        tags = cls._process_tags(io.BytesIO(header), image)
+                    else:
+                        # TIFF и прочие форматы: IFD может находиться в любом месте файла
+                        f.seek(0)
+                        tags = cls._process_tags(f, image)
+            metadata = cls._parse_tags(tags or {}, image)
+        cls.metadata_cache.put(key, metadata)
+        return metadata
+
     @staticmethod
-    def extract_gps_coordinates(image_path: str) -> Optional[Tuple[float, float]]:
-        """Извлекает широту и долготу из EXIF-данных изображения."""
-        with open(image_path, 'rb') as f:
-            tags = exifread.process_file(f, details=False)
-        if not tags:
-            return None
+    def _process_tags(f, image) -> dict:
+        try:
+            return exifread.process_file(f, details=False)
+        except Exception as e:
+            name = image if isinstance(image, str) else "<bytes>"
+            print(f"Ошибка чтения EXIF для {name}: {e}")
+            return {}
+
+    @staticmethod
+    def _parse_tags(tags: dict, image) -> dict:
+        metadata = {}
+
         gps_latitude = tags.get('GPS GPSLatitude')
         gps_latitude_ref = tags.get('GPS GPSLatitudeRef')
         gps_longitude = tags.get('GPS GPSLongitude')
         gps_longitude_ref = tags.get('GPS GPSLongitudeRef')
-        if not all([gps_latitude, gps_latitude_ref, gps_longitude, gps_longitude_ref]):
-            return None
+        if all([gps_latitude, gps_latitude_ref, gps_longitude, gps_longitude_ref]):
+            def convert_to_decimal(gps_value, ref):
+                degrees, minutes, seconds = (_ratio_to_float(v) or 0.0 for v in gps_value.values[:3])
+                decimal = degrees + (minutes / 60) + (seconds / 3600)
+                if ref.values in ['S', 'W']:
+                    decimal = -decimal
+                return decimal
+            try:
+                metadata["lat"] = convert_to_decimal(gps_latitude, gps_latitude_ref)
+                metadata["lon"] = convert_to_decimal(gps_longitude, gps_longitude_ref)
+            except (IndexError, ValueError) as e:
+                print(f"Ошибка преобразования GPS: {e}")
 
-        def convert_to_decimal(gps_value, ref):
-            degrees = gps_value.values[0].num / gps_value.values[0].den
-            minutes = gps_value.values[1].num / gps_value.values[1].den
-            seconds = gps_value.values[2].num / gps_value.values[2].den
-            decimal = degrees + (minutes / 60) + (seconds / 3600)
-            if ref.values in ['S', 'W']:
-                decimal = -decimal
-            return decimal
+        altitude = tags.get('GPS GPSAltitude')
+        if altitude:
+            value = _ratio_to_float(altitude.values[0])
+            if value is not None:
+                # GPSAltitudeRef = 1 — высота ниже уровня моря
+                altitude_ref = tags.get('GPS GPSAltitudeRef')
+                below_sea = altitude_ref is not None and list(altitude_ref.values)[:1] == [1]
+                metadata["altitude"] = -value if below_sea else value
 
-        lat = convert_to_decimal(gps_latitude, gps_latitude_ref)
-        lon = convert_to_decimal(gps_longitude, gps_longitude_ref)
-        return (lat, lon)
+        heading = tags.get('GPS GPSImgDirection')
+        if heading:
+            value = _ratio_to_float(heading.values[0])
+            if value is not None:
+                metadata["heading"] = value
+
+        make = tags.get('Image Make')
+        model = tags.get('Image Model')
+        if make:
+            metadata["camera_make"] = str(make).strip()
+        if model:
+            metadata["camera_model"] = str(model).strip()
 
-    @staticmethod
-    def extract_datetime(image_path: str) -> Optional[datetime]:
-        """Извлекает дату и время съемки из EXIF-данных изображения."""
-        with open(image_path, 'rb') as f:
-            tags = exifread.process_file(f, details=False)
         dt_tag = tags.get('EXIF DateTimeOriginal') or tags.get('Image DateTime')
-        if not dt_tag:
-            return None
-        try:
-            dt = datetime.strptime(str(dt_tag), "%Y:%m:%d %H:%M:%S")
-            return dt
-        except Exception as e:
-            print(f"Ошибка преобразования даты для {image_path}: {e}")
+        if dt_tag:
+            try:
+                metadata["datetime"] = datetime.strptime(str(dt_tag), "%Y:%m:%d %H:%M:%S")
+            except Exception as e:
+                name = image if isinstance(image, str) else "<bytes>"
+                print(f"Ошибка преобразования даты для {name}: {e}")
+        return metadata
+
+    @staticmethod
+    def metadata_to_payload(metadata: dict) -> dict:
+        """Преобразует результат extract_metadata в поля payload Qdrant."""
+        payload = {}
+        if "lat" in metadata and "lon" in metadata:
+            lat, lon = float(metadata["lat"]), float(metadata["lon"])
+            # location — geo-поле для индексированной фильтрации; lat/lon остаются для интерфейса
+            payload.update({"lat": lat, "lon": lon, "location": {"lat": lat, "lon": lon}})
+        dt = metadata.get("datetime")
+        if dt:
+            payload.update({
+                "timestamp": dt.timestamp(),
+                "date": [dt.year, dt.month, dt.day],
+                "time": [dt.hour, dt.minute, dt.second]
+            })
+        for field in ("altitude", "heading", "camera_make", "camera_model"):
+            if field in metadata:
+                payload[field] = metadata[field]
+        return payload
+
+    @classmethod
+    def extract_gps_coordinates(cls, image_path: str) -> Optional[Tuple[float, float]]:
+        """Извлекает широту и долготу из EXIF-данных изображения."""
+        metadata = cls.extract_metadata(image_path)
+        if "lat" not in metadata or "lon" not in metadata:
             return None
+        return (metadata["lat"], metadata["lon"])
+
+    @classmethod
+    def extract_datetime(cls, image_path: str) -> Optional[datetime]:
+        """Извлекает дату и время съемки из EXIF-данных изображения."""
+        return cls.extract_metadata(image_path).get("datetime")
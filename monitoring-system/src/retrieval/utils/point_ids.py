@@ -0,0 +1,24 @@
+import os
+import uuid
+from typing import Optional
+
+# Пространство имён для детерминированных идентификаторов точек (UUIDv5 от источника изображения)
+POINT_ID_NAMESPACE = uuid.uuid5(uuid.NAMESPACE_URL, "operational-situation-display-system/geo_embeddings")
+
+
+def make_point_id(source: str) -> str:
+    """
+    Возвращает стабильный идентификатор точки Qdrant для источника (локальный путь или s3:// URI).
+    В отличие от hash(), результат не зависит от процесса, поэтому повторная индексация
+    перезаписывает те же точки, а не создаёт дубликаты.
+    """
+    return str(uuid.uuid5(POINT_ID_NAMESPACE, source))
+
+
+def file_fingerprint(path: str) -> Optional[str]:
+    """Отпечаток содержимого локального файла по размеру и времени изменения (без чтения файла)."""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return f"{stat.st_size}-{stat.st_mtime_ns}"
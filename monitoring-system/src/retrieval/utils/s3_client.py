@@ -0,0 +1,69 @@
+import os
+import threading
+from typing import Optional
+
+import boto3
+from boto3.s3.transfer import TransferConfig
+from botocore.config import Config
+
+# Число параллельных загрузок из S3 в батче/директории (fetch и download_s3_keys)
+S3_FETCH_WORKERS = int(os.getenv("S3_FETCH_WORKERS", "8"))
+# Параллельные части одного файла при multipart-скачивании
+S3_TRANSFER_CONCURRENCY = int(os.getenv("S3_TRANSFER_CONCURRENCY", "4"))
+
+_lock = threading.Lock()
+_clients = {}
+_transfer_config: Optional[TransferConfig] = None
+
+
+def _client_config() -> Config:
+    # Пул соединений должен покрывать все одновременные запросы: параллельный fetch, скачивание
+    # директорий и части multipart-загрузок; иначе запросы ждут соединение или открывают новое (TLS)
+    default_pool = 2 * S3_FETCH_WORKERS + S3_FETCH_WORKERS * S3_TRANSFER_CONCURRENCY
+    return Config(
+        max_pool_connections=int(os.getenv("S3_MAX_POOL_CONNECTIONS", str(default_pool))),
+        retries={
+            "max_attempts": int(os.getenv("S3_MAX_ATTEMPTS", "5")),
+            # adaptive — повторы с клиентским ограничением скорости при троттлинге хранилища
+            "mode": os.getenv("S3_RETRY_MODE", "adaptive"),
+        },
+        connect_timeout=float(os.getenv("S3_CONNECT_TIMEOUT", "5")),
+        read_timeout=float(os.getenv("S3_READ_TIMEOUT", "60")),
+        tcp_keepalive=True,
+    )
+
+
+def get_s3_client():
+    """
+    Общий клиент S3 процесса. Клиенты boto3 потокобезопасны, поэтому один клиент с пулом соединений
+    используется всеми потоками; после fork/spawn в новом процессе создаётся свой.
+    Endpoint и регион берутся из S3_ENDPOINT_URL и S3_REGION (иначе — из настроек AWS).
+    """
+    pid = os.getpid()
+    client = _clients.get(pid)
+    if client is not None:
+        return client
+    with _lock:
+        if pid not in _clients:
+            session = boto3.session.Session()
+            _clients[pid] = session.client(
+                "s3",
+                endpoint_url=os.getenv("S3_ENDPOINT_URL") or None,
+                region_name=os.getenv("S3_REGION") or None,
+                config=_client_config(),
+            )
+        return _clients[pid]
+
+
+def get_transfer_config() -> TransferConfig:
+    """Настройки download_file: порог и размер частей multipart-загрузки, число параллельных частей."""
+    global _transfer_config
+    if _transfer_config is None:
+        mb = 1024 * 1024
+        _transfer_config = TransferConfig(
+            multipart_threshold=int(float(os.getenv("S3_MULTIPART_THRESHOLD_MB", "64")) * mb),
+            multipart_chunksize=int(float(os.getenv("S3_MULTIPART_CHUNKSIZE_MB", "16")) * mb),
+            max_concurrency=S3_TRANSFER_CONCURRENCY,
+            use_threads=S3_TRANSFER_CONCURRENCY > 1,
+        )
+    return _transfer_config
@@ -1,80 +1,126 @@
 import os
 import logging
 from concurrent.futures import ThreadPoolExecutor
-import boto3
 from botocore.exceptions import ClientError
-from typing import List, Optional
+from typing import Iterator, List, Optional
+
+from .s3_client import S3_FETCH_WORKERS, get_s3_client, get_transfer_config
+from ...metrics import cache_result, debug_sampled, timed
 
 logger = logging.getLogger(__name__)
 CACHE_DIR = os.getenv("DATASETS_DIR", "./datasets")
 
 class S3ImageHandler:
+    valid_ext = ('.jpg','.jpeg','.png','.bmp','.tiff','.tif')
+
     @staticmethod
-    def list_s3_images(s3_path: str) -> List[str]:
-        valid_ext = ('.jpg','.jpeg','.png','.bmp','.tiff','.tif')
+    def split_s3_path(s3_path: str):
         path = s3_path[5:]
         bucket, prefix = (path.split('/',1)+[''])[:2]
-        s3 = boto3.client('s3')
+        return bucket, prefix
+
+    @staticmethod
+    def local_cache_path(bucket: str, key: str, root: Optional[str] = None) -> str:
+        return os.path.join(root or CACHE_DIR, bucket, key)
+
+    @staticmethod
+    def listing_fingerprint(obj: dict) -> str:
+        """Отпечаток объекта S3 по данным листинга (ETag и размер) — без чтения самого объекта."""
+        return f"{obj['ETag'].strip(chr(34))}-{obj['Size']}"
+
+    @staticmethod
+    def read_s3_object(image_path: str) -> bytes:
+        """Читает объект s3://bucket/key целиком в память."""
+        bucket, key = image_path[5:].split('/', 1)
+        with timed("s3_fetch"):
+            return get_s3_client().get_object(Bucket=bucket, Key=key)['Body'].read()
+
+    @staticmethod
+    def iter_s3_objects(s3_path: str) -> Iterator[dict]:
+        """
+        Лениво перечисляет объекты-изображения по префиксу (постранично, в лексикографическом порядке ключей).
+        Возвращает словари листинга S3 (Key, ETag, Size, ...).
+        """
+        bucket, prefix = S3ImageHandler.split_s3_path(s3_path)
+        s3 = get_s3_client()
         try:
             s3.head_bucket(Bucket=bucket)
         except ClientError:
             logger.error(f"Bucket not found: {bucket}")
-            return []
+            return
         paginator = s3.get_paginator('list_objects_v2')
-        keys=[]
         for page in paginator.paginate(Bucket=bucket, Prefix=prefix):
             for obj in page.get('Contents',[]):
-                key=obj['Key']
-                if key.lower().endswith(valid_ext):
-                    keys.append(key)
-        return [f"s3://{bucket}/{k}" for k in keys]
+                if obj['Key'].lower().endswith(S3ImageHandler.valid_ext):
+                    yield obj
+
+    @staticmethod
+    def list_s3_images(s3_path: str) -> List[str]:
+        bucket, _ = S3ImageHandler.split_s3_path(s3_path)
+        return [f"s3://{bucket}/{obj['Key']}" for obj in S3ImageHandler.iter_s3_objects(s3_path)]
 
     @staticmethod
     def get_local_image_path(image_path: str) -> str:
         if not image_path.startswith('s3://'):
             return image_path
         bucket,key = image_path[5:].split('/',1)
-        local=os.path.join(CACHE_DIR,bucket,key)
+        local=S3ImageHandler.local_cache_path(bucket,key)
         if os.path.exists(local):
-            logger.info(f"[CACHE] hit: {local}")
+            cache_result("s3_local", True)
+            debug_sampled(logger, "s3.cache_hit", "[CACHE] hit: %s", local)
             return local
+        cache_result("s3_local", False)
         os.makedirs(os.path.dirname(local),exist_ok=True)
-        logger.info(f"[CACHE] download: {image_path} -> {local}")
-        boto3.client('s3').download_file(bucket,key,local)
+        debug_sampled(logger, "s3.download", "[CACHE] download: %s -> %s", image_path, local)
+        with timed("s3_fetch"):
+            get_s3_client().download_file(bucket,key,local,Config=get_transfer_config())
         return local
 
+    @staticmethod
+    def download_s3_keys(bucket: str, keys: List[str], max_workers: int = S3_FETCH_WORKERS,
+                         root: Optional[str] = None) -> List[str]:
+        """
+        Скачивает указанные ключи в локальный кэш (существующие файлы пропускаются).
+        root — корень кэша (по умолчанию DATASETS_DIR). Возвращает локальные пути в порядке ключей.
+        """
+        s3=get_s3_client()
+        def dl(k):
+            out=S3ImageHandler.local_cache_path(bucket,k,root)
+            if os.path.exists(out):
+                cache_result("s3_local", True)
+                debug_sampled(logger, "s3.cache_hit", "[CACHE] hit (skip): %s", out)
+                return out
+            cache_result("s3_local", False)
+            os.makedirs(os.path.dirname(out),exist_ok=True)
+            debug_sampled(logger, "s3.download", "[CACHE] download: s3://%s/%s -> %s", bucket, k, out)
+            with timed("s3_fetch"):
+                s3.download_file(bucket,k,out,Config=get_transfer_config())
+            return out
+        with ThreadPoolExecutor(max_workers=max_workers) as ex:
+            return list(ex.map(dl,keys))
+
     @staticmethod
     def download_s3_folder(s3_path: str, local_dir: Optional[str]=None) -> None:
-        valid_ext = ('.jpg','.jpeg','.png','.bmp','.tiff','.tif')
-        path=s3_path[5:]
-        bucket,prefix=(path.split('/',1)+[''])[:2]
+        bucket,prefix=S3ImageHandler.split_s3_path(s3_path)
         if not local_dir:
             local_dir=os.path.join(CACHE_DIR,bucket,prefix)
         os.makedirs(local_dir,exist_ok=True)
         logger.info(f"[CACHE] Download S3 folder: {s3_path} -> {local_dir}")
-        s3=boto3.client('s3')
-        try:
-            s3.head_bucket(Bucket=bucket)
-        except ClientError:
-            logger.error(f"Bucket not found: {bucket}")
-            return
-        paginator=s3.get_paginator('list_objects_v2')
-        keys=[]
-        for page in paginator.paginate(Bucket=bucket,Prefix=prefix):
-            for obj in page.get('Contents',[]):
-                key=obj['Key']
-                if key.lower().endswith(valid_ext):
-                    keys.append(key)
+        keys=[obj['Key'] for obj in S3ImageHandler.iter_s3_objects(s3_path)]
         logger.info(f"[CACHE] Found {len(keys)} image keys in {s3_path}")
+        s3=get_s3_client()
         def dl(k):
             rel=k[len(prefix):].lstrip('/')
             out=os.path.join(local_dir,rel)
             if os.path.exists(out):
-                logger.info(f"[CACHE] hit (skip): {out}")
+                cache_result("s3_local", True)
+                debug_sampled(logger, "s3.cache_hit", "[CACHE] hit (skip): %s", out)
                 return
+            cache_result("s3_local", False)
             os.makedirs(os.path.dirname(out),exist_ok=True)
-            logger.info(f"[CACHE] download: s3://{bucket}/{k} -> {out}")
-            s3.download_file(bucket,k,out)
-        with ThreadPoolExecutor(max_workers=8) as ex:
+            debug_sampled(logger, "s3.download", "[CACHE] download: s3://%s/%s -> %s", bucket, k, out)
+            with timed("s3_fetch"):
+                s3.download_file(bucket,k,out,Config=get_transfer_config())
+        with ThreadPoolExecutor(max_workers=S3_FETCH_WORKERS) as ex:
             list(ex.map(dl,keys))
         logger.info(f"[CACHE] Folder download complete: {len(keys)} files")
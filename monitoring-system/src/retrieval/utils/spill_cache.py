@@ -0,0 +1,149 @@
+import os
+import shutil
+import logging
+import threading
+from collections import OrderedDict
+from typing import Dict, Iterable, Optional, Set
+
+logger = logging.getLogger(__name__)
+
+
+class SpillCache:
+    """
+    Дисковый кэш файлов из S3, ограниченный по суммарному размеру.
+
+    Используется потоковой индексацией S3 для объектов, которым нужен файл на диске
+    (очистка дубликатов открывает изображения директории по путям). Место под директорию
+    резервируется до скачивания (reserve), и её файлы закреплены, пока очистка не закончится (unpin):
+    закреплённые файлы не вытесняются. Остальные файлы при превышении max_bytes удаляются по LRU;
+    такой файл на стадии fetch заново читается из S3, поэтому их вытеснение влияет только на трафик,
+    а не на результат. Директорию, под которую не хватает места, reserve отклоняет.
+
+    :param root: Корневая директория кэша (своя для каждого процесса: при создании она очищается,
+        так как файлы прошлых запусков не учтены в размере).
+    :param max_bytes: Максимальный суммарный размер файлов (вместе с зарезервированным местом).
+    """
+    def __init__(self, root: str, max_bytes: int):
+        self.root = root
+        shutil.rmtree(root, ignore_errors=True)
+        os.makedirs(root, exist_ok=True)
+        self.max_bytes = max(0, int(max_bytes))
+        self._entries: "OrderedDict[str, int]" = OrderedDict()
+        # Закреплённые директории: директория -> её файлы; файл -> директория; ожидаемые размеры ещё не скачанных
+        self._pins: Dict[str, Set[str]] = {}
+        self._pinned: Dict[str, str] = {}
+        self._reserved: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        self.total_bytes = 0
+        self.reserved_bytes = 0
+        self.evictions = 0
+        self.rejections = 0
+
+    def local_path(self, bucket: str, key: str) -> str:
+        return os.path.join(self.root, bucket, key)
+
+    def reserve(self, directory: str, files: Dict[str, int]) -> bool:
+        """
+        Резервирует место под файлы директории (локальный путь -> размер из листинга) до их скачивания
+        и закрепляет их до unpin(directory). Для этого вытесняются только незакреплённые файлы.
+        Возвращает False, если директория не помещается: больше max_bytes сама по себе или вместе
+        с уже закреплёнными директориями (тогда ничего не вытесняется).
+        """
+        evicted = []
+        with self._lock:
+            need = sum(size for path, size in files.items() if path not in self._entries)
+            held = sum(self._entries[path] for path in files if path in self._entries)
+            over = self.total_bytes + self.reserved_bytes + need - self.max_bytes
+            evictable = [(path, size) for path, size in self._entries.items()
+                         if path not in self._pinned and path not in files]
+            if held + need > self.max_bytes or over > sum(size for _, size in evictable):
+                self.rejections += 1
+                return False
+            for path, size in evictable:
+                if over <= 0:
+                    break
+                del self._entries[path]
+                self.total_bytes -= size
+                self.evictions += 1
+                over -= size
+                evicted.append(path)
+            self._pins.setdefault(directory, set()).update(files)
+            for path, size in files.items():
+                self._pinned[path] = directory
+                if path not in self._entries:
+                    self.reserved_bytes += size - self._reserved.get(path, 0)
+                    self._reserved[path] = size
+        for path in evicted:
+            self._remove_file(path)
+        return True
+
+    def unpin(self, directory: str) -> None:
+        """Снимает закрепление директории (очистка закончена): её файлы остаются в кэше на общих правах LRU."""
+        with self._lock:
+            for path in self._pins.pop(directory, ()):
+                self._pinned.pop(path, None)
+                self.reserved_bytes -= self._reserved.pop(path, 0)
+
+    def register(self, path: str) -> None:
+        """
+        Учитывает скачанный файл (для закреплённого — вместо его резерва) и при переполнении
+        вытесняет самые давние незакреплённые файлы, кроме только что добавленного.
+        """
+        size = os.path.getsize(path)
+        evicted = []
+        with self._lock:
+            self.reserved_bytes -= self._reserved.pop(path, 0)
+            self.total_bytes += size - self._entries.pop(path, 0)
+            self._entries[path] = size
+            if self.total_bytes + self.reserved_bytes > self.max_bytes:
+                for old_path, old_size in list(self._entries.items()):
+                    if self.total_bytes + self.reserved_bytes <= self.max_bytes:
+                        break
+                    if old_path == path or old_path in self._pinned:
+                        continue
+                    del self._entries[old_path]
+                    self.total_bytes -= old_size
+                    self.evictions += 1
+                    evicted.append(old_path)
+        for old_path in evicted:
+            self._remove_file(old_path)
+
+    def get(self, path: str) -> Optional[str]:
+        """Возвращает путь, если файл есть в кэше, и отмечает его как недавно использованный."""
+        with self._lock:
+            if path not in self._entries:
+                return None
+            self._entries.move_to_end(path)
+        return path if os.path.exists(path) else None
+
+    def discard(self, paths: Iterable[str]) -> None:
+        """Удаляет файлы, которые больше не понадобятся (уже обработаны или отброшены очисткой)."""
+        for path in paths:
+            with self._lock:
+                size = self._entries.pop(path, None)
+                if size is not None:
+                    self.total_bytes -= size
+                self.reserved_bytes -= self._reserved.pop(path, 0)
+            if size is not None:
+                self._remove_file(path)
+
+    @staticmethod
+    def _remove_file(path: str) -> None:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logger.warning(f"[spill] Не удалось удалить {path}: {e}")
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "files": len(self._entries),
+                "bytes": self.total_bytes,
+                "reserved_bytes": self.reserved_bytes,
+                "pinned_dirs": len(self._pins),
+                "max_bytes": self.max_bytes,
+                "evictions": self.evictions,
+                "rejections": self.rejections,
+            }
@@ -0,0 +1,210 @@
+"""IngestionJobManager: контрольные точки, отмена и возобновление задач."""
+import threading
+import time
+from concurrent.futures import Future
+from concurrent.futures.process import BrokenProcessPool
+
+import pytest
+
+from src.ingestion import IngestionRunner
+from src.jobs import IngestionJobManager, JobStore
+
+DIRS = ["d0", "d1", "d2", "d3"]
+
+
+class FakeIndexer:
+    """
+    process_image_folder по директориям DIRS: каждая завершённая директория — одно изображение.
+    block_after — после стольких директорий ждать release или отмены; fail_at — упасть на этой директории.
+    """
+    def __init__(self, block_after=None, fail_at=None):
+        self.block_after = block_after
+        self.fail_at = fail_at
+        self.release = threading.Event()
+        self.blocked = threading.Event()
+        self.calls = []
+
+    def process_image_folder(self, folder_path, batch_size, show_progress=False, skip_dirs=None,
+                             on_directory_done=None, progress_callback=None, cancel_event=None):
+        skip_dirs = set(skip_dirs or ())
+        self.calls.append(skip_dirs)
+        stats = {"images_listed": 0, "images_skipped": 0, "images_done": 0, "cancelled": False,
+                 "stage_seconds": {}}
+        for idx, directory in enumerate(d for d in DIRS if d not in skip_dirs):
+            if idx == self.block_after:
+                self.blocked.set()
+                while not self.release.wait(0.05):
+                    if cancel_event is not None and cancel_event.is_set():
+                        stats["cancelled"] = True
+                        return stats
+            if directory == self.fail_at:
+                raise ConnectionError("qdrant unavailable")
+            stats["images_listed"] += 1
+            stats["images_done"] += 1
+            on_directory_done(directory)
+            progress_callback(stats)
+        return stats
+
+
+class CrashingRunner(IngestionRunner):
+    """
+    Первые crashes задач «роняют процесс индексации»: задача успевает записать контрольную точку
+    с первой директорией и остаться running, а Future завершается BrokenProcessPool.
+    """
+    def __init__(self, indexer, crashes):
+        super().__init__(mode="thread", indexer=indexer)
+        self.crashes = crashes
+
+    def call(self, fn, *args):
+        if not self.crashes:
+            return super().call(fn, *args)
+        self.crashes -= 1
+        jobs_dir, job_id = args[0], args[1]
+        future = Future()
+
+        def crash():
+            store = JobStore(jobs_dir)
+            job = store.load(job_id)
+            job.update(status="running", attempts=job["attempts"] + 1, done_dirs=["d0"])
+            store.save(job)
+            future.set_exception(BrokenProcessPool("A process in the process pool was terminated abruptly"))
+
+        threading.Thread(target=crash).start()
+        return future
+
+
+def wait_status(manager, job_id, statuses=("completed", "failed", "cancelled"), timeout=10.0):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        job = manager.get(job_id)
+        if job["status"] in statuses and not manager._futures.get(job_id):
+            return job
+        time.sleep(0.02)
+    raise AssertionError(f"Задача {job_id} не перешла в {statuses}: {manager.get(job_id)}")
+
+
+@pytest.fixture
+def make_manager(tmp_path):
+    runners = []
+
+    def make(indexer, max_workers=1, runner=None, max_attempts=3):
+        runner = runner or IngestionRunner(mode="thread", indexer=indexer, max_workers=max_workers)
+        runners.append(runner)
+        return IngestionJobManager(runner, str(tmp_path / "jobs"), checkpoint_interval=0,
+                                   max_attempts=max_attempts)
+
+    yield make
+    for runner in runners:
+        runner.shutdown(wait=True)
+
+
+def test_job_checkpoints_completed_directories(make_manager):
+    manager = make_manager(FakeIndexer())
+    job = manager.submit("/data/flights", batch_size=8)
+    job = wait_status(manager, job["id"])
+    assert job["status"] == "completed"
+    assert job["done_dirs"] == len(DIRS) and job["images_done_total"] == len(DIRS)
+    assert manager.store.load(job["id"])["done_dirs"] == DIRS
+
+
+def test_failed_job_keeps_its_checkpoint(make_manager):
+    manager = make_manager(FakeIndexer(fail_at="d2"))
+    job = wait_status(manager, manager.submit("/data/flights")["id"])
+    assert job["status"] == "failed" and "qdrant unavailable" in job["error"]
+    assert manager.store.load(job["id"])["done_dirs"] == ["d0", "d1"]
+
+
+def test_cancel_running_job_stops_after_current_directory(make_manager):
+    indexer = FakeIndexer(block_after=1)
+    manager = make_manager(indexer)
+    job = manager.submit("/data/flights")
+    assert indexer.blocked.wait(5)
+    assert manager.cancel(job["id"])["cancel_requested"]
+    job = wait_status(manager, job["id"])
+    assert job["status"] == "cancelled" and job["done_dirs"] == 1
+    assert not manager.store.cancel_requested(job["id"])
+
+
+def test_cancel_queued_job(make_manager):
+    indexer = FakeIndexer(block_after=0)
+    manager = make_manager(indexer)
+    running = manager.submit("/data/first")
+    queued = manager.submit("/data/second")
+    assert indexer.blocked.wait(5)
+    manager.cancel(queued["id"])
+    assert wait_status(manager, queued["id"])["status"] == "cancelled"
+    indexer.release.set()
+    assert wait_status(manager, running["id"])["status"] == "completed"
+    assert len(indexer.calls) == 1
+
+
+def test_resume_pending_continues_from_checkpoint(make_manager, tmp_path):
+    store = JobStore(str(tmp_path / "jobs"))
+    store.save({"id": "interrupted", "folder_path": "/data/flights", "batch_size": 8, "status": "running",
+                "created_at": time.time(), "started_at": time.time(), "finished_at": None, "attempts": 1,
+                "done_dirs": ["d0", "d1"], "progress": {"images_done": 2}, "error": None})
+    store.save({"id": "finished", "folder_path": "/data/other", "batch_size": 8, "status": "completed",
+                "created_at": time.time(), "attempts": 1, "done_dirs": DIRS, "progress": {}, "error": None})
+    indexer = FakeIndexer()
+    manager = make_manager(indexer)
+    assert manager.resume_pending() == ["interrupted"]
+    job = wait_status(manager, "interrupted")
+    assert indexer.calls == [{"d0", "d1"}]
+    assert job["status"] == "completed" and job["attempts"] == 2
+    assert job["images_done_total"] == len(DIRS)
+    assert manager.store.load("interrupted")["done_dirs"] == DIRS
+
+
+def test_crashed_worker_requeues_job_from_checkpoint(make_manager):
+    indexer = FakeIndexer()
+    manager = make_manager(indexer, runner=CrashingRunner(indexer, crashes=1))
+    job = wait_status(manager, manager.submit("/data/flights")["id"])
+    assert job["status"] == "completed" and job["attempts"] == 2
+    assert indexer.calls == [{"d0"}]
+    assert manager.store.load(job["id"])["done_dirs"] == DIRS
+
+
+def test_crashed_worker_fails_job_after_max_attempts(make_manager):
+    indexer = FakeIndexer()
+    manager = make_manager(indexer, runner=CrashingRunner(indexer, crashes=5), max_attempts=2)
+    job = wait_status(manager, manager.submit("/data/flights")["id"])
+    assert job["status"] == "failed" and job["attempts"] == 2
+    assert "terminated abruptly" in job["error"]
+    assert indexer.calls == []
+    assert manager.store.load(job["id"])["done_dirs"] == ["d0"]
+
+
+def test_resume_failed_job_keeps_done_dirs(make_manager):
+    indexer = FakeIndexer(fail_at="d2")
+    manager = make_manager(indexer)
+    job_id = manager.submit("/data/flights")["id"]
+    assert wait_status(manager, job_id)["status"] == "failed"
+    indexer.fail_at = None
+    assert manager.resume(job_id)["status"] == "queued"
+    job = wait_status(manager, job_id)
+    assert indexer.calls[-1] == {"d0", "d1"}
+    assert job["status"] == "completed" and job["attempts"] == 2 and job["error"] is None
+    assert job["images_done_total"] == len(DIRS)
+
+
+def test_resume_cancelled_job(make_manager):
+    indexer = FakeIndexer(block_after=1)
+    manager = make_manager(indexer)
+    job_id = manager.submit("/data/flights")["id"]
+    assert indexer.blocked.wait(5)
+    manager.cancel(job_id)
+    assert wait_status(manager, job_id)["status"] == "cancelled"
+    indexer.block_after = None
+    manager.resume(job_id)
+    job = wait_status(manager, job_id)
+    assert job["status"] == "completed" and not job["cancel_requested"]
+    assert indexer.calls[-1] == {"d0"}
+
+
+def test_resume_rejects_completed_and_unknown_jobs(make_manager):
+    manager = make_manager(FakeIndexer())
+    job_id = manager.submit("/data/flights")["id"]
+    assert wait_status(manager, job_id)["status"] == "completed"
+    with pytest.raises(ValueError):
+        manager.resume(job_id)
+    assert manager.resume("missing") is None
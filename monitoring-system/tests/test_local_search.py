@@ -0,0 +1,87 @@
+"""Поиск во встроенном Qdrant (QDRANT_PATH=:memory:): search, search_batch, search_similar и фильтры."""
+from datetime import datetime
+
+import pytest
+from qdrant_client.http import models
+
+from src.retrieval import ImageQdrantIndexer, ImageMetadataExtractor
+from src.retrieval.utils import make_point_id
+
+# Два кадра в Москве в разные дни, один в Санкт-Петербурге и один без EXIF
+FRAMES = {
+    "moscow_1.jpg": ([1.0, 0.0, 0.0, 0.0], {"lat": 55.751, "lon": 37.618, "datetime": datetime(2024, 6, 1, 10, 0)}),
+    "moscow_2.jpg": ([0.9, 0.1, 0.0, 0.0], {"lat": 55.760, "lon": 37.620, "datetime": datetime(2024, 6, 2, 10, 0)}),
+    "spb.jpg": ([0.0, 1.0, 0.0, 0.0], {"lat": 59.934, "lon": 30.306, "datetime": datetime(2024, 6, 1, 15, 0)}),
+    "no_exif.jpg": ([0.0, 0.0, 1.0, 0.0], {}),
+}
+MOSCOW_BBOX = (55.70, 55.80, 37.50, 37.70)
+MOSCOW_POLYGON = [(55.70, 37.50), (55.80, 37.50), (55.80, 37.70), (55.70, 37.70)]
+
+
+@pytest.fixture(scope="module")
+def indexer():
+    indexer = ImageQdrantIndexer(embedder=None, cleaner=None, collection_name="test_local",
+                                 vector_size=4, qdrant_path=":memory:")
+    indexer.client.upsert(collection_name=indexer.collection_name, points=[
+        models.PointStruct(id=make_point_id(source), vector=vector,
+                           payload={"source": source, **ImageMetadataExtractor.metadata_to_payload(metadata)})
+        for source, (vector, metadata) in FRAMES.items()
+    ])
+    return indexer
+
+
+def sources(hits):
+    return [hit["payload"]["source"] for hit in hits]
+
+
+def test_search_orders_by_similarity(indexer):
+    hits = indexer.search(None, top_k=2, query_vector=[1.0, 0.0, 0.0, 0.0])
+    assert sources(hits) == ["moscow_1.jpg", "moscow_2.jpg"]
+    assert hits[0]["payload"]["coordinates"] == (55.751, 37.618)
+    assert hits[0]["score"] >= hits[1]["score"]
+
+
+@pytest.mark.parametrize("filters, expected", [
+    ({"coord_range": MOSCOW_BBOX}, {"moscow_1.jpg", "moscow_2.jpg"}),
+    ({"radius": (59.934, 30.306, 5000)}, {"spb.jpg"}),
+    ({"polygon": MOSCOW_POLYGON}, {"moscow_1.jpg", "moscow_2.jpg"}),
+    ({"start_datetime": "2024-06-02"}, {"moscow_2.jpg"}),
+    ({"end_datetime": "2024-06-01"}, {"moscow_1.jpg", "spb.jpg"}),
+    ({"coord_range": MOSCOW_BBOX, "end_datetime": "2024-06-01"}, {"moscow_1.jpg"}),
+])
+def test_search_filters(indexer, filters, expected):
+    hits = indexer.search(None, top_k=10, query_vector=[0.0, 0.0, 0.0, 1.0], **filters)
+    assert set(sources(hits)) == expected
+
+
+def test_search_batch_applies_per_query_filters(indexer):
+    results = indexer.search_batch([
+        {"query": None, "query_vector": [0.0, 1.0, 0.0, 0.0], "top_k": 1},
+        {"query": None, "query_vector": [0.0, 1.0, 0.0, 0.0], "top_k": 10, "coord_range": MOSCOW_BBOX},
+        {"query": None, "query_vector": [1.0, 0.0, 0.0, 0.0], "top_k": 10, "radius": (59.934, 30.306, 5000)},
+    ])
+    assert sources(results[0]) == ["spb.jpg"]
+    assert set(sources(results[1])) == {"moscow_1.jpg", "moscow_2.jpg"}
+    assert sources(results[2]) == ["spb.jpg"]
+
+
+def test_search_similar_excludes_seed_point(indexer):
+    hits = indexer.search_similar(make_point_id("moscow_1.jpg"), top_k=2)
+    assert sources(hits)[0] == "moscow_2.jpg"
+    assert "moscow_1.jpg" not in sources(hits)
+
+
+def test_search_similar_with_filter(indexer):
+    hits = indexer.search_similar(make_point_id("moscow_1.jpg"), top_k=10, polygon=MOSCOW_POLYGON)
+    assert sources(hits) == ["moscow_2.jpg"]
+
+
+def test_search_similar_missing_point_is_not_found(indexer):
+    with pytest.raises(Exception) as error:
+        indexer.search_similar(make_point_id("missing.jpg"))
+    assert indexer.is_not_found(error.value)
+
+
+def test_polygon_needs_three_vertices():
+    with pytest.raises(ValueError):
+        ImageQdrantIndexer.build_filter(polygon=[(55.7, 37.5), (55.8, 37.6)])
@@ -0,0 +1,46 @@
+"""LRUCache: вытеснение, счётчики, TTL и сохранение между перезапусками."""
+import numpy as np
+
+from src.retrieval.utils import LRUCache
+
+
+def test_evicts_least_recently_used():
+    cache = LRUCache(max_size=2)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    assert cache.get("a") == 1
+    cache.put("c", 3)
+    assert "b" not in cache
+    assert cache.get("a") == 1 and cache.get("c") == 3
+    assert cache.stats()["evictions"] == 1
+
+
+def test_counts_hits_and_misses():
+    cache = LRUCache(max_size=4)
+    cache.put("a", 1)
+    cache.get("a")
+    cache.get("missing", default=0)
+    cache.get("missing", record=False)
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"], stats["hit_rate"]) == (1, 1, 0.5)
+
+
+def test_ttl_expires(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr("src.retrieval.utils.cache.time.time", lambda: now[0])
+    cache = LRUCache(max_size=4, ttl=10)
+    cache.put("a", 1)
+    now[0] += 5
+    assert cache.get("a") == 1
+    now[0] += 10
+    assert cache.get("a") is None
+    assert cache.stats()["expirations"] == 1
+
+
+def test_persists_between_instances(tmp_path):
+    path = str(tmp_path / "cache.pkl")
+    cache = LRUCache(max_size=4, persist_path=path)
+    cache.put(("model", "river"), np.ones(3, dtype=np.float32))
+    cache.save()
+    restored = LRUCache(max_size=4, persist_path=path)
+    np.testing.assert_array_equal(restored.get(("model", "river")), np.ones(3, dtype=np.float32))
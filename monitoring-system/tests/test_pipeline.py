@@ -0,0 +1,117 @@
+"""IngestionPipeline: учёт завершённых директорий — контрольных точек прерванной индексации."""
+from concurrent.futures import Future
+
+import numpy as np
+
+from src.retrieval.processing import FolderScanner, ImageBatchProcessor, IngestionPipeline
+
+
+class ListedScanner(FolderScanner):
+    """Обход заранее заданного дерева {директория: изображения} без очистки."""
+    def __init__(self, tree: dict):
+        super().__init__()
+        self.tree = tree
+
+    def iter_folder(self, folder_path, resize=1024, skip_dirs=None):
+        for directory, images in self.tree.items():
+            if directory not in (skip_dirs or set()):
+                yield directory, list(images)
+
+
+class PassThroughProcessor(ImageBatchProcessor):
+    """Точки — просто источники; fail_sources роняют стадию fetch их батча."""
+    def __init__(self, fail_sources=()):
+        super().__init__(embedder=None)
+        self.fail_sources = set(fail_sources)
+
+    def fetch_batch(self, image_paths):
+        if self.fail_sources & set(image_paths):
+            raise OSError("fetch failed")
+        return list(image_paths), []
+
+    def build_points(self, original_paths, local_paths, embeddings, fingerprints=None):
+        return list(original_paths)
+
+    def cleanup_downloads(self, downloaded_files):
+        pass
+
+
+class Embeddings:
+    def __init__(self, count):
+        self.count = count
+
+    def cpu(self):
+        return self
+
+    def numpy(self):
+        return np.zeros((self.count, 4), dtype=np.float32)
+
+
+class FakeEmbedder:
+    def preprocess_images(self, paths):
+        return paths
+
+    def encode_preprocessed(self, pixels):
+        return Embeddings(len(pixels))
+
+
+class DeferredUploads:
+    """upsert_fn, чьи запросы завершаются только по команде теста."""
+    def __init__(self):
+        self.batches = []
+
+    def __call__(self, points):
+        future = Future()
+        self.batches.append((list(points), future))
+        return [future]
+
+    def finish(self, idx, error=None):
+        points, future = self.batches[idx]
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(len(points))
+
+
+def run(tree, upsert_fn, processor=None, filter_fn=None):
+    done = []
+    pipeline = IngestionPipeline(FakeEmbedder(), ListedScanner(tree), processor or PassThroughProcessor(),
+                                 upsert_fn=upsert_fn, batch_size=2, filter_fn=filter_fn)
+    stats = pipeline.run("root", on_directory_done=done.append)
+    return stats, done
+
+
+def test_directory_completes_when_all_its_batches_are_uploaded():
+    uploads = DeferredUploads()
+    stats, done = run({"d0": ["d0/0.jpg", "d0/1.jpg", "d0/2.jpg"], "d1": ["d1/0.jpg"]}, uploads)
+    assert stats["images_done"] == 4 and stats["batches_done"] == 2
+    # Точки отправлены, но не подтверждены — директории ещё не завершены
+    assert done == []
+    uploads.finish(0)
+    assert done == []
+    uploads.finish(1)
+    assert sorted(done) == ["d0", "d1"]
+
+
+def test_failed_upload_keeps_directory_unfinished():
+    uploads = DeferredUploads()
+    _, done = run({"d0": ["d0/0.jpg", "d0/1.jpg"], "d1": ["d1/0.jpg", "d1/1.jpg"]}, uploads)
+    uploads.finish(0)
+    uploads.finish(1, error=ConnectionError("qdrant unavailable"))
+    assert done == ["d0"]
+
+
+def test_failed_stage_keeps_directory_unfinished():
+    stats, done = run({"d0": ["d0/0.jpg", "d0/1.jpg"], "d1": ["d1/0.jpg", "d1/1.jpg"]}, lambda points: None,
+                      processor=PassThroughProcessor(fail_sources={"d1/0.jpg"}))
+    assert stats["batches_failed"] == 1
+    assert done == ["d0"]
+
+
+def test_fully_skipped_directory_completes_immediately():
+    def filter_fn(listed):
+        return [source for source in listed if not source.startswith("d0/")]
+
+    stats, done = run({"d0": ["d0/0.jpg"], "d1": ["d1/0.jpg"]}, lambda points: None, filter_fn=filter_fn)
+    assert stats["images_skipped"] == 1
+    assert sorted(done) == ["d0", "d1"]
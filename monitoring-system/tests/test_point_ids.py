@@ -0,0 +1,32 @@
+"""Детерминированные идентификаторы точек и отпечатки файлов."""
+import os
+import uuid
+
+from src.retrieval.utils import make_point_id, file_fingerprint
+
+
+def test_point_id_is_a_fixed_uuid5_of_the_source():
+    # Значения зафиксированы: они не зависят от процесса (в отличие от hash()), а смена пространства
+    # имён или схемы перевыпустила бы все точки коллекции
+    assert make_point_id("s3://bucket/flight/0001.jpg") == "af1d5ab8-6e86-545a-9fe3-baf2db50f0f6"
+    assert make_point_id("/data/flight/0001.jpg") == "2841ed29-30cc-583f-ac9f-25a4bc4ece2e"
+    assert uuid.UUID(make_point_id("x")).version == 5
+
+
+def test_point_ids_differ_per_source():
+    assert make_point_id("s3://bucket/a.jpg") != make_point_id("s3://bucket/b.jpg")
+
+
+def test_file_fingerprint_tracks_size_and_mtime(tmp_path):
+    path = tmp_path / "frame.jpg"
+    path.write_bytes(b"\xff\xd8" + b"\0" * 10)
+    first = file_fingerprint(str(path))
+    assert first == file_fingerprint(str(path))
+    os.utime(path, ns=(0, 1_000_000_000))
+    assert file_fingerprint(str(path)) != first
+    path.write_bytes(b"\xff\xd8")
+    assert file_fingerprint(str(path)).startswith("2-")
+
+
+def test_file_fingerprint_of_missing_file_is_none(tmp_path):
+    assert file_fingerprint(str(tmp_path / "missing.jpg")) is None
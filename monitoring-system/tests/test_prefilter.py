@@ -0,0 +1,41 @@
+"""PairPrefilter: очевидные пары решаются без мэтчера."""
+import cv2
+import numpy as np
+
+from src.duplicate.prefilter import PairPrefilter, haversine_m
+
+
+def signature(phash=None, lat=None, lon=None, altitude=None) -> dict:
+    return {"phash": phash, "lat": lat, "lon": lon, "altitude": altitude}
+
+
+def test_far_apart_frames_are_disjoint():
+    prefilter = PairPrefilter(gps_disjoint_distance_m=1000)
+    moscow, spb = signature(lat=55.751, lon=37.618), signature(lat=59.934, lon=30.306)
+    assert prefilter.decide(moscow, spb) == 0.0
+
+
+def test_high_altitude_widens_disjoint_distance():
+    prefilter = PairPrefilter(gps_disjoint_distance_m=1000)
+    first = signature(lat=55.751, lon=37.618, altitude=1000)
+    second = signature(lat=55.751, lon=37.648, altitude=1000)
+    assert 1000 < haversine_m(55.751, 37.618, 55.751, 37.648) < 3000
+    assert prefilter.decide(first, second) is None
+
+
+def test_near_identical_hashes_are_duplicates():
+    prefilter = PairPrefilter(duplicate_hash_distance=4)
+    assert prefilter.decide(signature(phash=0b101100), signature(phash=0b101101)) == 100.0
+    assert prefilter.decide(signature(phash=0), signature(phash=0b11111)) is None
+
+
+def test_signature_from_image(tmp_path):
+    rng = np.random.default_rng(0)
+    image = cv2.GaussianBlur(rng.integers(0, 255, (240, 320), dtype=np.uint8), (15, 15), 0)
+    first, second, other = (str(tmp_path / name) for name in ("a.png", "b.png", "c.png"))
+    cv2.imwrite(first, image)
+    cv2.imwrite(second, image)
+    cv2.imwrite(other, np.ascontiguousarray(image[:, ::-1].T))
+    prefilter = PairPrefilter()
+    assert prefilter.decide(prefilter.signature(first), prefilter.signature(second)) == 100.0
+    assert prefilter.decide(prefilter.signature(first), prefilter.signature(other)) is None
@@ -0,0 +1,74 @@
+"""SpillCache: дисковый кэш потоковой индексации S3, ограниченный по размеру."""
+import os
+
+from src.retrieval.utils import SpillCache
+
+
+def write(cache: SpillCache, path: str, size: int) -> str:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(b"\0" * size)
+    cache.register(path)
+    return path
+
+
+def test_register_evicts_oldest(tmp_path):
+    cache = SpillCache(str(tmp_path / "spill"), max_bytes=100)
+    old = write(cache, cache.local_path("bucket", "a/1.jpg"), 60)
+    new = write(cache, cache.local_path("bucket", "a/2.jpg"), 60)
+    assert not os.path.exists(old) and cache.get(old) is None
+    assert cache.get(new) == new
+    assert cache.stats()["evictions"] == 1
+
+
+def test_get_refreshes_recency(tmp_path):
+    cache = SpillCache(str(tmp_path / "spill"), max_bytes=100)
+    first = write(cache, cache.local_path("bucket", "a/1.jpg"), 40)
+    second = write(cache, cache.local_path("bucket", "a/2.jpg"), 40)
+    assert cache.get(first) == first
+    write(cache, cache.local_path("bucket", "a/3.jpg"), 40)
+    assert os.path.exists(first) and not os.path.exists(second)
+
+
+def test_discard_releases_space(tmp_path):
+    cache = SpillCache(str(tmp_path / "spill"), max_bytes=100)
+    path = write(cache, cache.local_path("bucket", "a/1.jpg"), 50)
+    cache.discard([path])
+    assert not os.path.exists(path)
+    assert cache.stats()["bytes"] == 0
+
+
+def test_root_is_cleared_on_start(tmp_path):
+    root = tmp_path / "spill"
+    stale = root / "bucket" / "stale.jpg"
+    stale.parent.mkdir(parents=True)
+    stale.write_bytes(b"\0")
+    SpillCache(str(root), max_bytes=100)
+    assert not stale.exists()
+
+
+def test_pinned_directory_survives_until_unpin(tmp_path):
+    cache = SpillCache(str(tmp_path / "spill"), max_bytes=100)
+    old = write(cache, cache.local_path("bucket", "old/1.jpg"), 40)
+    directory = cache.local_path("bucket", "flight")
+    files = {os.path.join(directory, f"{i}.jpg"): 30 for i in range(3)}
+    # Место резервируется до скачивания: вытесняется незакреплённый файл, а не файлы директории
+    assert cache.reserve(directory, files)
+    assert not os.path.exists(old)
+    for path, size in files.items():
+        write(cache, path, size)
+    assert all(os.path.exists(path) for path in files)
+    # Пока директория закреплена, для следующей места нет
+    assert not cache.reserve(cache.local_path("bucket", "next"), {cache.local_path("bucket", "next/1.jpg"): 20})
+    cache.unpin(directory)
+    assert cache.reserve(cache.local_path("bucket", "next"), {cache.local_path("bucket", "next/1.jpg"): 20})
+    assert cache.stats()["rejections"] == 1
+
+
+def test_rejects_directory_larger_than_cache(tmp_path):
+    cache = SpillCache(str(tmp_path / "spill"), max_bytes=100)
+    kept = write(cache, cache.local_path("bucket", "a/1.jpg"), 10)
+    directory = cache.local_path("bucket", "huge")
+    assert not cache.reserve(directory, {os.path.join(directory, "1.jpg"): 80, os.path.join(directory, "2.jpg"): 80})
+    assert os.path.exists(kept)
+    assert cache.stats()["reserved_bytes"] == 0
@@ -0,0 +1,53 @@
+"""QdrantUploader: барьер согласованности, повторы и передача ошибок."""
+import threading
+
+import pytest
+
+from src.retrieval import QdrantUploader
+
+
+class RecordingClient:
+    """Клиент Qdrant, запоминающий вызовы upsert; первые fail_times вызовов завершаются ошибкой."""
+    def __init__(self, fail_times: int = 0):
+        self.calls = []
+        self.fail_times = fail_times
+        self._lock = threading.Lock()
+
+    def upsert(self, collection_name, points, wait):
+        with self._lock:
+            self.calls.append((len(points), wait))
+            if self.fail_times:
+                self.fail_times -= 1
+                raise ConnectionError("qdrant unavailable")
+
+
+def test_flush_resends_last_chunk_with_wait():
+    client = RecordingClient()
+    uploader = QdrantUploader(client, "test", chunk_size=2, max_in_flight=2)
+    futures = uploader.submit(list(range(5)))
+    assert len(futures) == 3
+    stats = uploader.close()
+    assert stats["points_sent"] == 5 and stats["requests"] == 3
+    assert sorted(client.calls[:3]) == [(1, False), (2, False), (2, False)]
+    # Барьер: последний чанк повторно с wait=True, после ответа видны все точки
+    assert client.calls[-1] == (1, True)
+
+
+def test_retries_transient_errors():
+    client = RecordingClient(fail_times=2)
+    uploader = QdrantUploader(client, "test", chunk_size=10, max_retries=3, backoff=0)
+    assert [future.result() for future in uploader.submit([1, 2, 3])] == [3]
+    stats = uploader.close()
+    assert (stats["retries"], stats["points_failed"]) == (2, 0)
+
+
+def test_failure_after_retries_propagates_to_future():
+    client = RecordingClient(fail_times=10)
+    uploader = QdrantUploader(client, "test", chunk_size=10, max_retries=1, backoff=0)
+    future, = uploader.submit([1, 2, 3])
+    with pytest.raises(ConnectionError):
+        future.result()
+    stats = uploader.close()
+    assert (stats["points_sent"], stats["points_failed"]) == (0, 3)
+    # Без загруженных точек барьер не отправляется
+    assert all(not wait for _, wait in client.calls)